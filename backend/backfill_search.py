@@ -0,0 +1,13 @@
+"""
+Builds the /search index for reports generated before it existed.
+Usage: python backfill_search.py [output_dir]
+"""
+import sys
+from services import search
+
+output_dir = sys.argv[1] if len(sys.argv) > 1 else "../output"
+
+# Only the search tables are created (by backfill); history.init_history is not
+# called, since it migrates and renames a legacy history.json
+count = search.backfill(output_dir)
+print(f"Indexed {count} reports from {output_dir}")
@@ -0,0 +1,673 @@
+"""
+Offline end-to-end benchmark. Runs POST /analyze against local stand-ins for
+YouTube (yt_dlp) and Gemini (google.generativeai) with configurable latency and
+payload sizes, at several concurrency levels and video lengths, and reports
+p50/p95 latency, jobs per minute, peak RSS and per-stage / per-format times.
+Results are saved as JSON so runs can be compared across commits.
+
+Usage:
+    python benchmark.py [--concurrency 1,4] [--minutes 10,60] [--jobs 8]
+                        [--output results.json] [--compare previous.json]
+
+Nothing touches the network. ffmpeg is still required: the real transcode,
+probe and split steps run on generated audio. Requests go through httpx's
+ASGITransport, so httpx must be installed (it is in requirements.txt).
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import types
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import itertools
+import subprocess
+import zlib
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, parse_qs
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmark_results")
+RESULTS_VERSION = 1
+
+POLL_INTERVAL = 0.05
+METRICS_PREFIX = "videoinsight_"
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+# Generated source audio: opus at a fixed bitrate, which the speech profile remuxes
+SOURCE_ABR = 48
+SEGMENT_SECONDS = 60
+# Characters per streamed Gemini chunk, and the usual ~4 characters per token
+STREAM_CHUNK_CHARS = 400
+CHARS_PER_TOKEN = 4
+# Gemini bills audio at 32 tokens per second
+AUDIO_TOKENS_PER_SECOND = 32
+
+WORDS = (
+    "análisis datos modelo proceso sistema función resultado ejemplo método valor "
+    "estructura información contenido práctica tiempo concepto relación problema "
+    "solución desarrollo aplicación diseño código prueba rendimiento memoria red "
+    "usuario servidor cliente archivo formato sección resumen guía capítulo lección"
+).split()
+
+# Stand-in settings, filled in by run_scenario before the app is imported
+_fake = {}
+
+
+# --- yt_dlp stand-in ---------------------------------------------------------
+
+class FakeDownloadError(Exception):
+    pass
+
+
+def _parse_bytes(value: str):
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([kmg]?)", value.strip().lower())
+    if not match:
+        return None
+    return int(float(match.group(1)) * {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}[match.group(2)])
+
+
+def video_id(minutes: int, index: int) -> str:
+    """11-character video IDs that encode the video length for the stand-ins."""
+    return f"b{minutes:04d}{index:06d}"
+
+
+def _video_minutes(vid: str) -> int:
+    return int(vid[1:5])
+
+
+def _source_path(minutes: int) -> str:
+    return os.path.join(_fake["sources_dir"], f"{minutes}.webm")
+
+
+class FakeYoutubeDL:
+    """Serves generated audio for benchmark video IDs at a simulated bandwidth."""
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=True):
+        time.sleep(_fake["metadata_seconds"])
+        vid = parse_qs(urlparse(url).query).get("v", [url])[0]
+        minutes = _video_minutes(vid)
+        info = {
+            "id": vid,
+            "title": f"Benchmark video {vid}",
+            "duration": minutes * 60,
+            "upload_date": "20240101",
+            "uploader": "Benchmark",
+            "thumbnail": "",
+            "description": "",
+            "webpage_url": url,
+            "availability": "public",
+            "live_status": "not_live",
+            "formats": [{
+                "format_id": "251", "ext": "webm", "acodec": "opus", "vcodec": "none",
+                "abr": SOURCE_ABR, "protocol": "https", "filesize": os.path.getsize(_source_path(minutes)),
+            }],
+        }
+        return self.process_ie_result(info, download) if download else info
+
+    def process_ie_result(self, info, download=True):
+        fmt = info["formats"][0]
+        info = dict(info, format_id=fmt["format_id"], ext=fmt["ext"], acodec=fmt["acodec"], abr=fmt["abr"])
+        if download:
+            path = self.prepare_filename(info)
+            self._download(_source_path(_video_minutes(info["id"])), path)
+            info["requested_downloads"] = [dict(fmt, filepath=path)]
+        return info
+
+    def prepare_filename(self, info):
+        path = self.params.get("outtmpl", "%(id)s.%(ext)s")
+        for key in ("id", "format_id", "ext"):
+            path = path.replace(f"%({key})s", str(info[key]))
+        return path
+
+    def _download(self, source, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        total = os.path.getsize(source)
+        bytes_per_second = _fake["download_mbps"] * 125000
+        hooks = self.params.get("progress_hooks", [])
+        done = 0
+        with open(source, "rb") as src, open(path + ".part", "wb") as dst:
+            while True:
+                block = src.read(1024 * 1024)
+                if not block:
+                    break
+                dst.write(block)
+                done += len(block)
+                time.sleep(len(block) / bytes_per_second)
+                for hook in hooks:
+                    hook({"status": "downloading", "downloaded_bytes": done, "total_bytes": total})
+        os.replace(path + ".part", path)
+        for hook in hooks:
+            hook({"status": "finished", "downloaded_bytes": total, "total_bytes": total, "filename": path})
+
+
+# --- google.generativeai stand-in --------------------------------------------
+
+class FakeFile:
+    def __init__(self, name: str, size: int, ready_at: float):
+        self.name = name
+        self.size_bytes = size
+        self.mime_type = "audio/ogg"
+        self.uri = f"https://benchmark.invalid/{name}"
+        self.create_time = datetime.now(timezone.utc)
+        self.expiration_time = self.create_time + timedelta(hours=48)
+        self.seconds = size * 8 / (SOURCE_ABR * 1000)
+        self._ready_at = ready_at
+
+    @property
+    def state(self):
+        return types.SimpleNamespace(name="ACTIVE" if time.time() >= self._ready_at else "PROCESSING")
+
+
+class FakeResponse:
+    def __init__(self, text: str, usage=None):
+        self.text = text
+        self.usage_metadata = usage
+        self.prompt_feedback = None
+
+
+class ResourceExhausted(Exception):
+    """Mimics google.api_core's 429 error."""
+    code = 429
+
+
+_files = {}
+_files_lock = threading.Lock()
+_file_ids = itertools.count(1)
+_generate_times = []
+
+
+def _upload_file(path, **kwargs):
+    size = os.path.getsize(path)
+    time.sleep(size / (_fake["upload_mbps"] * 125000))
+    processing = _fake["processing_seconds"] + size / (_fake["processing_mbps"] * 125000)
+    audio_file = FakeFile(f"files/benchmark-{next(_file_ids)}", size, time.time() + processing)
+    with _files_lock:
+        _files[audio_file.name] = audio_file
+    return audio_file
+
+
+def _get_file(name):
+    with _files_lock:
+        if name not in _files:
+            raise Exception(f"404 File {name} not found")
+        return _files[name]
+
+
+def _delete_file(name, **kwargs):
+    with _files_lock:
+        _files.pop(name, None)
+
+
+def _list_files(**kwargs):
+    with _files_lock:
+        return list(_files.values())
+
+
+def _text(rng: random.Random, words: int, markdown: bool = False) -> str:
+    """Deterministic filler text; Markdown adds headings and bullets like real reports."""
+    parts = []
+    written = 0
+    while written < words:
+        length = min(rng.randint(40, 90), words - written)
+        paragraph = " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+        if markdown and len(parts) % 4 == 0:
+            parts.append(f"## {rng.choice(WORDS).capitalize()} {len(parts) // 4 + 1}")
+        if markdown and len(parts) % 3 == 2:
+            paragraph = "\n".join(f"- **{rng.choice(WORDS)}**: {' '.join(rng.choice(WORDS) for _ in range(8))}" for _ in range(4))
+        parts.append(paragraph)
+        written += length
+    return "\n\n".join(parts)
+
+
+def _fake_generation(contents: list, generation_config: dict = None):
+    """
+    Returns (response text, prompt tokens). Transcription and notes sizes follow
+    the audio length; summary and guide sizes are fixed.
+    """
+    media = [part for part in contents if isinstance(part, FakeFile)]
+    prompt = "".join(part for part in contents if isinstance(part, str))
+    audio_seconds = sum(f.seconds for f in media)
+    prompt_tokens = int(audio_seconds * AUDIO_TOKENS_PER_SECOND + len(prompt) / CHARS_PER_TOKEN)
+    rng = random.Random(zlib.crc32((prompt[:500] + "".join(f.name for f in media)).encode()))
+
+    schema = (generation_config or {}).get("response_schema")
+    if not schema:
+        return _text(rng, _fake["summary_words"], markdown=True), prompt_tokens
+
+    spoken_words = int(audio_seconds / 60 * _fake["words_per_minute"]) or _fake["summary_words"]
+    fields = {}
+    for name in schema["properties"]:
+        if name == "keywords":
+            fields[name] = rng.sample(WORDS, 8)
+        elif name.startswith("transcription"):
+            fields[name] = _text(rng, spoken_words)
+        elif name == "notes":
+            fields[name] = _text(rng, spoken_words // 4, markdown=True)
+        elif name == "guide":
+            fields[name] = _text(rng, _fake["guide_words"], markdown=True)
+        else:
+            fields[name] = _text(rng, _fake["summary_words"], markdown=True)
+    return json.dumps(fields, ensure_ascii=False), prompt_tokens
+
+
+def _check_quota():
+    """Enforces the simulated requests-per-minute quota like the API does: 429 with a retry hint."""
+    limit = _fake.get("quota_rpm")
+    if not limit:
+        return
+    with _files_lock:
+        now = time.time()
+        _generate_times[:] = [t for t in _generate_times if t > now - 60]
+        if len(_generate_times) >= limit:
+            retry = _generate_times[0] + 60 - now
+            raise ResourceExhausted(f"429 Resource has been exhausted (e.g. check quota). Please retry in {retry:.1f}s.")
+        _generate_times.append(now)
+
+
+class FakeGenerativeModel:
+    """Answers with filler of realistic size after a first-token delay, at a fixed token rate."""
+
+    def __init__(self, model_name=None, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        _check_quota()
+        text, prompt_tokens = _fake_generation(list(contents), generation_config)
+        usage = types.SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=len(text) // CHARS_PER_TOKEN,
+            total_token_count=prompt_tokens + len(text) // CHARS_PER_TOKEN,
+        )
+        if stream:
+            return self._stream(text, usage)
+        time.sleep(_fake["first_token_seconds"] + len(text) / CHARS_PER_TOKEN / _fake["tokens_per_second"])
+        return FakeResponse(text, usage)
+
+    def _stream(self, text, usage):
+        time.sleep(_fake["first_token_seconds"])
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+        for i, chunk in enumerate(chunks):
+            time.sleep(len(chunk) / CHARS_PER_TOKEN / _fake["tokens_per_second"])
+            yield FakeResponse(chunk, usage if i == len(chunks) - 1 else None)
+
+
+def install_fakes(settings: dict):
+    """Registers the stand-ins as yt_dlp and google.generativeai; call before importing main."""
+    _fake.update(settings)
+
+    yt_dlp = types.ModuleType("yt_dlp")
+    yt_dlp.utils = types.ModuleType("yt_dlp.utils")
+    yt_dlp.utils.DownloadError = FakeDownloadError
+    yt_dlp.utils.parse_bytes = _parse_bytes
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+    sys.modules["yt_dlp"] = yt_dlp
+    sys.modules["yt_dlp.utils"] = yt_dlp.utils
+
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda **kwargs: None
+    genai.upload_file = _upload_file
+    genai.get_file = _get_file
+    genai.delete_file = _delete_file
+    genai.list_files = _list_files
+    genai.GenerativeModel = FakeGenerativeModel
+    try:
+        import google
+    except ImportError:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+    google.generativeai = genai
+    sys.modules["google.generativeai"] = genai
+
+
+# --- one scenario (runs in its own process) ----------------------------------
+
+def percentile(values: list, q: float):
+    """Nearest-rank percentile, or None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def parse_metrics(text: str) -> dict:
+    """Prometheus text -> {metric name (unprefixed): [(labels, value)]}."""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, value = line.rsplit(" ", 1)
+        name, _, labels = series.partition("{")
+        samples.setdefault(name[len(METRICS_PREFIX):], []).append((dict(re.findall(r'(\w+)="([^"]*)"', labels)), float(value)))
+    return samples
+
+
+def _histogram_summary(samples: dict, name: str, label: str, where: dict = None) -> dict:
+    """Mean, total and count per `label` value of a histogram, from its _sum and _count series."""
+    summary = {}
+    for suffix in ("sum", "count"):
+        for labels, value in samples.get(f"{name}_{suffix}", []):
+            if where and any(labels.get(k) != v for k, v in where.items()):
+                continue
+            entry = summary.setdefault(labels.get(label), {"total": 0.0, "count": 0})
+            entry["total" if suffix == "sum" else "count"] += value
+    for entry in summary.values():
+        entry["count"] = int(entry["count"])
+        entry["mean"] = round(entry["total"] / entry["count"], 3) if entry["count"] else None
+        entry["total"] = round(entry["total"], 3)
+    return summary
+
+
+async def _run_one(client, vid: str, scenario: dict) -> dict:
+    payload = {"url": f"https://www.youtube.com/watch?v={vid}", "options": scenario["options"], "mode": scenario["mode"]}
+    started = time.perf_counter()
+    while True:
+        response = await client.post("/analyze", json=payload)
+        if response.status_code != 503:
+            break
+        # Queue full: back off like a client would
+        await asyncio.sleep(POLL_INTERVAL * 4)
+    response.raise_for_status()
+    job = response.json()
+    while job["status"] not in FINISHED_STATUSES:
+        await asyncio.sleep(POLL_INTERVAL)
+        job = (await client.get(f"/jobs/{job['id']}")).json()
+    return {"video_id": vid, "status": job["status"], "seconds": time.perf_counter() - started, "error": job.get("error")}
+
+
+async def _drive(app, scenario: dict) -> dict:
+    import httpx
+
+    pending = [video_id(scenario["minutes"], i) for i in range(scenario["jobs"])]
+    runs = []
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            async def client_loop():
+                while pending:
+                    runs.append(await _run_one(client, pending.pop(0), scenario))
+
+            started = time.perf_counter()
+            await asyncio.gather(*[client_loop() for _ in range(scenario["concurrency"])])
+            wall_seconds = time.perf_counter() - started
+            metrics_text = (await client.get("/metrics")).text
+    return {"runs": runs, "wall_seconds": wall_seconds, "metrics": metrics_text}
+
+
+def run_scenario(scenario: dict) -> dict:
+    """
+    Runs one (concurrency, minutes) scenario against a fresh app in the current
+    process, whose working directory is a scratch copy of the backend layout.
+    """
+    install_fakes(scenario["fake"])
+    import multiprocessing
+    import main
+
+    outcome = asyncio.run(_drive(main.app, scenario))
+    # Reap the render pool so its peak RSS is counted under RUSAGE_CHILDREN
+    multiprocessing.active_children()
+
+    runs = outcome["runs"]
+    latencies = [run["seconds"] for run in runs if run["status"] == "completed"]
+    samples = parse_metrics(outcome["metrics"])
+    counters = {
+        name: {",".join(f"{k}={v}" for k, v in sorted(labels.items())) or "total": value for labels, value in samples.get(name, [])}
+        for name in ("bytes_downloaded_total", "bytes_uploaded_total", "gemini_tokens_total", "gemini_requests_total", "stage_errors_total")
+    }
+    spans = _histogram_summary(samples, "span_seconds", "span")
+    spans.pop("render", None)
+
+    return {
+        "concurrency": scenario["concurrency"],
+        "minutes": scenario["minutes"],
+        "jobs": len(runs),
+        "completed": len(latencies),
+        "failed": len(runs) - len(latencies),
+        "wall_seconds": round(outcome["wall_seconds"], 3),
+        "jobs_per_minute": round(len(latencies) * 60 / outcome["wall_seconds"], 2) if outcome["wall_seconds"] else None,
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 0.50), 3) if latencies else None,
+            "p95": round(percentile(latencies, 0.95), 3) if latencies else None,
+            "max": round(max(latencies), 3) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        },
+        # ru_maxrss is in KiB on Linux; children is the largest single child (ffmpeg or a renderer)
+        "peak_rss_mb": {
+            "server": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        },
+        "stage_seconds": _histogram_summary(samples, "stage_seconds", "stage"),
+        "span_seconds": spans,
+        "render_seconds": _histogram_summary(samples, "span_seconds", "format", where={"span": "render"}),
+        "counters": counters,
+        "errors": sorted({run["error"] for run in runs if run["error"]})[:5],
+    }
+
+
+# --- orchestration -----------------------------------------------------------
+
+def make_source(minutes: int, sources_dir: str) -> str:
+    """Generates `minutes` of opus audio by looping a one-minute encoded tone (fast, no re-encode)."""
+    path = os.path.join(sources_dir, f"{minutes}.webm")
+    if os.path.exists(path):
+        return path
+    segment = os.path.join(sources_dir, "segment.webm")
+    if not os.path.exists(segment):
+        subprocess.run([
+            "ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi",
+            "-i", f"sine=frequency=440:sample_rate=48000:duration={SEGMENT_SECONDS}",
+            "-ac", "1", "-c:a", "libopus", "-b:a", f"{SOURCE_ABR}k", "-vbr", "off", segment,
+        ], check=True)
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error", "-stream_loop", str(max(minutes - 1, 0)),
+        "-i", segment, "-c", "copy", path,
+    ], check=True)
+    return path
+
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _scenario_env(args) -> dict:
+    env = dict(os.environ)
+    for key in ("YOUTUBE_COOKIES", "YOUTUBE_PO_TOKEN"):
+        env.pop(key, None)
+    env.update({
+        "GOOGLE_API_KEY": "benchmark",
+        "LOG_LEVEL": args.log_level,
+        "LOG_FORMAT": "text",
+        "DOCUMENT_RENDER_MODE": args.render_mode,
+    })
+    return env
+
+
+def run_benchmark(args) -> dict:
+    root = tempfile.mkdtemp(prefix="videoinsight_bench_")
+    sources_dir = os.path.join(root, "sources")
+    os.makedirs(sources_dir)
+    fake = {
+        "sources_dir": sources_dir,
+        "metadata_seconds": args.metadata_latency,
+        "download_mbps": args.download_mbps,
+        "upload_mbps": args.upload_mbps,
+        "processing_seconds": args.processing_latency,
+        "processing_mbps": args.processing_mbps,
+        "first_token_seconds": args.first_token_latency,
+        "tokens_per_second": args.tokens_per_second,
+        "words_per_minute": args.words_per_minute,
+        "summary_words": args.summary_words,
+        "guide_words": args.guide_words,
+        "quota_rpm": args.quota_rpm,
+    }
+    scenarios = []
+    try:
+        for minutes in args.minutes:
+            make_source(minutes, sources_dir)
+        for minutes in args.minutes:
+            for concurrency in args.concurrency:
+                # Each scenario gets a fresh process and state dir (history, cache, outputs)
+                work_dir = os.path.join(root, f"c{concurrency}_m{minutes}", "backend")
+                os.makedirs(os.path.join(os.path.dirname(work_dir), "output"))
+                os.makedirs(work_dir)
+                scenario = {
+                    "concurrency": concurrency, "minutes": minutes,
+                    "jobs": args.jobs or max(2 * concurrency, 4),
+                    "options": args.options, "mode": args.mode, "fake": fake,
+                }
+                scenario_file = os.path.join(work_dir, "scenario.json")
+                with open(scenario_file, "w") as f:
+                    json.dump(scenario, f)
+                print(f"Running {scenario['jobs']} jobs of {minutes} min at concurrency {concurrency}...", flush=True)
+                proc = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--scenario", scenario_file],
+                    cwd=work_dir, env=_scenario_env(args), capture_output=True, text=True,
+                )
+                if proc.returncode != 0:
+                    raise RuntimeError(f"Scenario c{concurrency}/m{minutes} crashed:\n{(proc.stdout + proc.stderr)[-3000:]}")
+                with open(os.path.join(work_dir, "result.json")) as f:
+                    scenarios.append(json.load(f))
+    finally:
+        if args.keep:
+            print(f"Kept scratch files in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "version": RESULTS_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": {"commit": _git("rev-parse", "HEAD"), "dirty": bool(_git("status", "--porcelain", "--", "."))},
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {
+            "options": args.options, "mode": args.mode, "render_mode": args.render_mode,
+            "jobs": args.jobs, "fake": {k: v for k, v in fake.items() if k != "sources_dir"},
+        },
+        "scenarios": scenarios,
+    }
+
+
+def print_report(results: dict):
+    print(f"\n{'conc':>4} {'min':>4} {'jobs':>5} {'ok':>4} {'p50 s':>8} {'p95 s':>8} {'jobs/min':>9} {'rss MB':>7}")
+    for s in results["scenarios"]:
+        latency = s["latency_seconds"]
+        print(
+            f"{s['concurrency']:>4} {s['minutes']:>4} {s['jobs']:>5} {s['completed']:>4} "
+            f"{latency['p50'] or 0:>8.2f} {latency['p95'] or 0:>8.2f} {s['jobs_per_minute'] or 0:>9.2f} "
+            f"{s['peak_rss_mb']['server']:>7.1f}"
+        )
+        stages = ", ".join(f"{name} {v['mean']}s" for name, v in s["stage_seconds"].items())
+        renders = ", ".join(f"{fmt} {v['mean']}s" for fmt, v in s["render_seconds"].items())
+        print(f"{'':>10}stages: {stages}")
+        if renders:
+            print(f"{'':>10}render: {renders}")
+        for error in s["errors"]:
+            print(f"{'':>10}error: {error}")
+
+
+def compare(results: dict, baseline: dict, max_regression: float = None) -> bool:
+    """
+    Prints p50/p95/throughput changes against a previous results file. Returns
+    False if p95 or jobs/min regressed by more than `max_regression` percent.
+    """
+    def change(new, old):
+        return (new - old) * 100 / old if new is not None and old else None
+
+    previous = {(s["concurrency"], s["minutes"]): s for s in baseline["scenarios"]}
+    ok = True
+    print(f"\nCompared with {(baseline.get('git') or {}).get('commit') or 'baseline'} ({baseline.get('created_at')}):")
+    for s in results["scenarios"]:
+        old = previous.get((s["concurrency"], s["minutes"]))
+        if old is None:
+            continue
+        p50 = change(s["latency_seconds"]["p50"], old["latency_seconds"]["p50"])
+        p95 = change(s["latency_seconds"]["p95"], old["latency_seconds"]["p95"])
+        throughput = change(s["jobs_per_minute"], old["jobs_per_minute"])
+        fmt = lambda v: "n/a" if v is None else f"{v:+.1f}%"
+        print(f"  c{s['concurrency']}/m{s['minutes']}: p50 {fmt(p50)}, p95 {fmt(p95)}, jobs/min {fmt(throughput)}")
+        if max_regression is not None and ((p95 or 0) > max_regression or (throughput or 0) < -max_regression):
+            ok = False
+    return ok
+
+
+def _int_list(value: str) -> list:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the analysis pipeline.")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4], help="Concurrent clients, comma-separated (default 1,4)")
+    parser.add_argument("--minutes", type=_int_list, default=[10, 60], help="Video lengths in minutes, comma-separated (default 10,60)")
+    parser.add_argument("--jobs", type=int, default=None, help="Jobs per scenario (default 2x concurrency, at least 4)")
+    parser.add_argument("--options", type=lambda v: v.split(","), default=["summary", "guide", "transcription_orig"])
+    parser.add_argument("--mode", default="auto")
+    parser.add_argument("--render-mode", choices=("eager", "lazy"), default="eager")
+    parser.add_argument("--metadata-latency", type=float, default=0.2, help="Seconds per yt-dlp metadata request")
+    parser.add_argument("--download-mbps", type=float, default=80, help="Simulated YouTube bandwidth (Mbit/s)")
+    parser.add_argument("--upload-mbps", type=float, default=80, help="Simulated Gemini upload bandwidth (Mbit/s)")
+    parser.add_argument("--processing-latency", type=float, default=1.0, help="Fixed Gemini file processing seconds")
+    parser.add_argument("--processing-mbps", type=float, default=160, help="Gemini file processing rate (Mbit/s)")
+    parser.add_argument("--first-token-latency", type=float, default=0.5, help="Seconds before Gemini's first token")
+    parser.add_argument("--tokens-per-second", type=float, default=5000, help="Gemini output rate per request")
+    parser.add_argument("--words-per-minute", type=int, default=150, help="Transcript words per minute of audio")
+    parser.add_argument("--summary-words", type=int, default=800)
+    parser.add_argument("--guide-words", type=int, default=1500)
+    parser.add_argument("--quota-rpm", type=int, default=0, help="Simulated Gemini requests-per-minute quota; excess calls get 429 (0 = none)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="Results file (default benchmark_results/<time>_<commit>.json)")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, help="With --compare, exit 1 if p95 or jobs/min is worse by more than this percent")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        with open(args.scenario) as f:
+            result = run_scenario(json.load(f))
+        with open(os.path.join(os.path.dirname(args.scenario), "result.json"), "w") as f:
+            json.dump(result, f)
+        return
+
+    if not shutil.which("ffmpeg"):
+        sys.exit("ffmpeg is required to run the benchmark.")
+    results = run_benchmark(args)
+    print_report(results)
+
+    output = args.output
+    if not output:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}_{(results['git']['commit'] or 'nogit')[:8]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(results, json.load(f), args.max_regression):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,46 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
-import uuid
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import List, Optional
-from services.youtube import download_audio_and_metadata
-from services.gemini import analyze_content
-from services.document_generator import generate_documents
+from services.log import setup_logging
+
+# Configure logging before the services log anything at import time
+setup_logging()
+logger = logging.getLogger(__name__)
+
+from services.youtube import download_audio_and_metadata, extract_video_id, expand_urls, preflight, PreflightError, METADATA_CACHE_TTL_SECONDS
+from services.gemini import analyze_content, summarize_batch, generation_stats, ANALYSIS_MODES
+from services.document_generator import generate_documents, shutdown_render_pool, ensure_rendered, MANIFEST_FILE
+from services import jobs, job_store, cache, gemini_files, gemini_quota, history, search, batches, metrics, downloads, storage
 import shutil
+import time
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    history.init_history()
+    search.init_search()
+    cache.init_cache(OUTPUT_DIR, list(history.iter_entries()))
+    job_store.init_job_store()
+    storage.init_storage(OUTPUT_DIR)
+    # Analysis jobs run on a staged worker pipeline, off the request path;
+    # jobs interrupted by a restart resume from their last completed stage
+    await jobs.start_workers(PIPELINE)
+    reaper_task = asyncio.create_task(gemini_files.run_reaper())
+    # Intermediate cleanup, retention and the disk quota, off the request path
+    storage_task = asyncio.create_task(storage.run_sweeper())
+    yield
+    reaper_task.cancel()
+    storage_task.cancel()
+    await jobs.stop_workers()
+    shutdown_render_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS configuration
 app.add_middleware(
@@ -38,47 +68,57 @@ def health_check():
 
 import json
 
-from fastapi.staticfiles import StaticFiles
-
 # Output directory
 OUTPUT_DIR = "../output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Mount static files
-app.mount("/download", StaticFiles(directory=OUTPUT_DIR), name="download")
+@app.api_route("/download/{file_path:path}", methods=["GET", "HEAD"])
+async def download_file(file_path: str, request: Request):
+    """
+    Serves generated files. Documents produced in lazy mode are rendered on
+    their first request and served from disk afterwards. Supports ETag and
+    range requests; text files go out gzip/brotli-compressed when accepted.
+    """
+    output_root = os.path.realpath(OUTPUT_DIR)
+    full_path = os.path.realpath(os.path.join(OUTPUT_DIR, file_path))
+    if not full_path.startswith(output_root + os.sep) or os.path.basename(full_path) == MANIFEST_FILE:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # Hidden entries (.downloads partials) and in-progress temp files are not outputs
+    if any(part.startswith(".") or ".tmp" in part for part in os.path.relpath(full_path, output_root).split(os.sep)):
+        raise HTTPException(status_code=404, detail="Not Found")
 
-HISTORY_FILE = "history.json"
-
-def load_history():
-    if os.path.exists(HISTORY_FILE):
+    if not os.path.isfile(full_path):
         try:
-            with open(HISTORY_FILE, "r") as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+            rendered = await asyncio.to_thread(ensure_rendered, os.path.dirname(full_path), os.path.basename(full_path))
+        except Exception as e:
+            logger.error(f"Render Error: {e}", extra={"file": file_path})
+            raise HTTPException(status_code=500, detail=f"Rendering failed: {str(e)}")
+        if rendered is None:
+            raise HTTPException(status_code=404, detail="Not Found")
 
-def save_history(history):
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=2)
+    def respond():
+        downloads.ensure_precompressed(full_path)
+        response = downloads.file_response(full_path, request.headers)
+        if request.method == "GET" and response.status_code != 304 and os.path.dirname(full_path) != output_root:
+            storage.record_download(os.path.basename(os.path.dirname(full_path)))
+        return response
 
-# History storage
-history_log = load_history()
+    return await asyncio.to_thread(respond)
 
 # Verify Node.js for yt-dlp
 import shutil
 import subprocess
 node_path = shutil.which("node") or shutil.which("nodejs")
-print(f"DEBUG: PATH env var: {os.environ.get('PATH')}")
-print(f"DEBUG: Node.js check - Found at: {node_path}")
+logger.debug(f"PATH env var: {os.environ.get('PATH')}")
+logger.debug(f"Node.js check - Found at: {node_path}")
 if node_path:
     try:
         node_version = subprocess.check_output([node_path, "--version"], text=True).strip()
-        print(f"DEBUG: Node.js Version: {node_version}")
+        logger.debug(f"Node.js Version: {node_version}")
     except Exception as e:
-        print(f"DEBUG: Could not get Node version: {e}")
+        logger.debug(f"Could not get Node version: {e}")
 else:
-    print("WARNING: Node.js NOT FOUND. yt-dlp may fail JS challenges!")
+    logger.warning("Node.js NOT FOUND. yt-dlp may fail JS challenges!")
 
 
 # Startup Event: Write Cookies
@@ -99,34 +139,34 @@ else:
 # Helper: PO Token (Experimental)
 po_token_content = os.getenv("YOUTUBE_PO_TOKEN")
 if po_token_content:
-    print(f"DEBUG: Found YOUTUBE_PO_TOKEN env var (Length: {len(po_token_content)})")
+    logger.debug(f"Found YOUTUBE_PO_TOKEN env var (Length: {len(po_token_content)})")
 else:
-    print("DEBUG: YOUTUBE_PO_TOKEN env var NOT found.")
+    logger.debug("YOUTUBE_PO_TOKEN env var NOT found.")
 
 # Helper: Render Secret File (Method 2 - More robust)
 SECRET_FILE_PATH = "/etc/secrets/cookies.txt"
 if os.path.exists(SECRET_FILE_PATH):
-    print(f"DEBUG: Found Render Secret File at {SECRET_FILE_PATH}")
+    logger.debug(f"Found Render Secret File at {SECRET_FILE_PATH}")
     # Symlink or copy to cookies.txt so yt-dlp finds it easily, 
     # OR just set COOKIES_FILE_PATH global to point there.
     # For now, let's copy it to be safe and consistent.
     try:
         # import shutil
         # shutil.copy(SECRET_FILE_PATH, "cookies.txt")
-        print(f"DEBUG: IGNORING Secret File to test clean Node.js bypass")
+        logger.debug(f"IGNORING Secret File to test clean Node.js bypass")
     except Exception as e:
-        print(f"DEBUG: Error copying Secret File: {e}")
+        logger.debug(f"Error copying Secret File: {e}")
 
 
     cookies_content = os.getenv("YOUTUBE_COOKIES")
     if cookies_content:
         cookies_path = "cookies.txt"
-        print(f"DEBUG: Found YOUTUBE_COOKIES env var (Length: {len(cookies_content)})")
+        logger.debug(f"Found YOUTUBE_COOKIES env var (Length: {len(cookies_content)})")
         with open(cookies_path, "w") as f:
             f.write(cookies_content)
-        print(f"DEBUG: Successfully wrote cookies to {cookies_path}")
+        logger.debug(f"Successfully wrote cookies to {cookies_path}")
     else:
-        print("DEBUG: YOUTUBE_COOKIES env var NOT found.")
+        logger.debug("YOUTUBE_COOKIES env var NOT found.")
 
 @app.get("/debug_cookies")
 def debug_cookies():
@@ -162,74 +202,420 @@ def debug_cookies():
 class AnalyzeRequest(BaseModel):
     url: str
     options: List[str]  # "summary", "transcription_orig", "transcription_es", "guide"
+    mode: Optional[str] = "auto"  # "auto", "single", "chunked", "sections"
 
-@app.post("/analyze")
-async def analyze_video(request: AnalyzeRequest, background_tasks: BackgroundTasks):
-    print(f"Received analysis request for URL: {request.url}")
-    video_id = str(uuid.uuid4())[:8]
-    
+async def preflight_stage(job: dict):
+    """
+    Stage 0: resolves the video metadata once and rejects videos that break a
+    policy (private, live, too long...) before anything is downloaded.
+    """
+    state = job.setdefault("_state", {})
     try:
-        # 1. Download Video/Audio (to base dir first to get metadata)
-        try:
-            video_data = download_audio_and_metadata(request.url, OUTPUT_DIR, video_id)
-        except Exception as e:
-            print(f"Download Error: {e}")
-            raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
-
-        
-        # Create unique subdirectory
-        safe_title = "".join([c for c in video_data.get('title', 'video') if c.isalnum() or c in (' ', '-', '_')]).strip().replace(' ', '_')
-        video_output_dir = os.path.join(OUTPUT_DIR, f"{safe_title}_{video_id}")
-        os.makedirs(video_output_dir, exist_ok=True)
-        
-        # Move audio file to subdirectory
-        import shutil
-        old_audio_path = video_data['audio_path']
-        new_audio_path = os.path.join(video_output_dir, os.path.basename(old_audio_path))
-        shutil.move(old_audio_path, new_audio_path)
-        video_data['audio_path'] = new_audio_path
-        
-        # 2. Analyze with Gemini
-        try:
-            analysis_results = await analyze_content(video_data['audio_path'], request.options)
-        except Exception as e:
-            print(f"Analysis Error: {e}")
-            raise HTTPException(status_code=500, detail=f"AI Analysis failed: {str(e)}")
-
-        
-        # 3. Generate Documents
-        generated_files = generate_documents(analysis_results, video_data, video_output_dir, request.options)
-        
-        # 4. Update History
-        entry = {
-            "id": video_id,
-            "title": video_data['title'],
-            "url": request.url,
-            "date": video_data['upload_date'],
-            "report_date": datetime.now().strftime("%Y-%m-%d"),
-            "dir_name": os.path.basename(video_output_dir), # Store dir name for frontend reconstruction
-            "files": generated_files,
-            "thumbnail": video_data['thumbnail']
+        info = await asyncio.to_thread(preflight, job["request"]["url"])
+    except PreflightError as e:
+        raise Exception(f"Rejected: {str(e)}")
+    except Exception as e:
+        # Not conclusive (e.g. a transient network error): the download stage probes again
+        logger.warning(f"Preflight could not resolve metadata: {e}")
+        return
+    state["info"] = info
+    state["info_at"] = time.time()
+    jobs.publish_event(job, "preflight", {
+        "title": info.get('title'),
+        "duration": info.get('duration'),
+        "uploader": info.get('uploader'),
+        "thumbnail": info.get('thumbnail'),
+    })
+
+async def download_stage(job: dict):
+    """
+    Stage 1: downloads the audio and metadata, then moves the audio into the
+    job's output directory. Blocking work runs in a worker thread.
+    """
+    request = job["request"]
+    state = job.setdefault("_state", {})
+    video_id = job["id"]
+    on_event = jobs.job_event_callback(job)
+    logger.info("Processing job", extra={"job_id": video_id, "url": request["url"]})
+
+    # Metadata resolved long ago (the job waited in the queue) may hold expired
+    # format URLs; it is never checkpointed (see job_store.VOLATILE_STATE_KEYS)
+    info = state.pop("info", None)
+    if info and time.time() - state.pop("info_at", 0) > METADATA_CACHE_TTL_SECONDS:
+        info = None
+
+    # Download Video/Audio (to base dir first to get metadata)
+    try:
+        video_data = await asyncio.to_thread(download_audio_and_metadata, request["url"], OUTPUT_DIR, video_id, None, on_event, info)
+    except Exception as e:
+        logger.debug(f"Download Error: {e}", extra={"job_id": video_id})
+        raise Exception(f"Download failed: {str(e)}")
+
+    # Create unique subdirectory
+    safe_title = "".join([c for c in video_data.get('title', 'video') if c.isalnum() or c in (' ', '-', '_')]).strip().replace(' ', '_')
+    video_output_dir = os.path.join(OUTPUT_DIR, f"{safe_title}_{video_id}")
+    os.makedirs(video_output_dir, exist_ok=True)
+
+    # Move audio file to subdirectory
+    old_audio_path = video_data['audio_path']
+    new_audio_path = os.path.join(video_output_dir, os.path.basename(old_audio_path))
+    shutil.move(old_audio_path, new_audio_path)
+    video_data['audio_path'] = new_audio_path
+    on_event("metadata", {
+        "title": video_data['title'],
+        "date": video_data['upload_date'],
+        "thumbnail": video_data['thumbnail'],
+        "dir_name": os.path.basename(video_output_dir),
+    })
+    state["video_data"] = video_data
+    state["output_dir"] = video_output_dir
+
+async def analysis_stage(job: dict):
+    """
+    Stage 2: analyzes the audio with Gemini. The Gemini file and each section
+    are checkpointed as they arrive, so a resumed job only requests the rest.
+    """
+    request = job["request"]
+    state = job["_state"]
+    if not os.path.exists(state["video_data"]['audio_path']):
+        # Resumed after a restart, but the audio is gone: download it again
+        await download_stage(job)
+    video_data = state["video_data"]
+    publish = jobs.job_event_callback(job)
+    sections = state.setdefault("sections", {})
+    # Batch items wait behind interactive requests for Gemini quota
+    gemini_quota.set_priority(gemini_quota.BATCH if request.get("batch_id") else gemini_quota.INTERACTIVE)
+
+    def on_event(event, data):
+        # May run in worker threads; the checkpoint applies the change on the event loop
+        if event == "section":
+            jobs.save_checkpoint(job, lambda state: sections.update({data["name"]: data["content"]}))
+        elif event == "gemini" and data.get("name"):
+            jobs.save_checkpoint(job, lambda state: state.update(gemini_file=data["name"]))
+        publish(event, data)
+
+    try:
+        state["analysis"] = await analyze_content(
+            video_data['audio_path'],
+            request["options"],
+            duration=video_data.get('duration'),
+            mode=request.get("mode") or "auto",
+            on_event=on_event,
+            source_key=f"{request['video_id']}:{video_data['transcode_stats']['profile']}" if request.get("video_id") else None,
+            completed=sections,
+            gemini_file=state.get("gemini_file"),
+        )
+    except Exception as e:
+        logger.debug(f"Analysis Error: {e}", extra={"job_id": job["id"]})
+        raise Exception(f"AI Analysis failed: {str(e)}")
+    state.pop("sections", None)
+
+    # The audio was only needed for the upload, unless another job for the same
+    # video is still using the directory
+    if os.path.basename(state["output_dir"]) not in jobs.active_output_dirs(exclude=job):
+        await asyncio.to_thread(storage.release_audio, video_data['audio_path'])
+
+async def documents_stage(job: dict) -> dict:
+    """
+    Stage 3: generates the documents, records the run in history, the search
+    index and the result cache. Returns the history entry (the job result).
+    """
+    request = job["request"]
+    state = job["_state"]
+    video_data = state["video_data"]
+    video_output_dir = state["output_dir"]
+    analysis_results = state["analysis"]
+    on_event = jobs.job_event_callback(job)
+    os.makedirs(video_output_dir, exist_ok=True)
+
+    # Generate Documents
+    render_stats = {}
+    generated_files = await asyncio.to_thread(
+        generate_documents, analysis_results, video_data, video_output_dir, request["options"],
+        lambda key, url: on_event("file", {"key": key, "url": url}),
+        render_stats,
+    )
+
+    # Update History
+    entry = {
+        "id": job["id"],
+        "video_id": request.get("video_id"),
+        "title": video_data['title'],
+        "url": request["url"],
+        "options": cache.normalize_options(request["options"]),
+        "date": video_data['upload_date'],
+        "report_date": datetime.now().strftime("%Y-%m-%d"),
+        "dir_name": os.path.basename(video_output_dir), # Store dir name for frontend reconstruction
+        "files": generated_files,
+        "thumbnail": video_data['thumbnail'],
+        "stats": {
+            "download": video_data.get('download_stats'),
+            "transcode": video_data.get('transcode_stats'),
+            "render": render_stats,
         }
-        history_log.append(entry)
-        save_history(history_log)
-        
-        return entry
+    }
+    await asyncio.to_thread(history.add_entry, entry)
+    await asyncio.to_thread(search.index_report, entry["dir_name"], entry["title"], analysis_results)
+
+    # Outputs are only deleted by the storage sweeper (services/storage.py)
+    await asyncio.to_thread(cache.store, request.get("video_id"), request["options"], entry)
+
+    return entry
+
+# Pipeline stages in order; each runs on its own worker pool (see jobs.STAGE_WORKERS)
+PIPELINE = [
+    ("preflight", preflight_stage),
+    ("download", download_stage),
+    ("analysis", analysis_stage),
+    ("documents", documents_stage),
+]
 
+async def start_analysis(payload: dict, wait: bool = False):
+    """
+    Returns (job, owned) for an analysis request: a completed job from the
+    result cache, an identical in-flight job, or a newly queued one (owned=True).
+    With `wait`, a full queue is waited on instead of raising QueueFullError.
+    """
+    # Serve repeat requests straight from the result cache
+    cached_entry = await asyncio.to_thread(cache.lookup, payload["video_id"], payload["options"])
+    if cached_entry:
+        logger.debug(f"Result cache hit for video {payload['video_id']}")
+        return jobs.create_completed_job(payload, cached_entry, cached=True), False
+
+    # Attach to an identical analysis that is already queued or running
+    inflight_job = jobs.find_inflight(payload["video_id"], payload["options"])
+    if inflight_job:
+        logger.debug(f"Coalescing request into in-flight job {inflight_job['id']}")
+        return jobs.attach_to_job(inflight_job), False
+
+    if wait:
+        return await jobs.enqueue_job(payload), True
+    return jobs.submit_job(payload), True
+
+@app.post("/analyze", status_code=202)
+async def analyze_video(request: AnalyzeRequest):
+    """Enqueues an analysis job and returns its id immediately. Poll GET /jobs/{id} for the result."""
+    logger.info("Received analysis request", extra={"url": request.url})
+    if request.mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode '{request.mode}'. Available: {', '.join(ANALYSIS_MODES)}")
+    payload = {"url": request.url, "options": request.options, "mode": request.mode, "video_id": extract_video_id(request.url)}
+
+    try:
+        job, _ = await start_analysis(payload)
+    except jobs.QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return jobs.public_job(job)
+
+class BatchRequest(BaseModel):
+    urls: List[str]  # video, playlist or channel URLs
+    options: List[str]
+    mode: Optional[str] = "auto"
+
+def _batch_report(entry: dict) -> dict:
+    """
+    Text fed to the cross-video summary: keywords plus the richest section available.
+    """
+    _, sections = search.read_report_dir(os.path.join(OUTPUT_DIR, entry["dir_name"]))
+    body = next((sections[key] for key in ("summary", "guide", "transcription_es", "transcription_orig") if sections.get(key)), "")
+    return {"title": entry["title"], "text": f"Keywords: {sections.get('keywords', '')}\n\n{body}"}
+
+async def run_batch(batch: dict):
+    """
+    Expands the batch URLs, feeds every video through the job queue (the
+    stage pipeline overlaps downloads, Gemini calls and renders across
+    videos) and finishes with a cross-video summary.
+    """
+    request = batch["request"]
+    gemini_quota.set_priority(gemini_quota.BATCH)
+    try:
+        entries = await asyncio.to_thread(expand_urls, request["urls"], batches.BATCH_MAX_ITEMS)
+        if not entries:
+            raise Exception("No videos found for the given URLs.")
+        batch["items"] = [dict(entry, job_id=None, owned=False) for entry in entries]
+        batches.update_batch(batch, status="running")
+        logger.debug(f"Batch {batch['id']} expanded to {len(entries)} videos")
+
+        for item in batch["items"]:
+            payload = {"url": item["url"], "options": request["options"], "mode": request["mode"], "video_id": item["video_id"], "batch_id": batch["id"]}
+            job, owned = await start_analysis(payload, wait=True)
+            item.update(job_id=job["id"], owned=owned, _job=job)
+
+        finished = await asyncio.gather(*[jobs.wait_for_job(item["_job"]) for item in batch["items"]])
+        completed = [job["result"] for job in finished if job["status"] == "completed"]
+        if not completed:
+            raise Exception("Every video in the batch failed.")
+
+        batches.update_batch(batch, status="summarizing")
+        reports = await asyncio.to_thread(lambda: [_batch_report(entry) for entry in completed])
+        summary = await summarize_batch(reports)
+
+        batch_dir = os.path.join(OUTPUT_DIR, f"batch_{batch['id']}")
+        os.makedirs(batch_dir, exist_ok=True)
+        with open(os.path.join(batch_dir, "batch_summary.md"), "w", encoding="utf-8") as f:
+            f.write(f"# Batch summary ({len(completed)} of {len(finished)} videos)\n\n{summary}")
+        batches.update_batch(batch, status="completed", summary=summary, summary_file=f"/download/batch_{batch['id']}/batch_summary.md")
+    except asyncio.CancelledError:
+        batches.update_batch(batch, status="cancelled")
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Batch {batch['id']} failed: {e}")
+        batches.update_batch(batch, status="failed", error=str(e))
+    finally:
+        batch.pop("_task", None)
+
+@app.post("/batches", status_code=202)
+async def create_batch(request: BatchRequest):
+    """
+    Analyzes several videos as one batch. `urls` may mix videos, playlists and
+    channels. Poll GET /batches/{id} for per-item progress and the final summary.
+    """
+    if request.mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode '{request.mode}'. Available: {', '.join(ANALYSIS_MODES)}")
+    if not request.urls:
+        raise HTTPException(status_code=400, detail="No URLs given.")
+    batch = batches.create_batch({"urls": request.urls, "options": request.options, "mode": request.mode})
+    batch["_task"] = asyncio.create_task(run_batch(batch))
+    return batches.public_batch(batch)
+
+@app.get("/batches/{batch_id}")
+def get_batch_status(batch_id: str):
+    batch = batches.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batches.public_batch(batch)
+
+@app.delete("/batches/{batch_id}")
+def cancel_batch(batch_id: str):
+    batch = batches.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if not batches.cancel_batch(batch):
+        raise HTTPException(status_code=409, detail=f"Batch already {batch['status']}")
+    return batches.public_batch(batch)
+
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.public_job(job)
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not jobs.cancel_job(job):
+        raise HTTPException(status_code=409, detail=f"Job already {job['status']}")
+    return jobs.public_job(job)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    Server-Sent Events stream of a job's progress: status changes, download
+    percentage, Gemini state, sections as they are parsed and files as they are
+    written. While the job runs, past events are replayed first, so a late
+    subscriber misses nothing; once it has finished, only the final status
+    event (with the result or error) is sent.
+    """
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        async for item in jobs.subscribe_events(job):
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {item['event']}\ndata: {json.dumps(item['data'])}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/jobs/{job_id}/archive")
+async def download_job_archive(job_id: str):
+    """
+    Streams a ZIP of every file a job produced (rendering pending lazy
+    documents first). The archive is written as it is sent, never held in
+    memory or on disk. Also accepts the id of a history entry.
+    """
+    job = jobs.get_job(job_id)
+    entry = job["result"] if job and job.get("result") else await asyncio.to_thread(history.get_entry, job_id)
+    if not entry or not entry.get("dir_name"):
+        raise HTTPException(status_code=404, detail="Job not found or not completed")
+
+    output_dir = os.path.join(OUTPUT_DIR, entry["dir_name"])
+    names = [os.path.basename(url) for url in entry.get("files", {}).values()]
+    try:
+        paths = await asyncio.gather(*(asyncio.to_thread(ensure_rendered, output_dir, name) for name in names))
+    except Exception as e:
+        logger.error(f"Render Error: {e}", extra={"job_id": job_id})
+        raise HTTPException(status_code=500, detail=f"Rendering failed: {str(e)}")
+    files = [(f"{entry['dir_name']}/{name}", path) for name, path in zip(names, paths) if path]
+    if not files:
+        raise HTTPException(status_code=404, detail="The job's files are no longer available")
+
+    metrics.inc("downloads_total", outcome="archive")
+    await asyncio.to_thread(storage.record_download, entry["dir_name"])
+    return StreamingResponse(
+        downloads.iter_zip(files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{entry["dir_name"]}.zip"'},
+    )
+
+@app.get("/jobs")
+def get_queue_status():
+    return {
+        **jobs.queue_stats(),
+        "cache": cache.stats(),
+        "gemini_files": gemini_files.stats(),
+        "generation": generation_stats,
+        "gemini_quota": gemini_quota.usage(),
+        "storage": storage.stats(),
+    }
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/history")
-def get_history():
-    return history_log
+def get_history(
+    limit: int = history.DEFAULT_PAGE_SIZE,
+    cursor: Optional[int] = None,
+    video_id: Optional[str] = None,
+    url: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    q: Optional[str] = None,
+):
+    """
+    Newest-first page of history. Pass `next_cursor` back as `cursor` for the next page.
+    Dates are report dates (YYYY-MM-DD); `q` searches titles and URLs.
+    """
+    items, next_cursor = history.list_entries(limit, cursor, video_id, url, date_from, date_to, q)
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/search")
+def search_reports(q: str, limit: int = search.DEFAULT_LIMIT, section: Optional[str] = None):
+    """
+    Full-text search over generated reports (summaries, guides, transcriptions
+    and keywords), best matches first, with highlighted snippets.
+    """
+    if section and section not in search.INDEXED_SECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown section '{section}'. Available: {', '.join(search.INDEXED_SECTIONS)}")
+    results, elapsed = search.search(q, limit, section)
+    return {"query": q, "results": results, "took_ms": round(elapsed * 1000, 2)}
 
 @app.get("/clean_tmp")
-def clean_tmp():
-    # Helper to clean up audio files if needed
-    pass
+async def clean_tmp():
+    """
+    Runs a storage sweep now (it also runs every STORAGE_SWEEP_MINUTES): stale
+    partial downloads, intermediate audio, retention and the disk quota.
+    """
+    return await storage.sweep_once()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,107 @@
+import os
+import uuid
+from datetime import datetime
+from services import jobs
+
+# Largest number of videos a single batch (or expanded playlist) may contain
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+# Finished batches kept for status queries; older ones are dropped
+MAX_FINISHED_BATCHES = int(os.getenv("BATCH_MAX_FINISHED", "50"))
+
+# In-memory batch registry: batch_id -> batch dict
+batches = {}
+
+BATCH_FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def create_batch(request: dict) -> dict:
+    batch = {
+        "id": str(uuid.uuid4())[:8],
+        "status": "expanding",
+        "request": request,
+        "items": [],
+        "summary": None,
+        "summary_file": None,
+        "error": None,
+        "created_at": _now(),
+        "updated_at": _now(),
+    }
+    _prune_finished_batches()
+    batches[batch["id"]] = batch
+    return batch
+
+
+def get_batch(batch_id: str):
+    return batches.get(batch_id)
+
+
+def update_batch(batch: dict, **fields):
+    batch.update(fields)
+    batch["updated_at"] = _now()
+    if batch["status"] in BATCH_FINISHED_STATUSES:
+        _release_jobs(batch)
+    return batch
+
+
+def _release_jobs(batch: dict):
+    """
+    Replaces each item's job reference with its final status and result, so a
+    finished batch does not keep the jobs alive after jobs prunes them.
+    """
+    for item in batch["items"]:
+        job = item.pop("_job", None)
+        if job is None:
+            continue
+        status, stage = job["status"], job.get("stage")
+        if status not in jobs.FINISHED_STATUSES and item.get("owned"):
+            # Cancelled with the batch; the job finishes cancelling on its own
+            status, stage = "cancelled", None
+        item.update(status=status, stage=stage, error=job.get("error"), result=job.get("result"))
+
+
+def _prune_finished_batches():
+    finished = [batch_id for batch_id, batch in batches.items() if batch["status"] in BATCH_FINISHED_STATUSES]
+    # Dicts keep insertion order, so the oldest finished batches come first
+    for batch_id in finished[:max(0, len(finished) - MAX_FINISHED_BATCHES)]:
+        del batches[batch_id]
+
+
+def _item_view(item: dict) -> dict:
+    view = {key: value for key, value in item.items() if not key.startswith("_")}
+    job = item.get("_job")
+    if job is not None:
+        view.update(status=job["status"], stage=job.get("stage"), error=job.get("error"), result=job.get("result"))
+    else:
+        view.setdefault("status", "pending")
+    return view
+
+
+def public_batch(batch: dict) -> dict:
+    """
+    Returns the client-facing batch with live per-item job status and totals.
+    """
+    items = [_item_view(item) for item in batch["items"]]
+    progress = {"total": len(items)}
+    for item in items:
+        progress[item["status"]] = progress.get(item["status"], 0) + 1
+    view = {key: value for key, value in batch.items() if key != "items" and not key.startswith("_")}
+    return {**view, "progress": progress, "items": items}
+
+
+def cancel_batch(batch: dict) -> bool:
+    if batch["status"] in BATCH_FINISHED_STATUSES:
+        return False
+    batch["_cancel_requested"] = True
+    for item in batch["items"]:
+        job = item.get("_job")
+        # Items shared with other requests (coalesced or cached) are left alone
+        if job is not None and item.get("owned"):
+            jobs.cancel_job(job)
+    task = batch.get("_task")
+    if task is not None:
+        task.cancel()
+    return True
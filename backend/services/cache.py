@@ -0,0 +1,216 @@
+import logging
+import json
+import os
+import threading
+import time
+from services.youtube import extract_video_id
+
+logger = logging.getLogger(__name__)
+
+# Result cache configuration (override via environment)
+CACHE_INDEX_FILE = os.getenv("RESULT_CACHE_FILE", "result_cache.json")
+# Runs kept in the index; older ones stay on disk (and in history) but are no
+# longer reused. Deleting outputs is left to services/storage.py (OUTPUT_QUOTA_MB
+# and OUTPUT_RETENTION_DAYS), which drops deleted runs from here via forget()
+CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "200"))
+
+# Options whose outputs live in the generated `files` mapping
+KNOWN_OPTIONS = ("summary", "transcription_orig", "transcription_es", "guide")
+
+# video_id -> list of cached runs
+# Each run: {"options": [...], "entry": <history entry>, "size": bytes, "last_access": ts}
+_index = {}
+_output_dir = None
+# lookup/store/forget run in worker threads (they touch the disk); this guards _index
+_lock = threading.Lock()
+
+
+def normalize_options(options) -> list:
+    return sorted(set(options))
+
+
+def options_from_files(files: dict) -> list:
+    """
+    Infers which options produced a `files` mapping (used for history entries
+    recorded before options were stored).
+    """
+    return normalize_options(
+        option for option in KNOWN_OPTIONS
+        if any(key == option or key.startswith(f"{option}_") for key in files)
+    )
+
+
+def filter_files(files: dict, options) -> dict:
+    """
+    Keeps only the files that belong to the requested options.
+    """
+    return {
+        key: path for key, path in files.items()
+        if any(key == option or key.startswith(f"{option}_") for option in options)
+    }
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _save_index():
+    tmp_path = f"{CACHE_INDEX_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(_index, f)
+    os.replace(tmp_path, CACHE_INDEX_FILE)
+
+
+def init_cache(output_dir: str, history: list):
+    """
+    Loads the cache index and seeds it from history entries whose output
+    directory still exists on disk.
+    """
+    global _index, _output_dir
+    _output_dir = output_dir
+
+    if os.path.exists(CACHE_INDEX_FILE):
+        try:
+            with open(CACHE_INDEX_FILE, "r") as f:
+                _index = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read result cache index: {e}")
+            _index = {}
+
+    known_dirs = {run["entry"].get("dir_name") for runs in _index.values() for run in runs}
+    for entry in history:
+        video_id = entry.get("video_id")
+        if not video_id:
+            video_id = extract_video_id(entry.get("url", ""))
+        dir_name = entry.get("dir_name")
+        if not video_id or not dir_name or dir_name in known_dirs:
+            continue
+        dir_path = os.path.join(output_dir, dir_name)
+        if not os.path.isdir(dir_path):
+            continue
+        options = entry.get("options") or options_from_files(entry.get("files", {}))
+        _index.setdefault(video_id, []).append({
+            "options": normalize_options(options),
+            "entry": entry,
+            "size": _dir_size(dir_path),
+            "last_access": os.path.getmtime(dir_path),
+        })
+        known_dirs.add(dir_name)
+
+    # Drop runs whose directories were removed outside the cache
+    for video_id in list(_index):
+        _index[video_id] = [run for run in _index[video_id] if os.path.isdir(os.path.join(output_dir, run["entry"]["dir_name"]))]
+        if not _index[video_id]:
+            del _index[video_id]
+
+    _save_index()
+    logger.debug(f"Result cache loaded ({sum(len(runs) for runs in _index.values())} runs)")
+
+
+def lookup(video_id: str, options):
+    """
+    Returns a history entry that covers `options` for this video, or None.
+    Any cached run whose options are a superset of the requested ones is reused;
+    the returned `files` are restricted to the requested options.
+    """
+    with _lock:
+        if not video_id or video_id not in _index:
+            return None
+
+        requested = set(options)
+        candidates = [run for run in _index[video_id] if requested.issubset(run["options"])]
+        if not candidates:
+            return None
+
+        # Prefer the smallest covering run, then the most recent one
+        run = min(candidates, key=lambda r: (len(r["options"]), -r["last_access"]))
+        if not os.path.isdir(os.path.join(_output_dir, run["entry"]["dir_name"])):
+            _index[video_id].remove(run)
+            _save_index()
+            return None
+
+        run["last_access"] = time.time()
+        _save_index()
+
+        entry = dict(run["entry"])
+        entry["files"] = filter_files(entry.get("files", {}), options)
+        return entry
+
+
+def store(video_id: str, options, entry: dict) -> list:
+    """
+    Records a finished run and drops least-recently-used runs from the index
+    past CACHE_MAX_ENTRIES (their outputs are kept). Returns the dropped dir names.
+    """
+    with _lock:
+        if not video_id:
+            return []
+
+        run = {
+            "options": normalize_options(options),
+            "entry": entry,
+            "size": _dir_size(os.path.join(_output_dir, entry["dir_name"])),
+            "last_access": time.time(),
+        }
+        _index.setdefault(video_id, []).append(run)
+
+        evicted = _evict(keep=run)
+        _save_index()
+        return evicted
+
+
+def forget(dir_names: list):
+    """
+    Drops cached runs whose output directories were deleted elsewhere (see services/storage.py).
+    """
+    with _lock:
+        dir_names = set(dir_names)
+        if not dir_names:
+            return
+        for video_id in list(_index):
+            _index[video_id] = [run for run in _index[video_id] if run["entry"].get("dir_name") not in dir_names]
+            if not _index[video_id]:
+                del _index[video_id]
+        _save_index()
+
+
+def _evict(keep=None) -> list:
+    runs = sorted(
+        ((video_id, run) for video_id, video_runs in _index.items() for run in video_runs),
+        key=lambda item: item[1]["last_access"],
+    )
+    count = len(runs)
+
+    evicted = []
+    for video_id, run in runs:
+        if count <= CACHE_MAX_ENTRIES:
+            break
+        if run is keep:
+            continue
+        dir_name = run["entry"]["dir_name"]
+        logger.debug(f"Dropping cached result {dir_name} from the index")
+        _index[video_id].remove(run)
+        if not _index[video_id]:
+            del _index[video_id]
+        count -= 1
+        evicted.append(dir_name)
+
+    return evicted
+
+
+def stats() -> dict:
+    with _lock:
+        runs = [run for video_runs in _index.values() for run in video_runs]
+        return {
+            "videos": len(_index),
+            "runs": len(runs),
+            "bytes": sum(run["size"] for run in runs),
+            "max_entries": CACHE_MAX_ENTRIES,
+        }
@@ -1,5 +1,11 @@
+import logging
 import os
+import json
+import time
+import threading
 import markdown2
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from docx import Document
 from reportlab.lib.pagesizes import A4
@@ -10,6 +16,112 @@ from reportlab.lib.units import inch
 from reportlab.pdfgen import canvas
 from ebooklib import epub
 from xml.sax.saxutils import escape
+from services import metrics, downloads
+
+logger = logging.getLogger(__name__)
+
+# DOCX/PDF/EPUB renders run in a process pool so they use all cores instead of
+# contending for the GIL. 0 renders inline in the calling thread.
+RENDER_WORKERS = int(os.getenv("DOCUMENT_RENDER_WORKERS", str(os.cpu_count() or 2)))
+
+# "lazy" writes only the text files plus a render manifest; DOCX/PDF/EPUB are
+# rendered on their first download (see ensure_rendered). "eager" renders everything.
+RENDER_MODE = os.getenv("DOCUMENT_RENDER_MODE", "lazy")
+MANIFEST_FILE = "render_manifest.json"
+
+_render_pool = None
+_render_locks = {}
+_render_locks_guard = threading.Lock()
+
+def _get_render_pool():
+    global _render_pool
+    if _render_pool is None and RENDER_WORKERS > 0:
+        # spawn, not fork: the server process has threads (and gRPC) that do not survive fork
+        _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _render_pool
+
+def shutdown_render_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+def _render(fmt, args):
+    """
+    Renders one document (runs in a pool process). Returns the render time in seconds.
+    """
+    start = time.perf_counter()
+    if fmt == "docx":
+        create_docx(*args)
+    elif fmt == "pdf":
+        create_professional_pdf(*args)
+    elif fmt == "epub":
+        create_epub(*args)
+    else:
+        raise ValueError(f"Unknown document format '{fmt}'")
+    return time.perf_counter() - start
+
+def _render_args(fmt, path, content, title_suffix, video_data, metadata_text, keywords):
+    if fmt == "docx":
+        return (f"{video_data['title']} - {title_suffix}", metadata_text + content, path)
+    if fmt == "pdf":
+        return (f"{title_suffix}: {video_data['title']}", content, path, video_data, keywords)
+    if fmt == "epub":
+        return (f"{title_suffix}: {video_data['title']}", metadata_text + content, path)
+    raise ValueError(f"Unknown document format '{fmt}'")
+
+def _run_render(fmt, args):
+    pool = _get_render_pool()
+    if pool is None:
+        return _render(fmt, args)
+    return pool.submit(_render, fmt, args).result()
+
+def ensure_rendered(output_dir: str, filename: str):
+    """
+    Renders a lazily generated document on first request and returns its path.
+    Later calls find the file on disk. Returns None if `filename` is not a
+    pending document of this output directory.
+    """
+    path = os.path.join(output_dir, filename)
+    if os.path.isfile(path):
+        return path
+
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    pending = manifest["files"].get(filename)
+    if pending is None:
+        return None
+
+    # One render per file even if several downloads arrive at once
+    with _render_locks_guard:
+        lock = _render_locks.setdefault(path, threading.Lock())
+    try:
+        with lock:
+            if not os.path.isfile(path):
+                section = manifest["sections"][pending["section"]]
+                base, ext = os.path.splitext(path)
+                tmp_path = f"{base}.tmp{ext}"
+                args = _render_args(
+                    pending["fmt"], tmp_path, section["content"], section["title_suffix"],
+                    manifest["video_data"], manifest["metadata_text"], manifest["keywords"],
+                )
+                try:
+                    elapsed = _run_render(pending["fmt"], args)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    # Don't leave a partial render behind for the next request or the sweeper
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+                metrics.observe("span_seconds", elapsed, span="render", format=pending["fmt"])
+                logger.debug(f"Rendered {filename} on demand in {elapsed:.2f}s")
+    finally:
+        with _render_locks_guard:
+            _render_locks.pop(path, None)
+    return path
 
 def clean_for_pdf(text):
     if not text: return ""
@@ -19,11 +131,27 @@ def clean_for_pdf(text):
     text = text.replace("&lt;br&gt;", "<br/>").replace("&lt;br/&gt;", "<br/>")
     return text
 
-def generate_documents(results: dict, video_data: dict, output_dir: str, options: list) -> dict:
+def generate_documents(results: dict, video_data: dict, output_dir: str, options: list, on_file=None, stats: dict = None, lazy: bool = None) -> dict:
     """
     Generates the requested files and returns a dictionary of file paths.
+    Text files are written first; DOCX/PDF/EPUB renders for every section are
+    then dispatched to the render pool in parallel, or, in lazy mode, deferred
+    to their first download.
+    `on_file(key, url)` is called as soon as each file has been written.
+    If `stats` is given it is filled with per-file render seconds.
     """
+    if lazy is None:
+        lazy = RENDER_MODE == "lazy"
     generated_files = {}
+    render_times = {}
+    start = time.perf_counter()
+
+    def add_file(key, path):
+        url = f"/download/{os.path.basename(output_dir)}/{os.path.basename(path)}"
+        generated_files[key] = url
+        downloads.precompress(path)
+        if on_file:
+            on_file(key, url)
     
     # 0. Global Request Log
     log_path = os.path.join(os.path.dirname(output_dir), "request_log.md")
@@ -52,29 +180,21 @@ def generate_documents(results: dict, video_data: dict, output_dir: str, options
         f"{'-'*40}\n\n"
     )
 
-    # Helper for Doc Generation
+    # Text outputs are cheap and written inline; binary formats are queued as render tasks
+    render_tasks = []  # (file key, format, path, section key)
+    sections = {}
+
     def generate_format(key, content, title_suffix):
         # Markdown
         md_path = os.path.join(output_dir, f"{base_filename}_{key}.md")
         with open(md_path, "w", encoding="utf-8") as f:
             f.write(f"# {video_data['title']} - {title_suffix}\n\n{metadata_text}{content}")
-        generated_files[f"{key}_md"] = f"/download/{os.path.basename(output_dir)}/{os.path.basename(md_path)}"
-        
-        # DOCX
-        docx_path = os.path.join(output_dir, f"{base_filename}_{key}.docx")
-        create_docx(f"{video_data['title']} - {title_suffix}", metadata_text + content, docx_path)
-        generated_files[f"{key}_docx"] = f"/download/{os.path.basename(output_dir)}/{os.path.basename(docx_path)}"
-        
-        # PDF (Professional)
-        pdf_path = os.path.join(output_dir, f"{base_filename}_{key}.pdf")
-        doc_title = f"{title_suffix}: {video_data['title']}"
-        create_professional_pdf(doc_title, content, pdf_path, video_data, keywords)
-        generated_files[f"{key}_pdf"] = f"/download/{os.path.basename(output_dir)}/{os.path.basename(pdf_path)}"
-        
-        # EPUB
-        epub_path = os.path.join(output_dir, f"{base_filename}_{key}.epub")
-        create_epub(f"{title_suffix}: {video_data['title']}", metadata_text + content, epub_path)
-        generated_files[f"{key}_epub"] = f"/download/{os.path.basename(output_dir)}/{os.path.basename(epub_path)}"
+        add_file(f"{key}_md", md_path)
+        sections[key] = {"content": content, "title_suffix": title_suffix}
+
+        # DOCX, PDF (Professional) and EPUB
+        for fmt in ("docx", "pdf", "epub"):
+            render_tasks.append((f"{key}_{fmt}", fmt, os.path.join(output_dir, f"{base_filename}_{key}.{fmt}"), key))
 
     if "summary" in results:
         generate_format("summary", results["summary"], "Summary")
@@ -87,16 +207,67 @@ def generate_documents(results: dict, video_data: dict, output_dir: str, options
         path = os.path.join(output_dir, f"{base_filename}_transcription_original.txt")
         with open(path, "w", encoding="utf-8") as f:
             f.write(f"{metadata_text}{results['transcription_orig']}")
-        generated_files["transcription_orig"] = f"/download/{os.path.basename(output_dir)}/{os.path.basename(path)}"
+        add_file("transcription_orig", path)
 
     if "transcription_es" in results:
         path = os.path.join(output_dir, f"{base_filename}_transcription_es.txt")
         with open(path, "w", encoding="utf-8") as f:
             f.write(f"{metadata_text}{results['transcription_es']}")
-        generated_files["transcription_es"] = f"/download/{os.path.basename(output_dir)}/{os.path.basename(path)}"
+        add_file("transcription_es", path)
+
+    def args_for(fmt, path, section_key):
+        section = sections[section_key]
+        return _render_args(fmt, path, section["content"], section["title_suffix"], video_data, metadata_text, keywords)
+
+    pool = None
+    if lazy:
+        # Persist everything needed to render later; the URLs are handed out now
+        manifest = {
+            "video_data": {k: video_data.get(k, '') for k in ("title", "webpage_url", "uploader", "upload_date")},
+            "metadata_text": metadata_text,
+            "keywords": keywords,
+            "sections": sections,
+            "files": {os.path.basename(path): {"section": section_key, "fmt": fmt} for _, fmt, path, section_key in render_tasks},
+        }
+        with open(os.path.join(output_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        for key, _, path, _ in render_tasks:
+            add_file(key, path)
+    else:
+        # Render DOCX/PDF/EPUB in parallel across processes
+        pool = _get_render_pool() if len(render_tasks) > 1 else None
+        if pool is not None:
+            futures = {pool.submit(_render, fmt, args_for(fmt, path, section_key)): (key, fmt, path) for key, fmt, path, section_key in render_tasks}
+            for future in as_completed(futures):
+                key, fmt, path = futures[future]
+                render_times[key] = round(future.result(), 3)
+                metrics.observe("span_seconds", render_times[key], span="render", format=fmt)
+                add_file(key, path)
+        else:
+            for key, fmt, path, section_key in render_tasks:
+                render_times[key] = round(_render(fmt, args_for(fmt, path, section_key)), 3)
+                metrics.observe("span_seconds", render_times[key], span="render", format=fmt)
+                add_file(key, path)
+
+    # Keep the usual key order (summary, guide, transcriptions) regardless of completion order
+    generated_files = dict(sorted(generated_files.items(), key=lambda item: _file_order(item[0])))
+
+    if stats is not None:
+        stats["files"] = render_times
+        stats["total_seconds"] = round(time.perf_counter() - start, 3)
+        stats["parallel"] = pool is not None
+        stats["mode"] = "lazy" if lazy else "eager"
 
     return generated_files
 
+SECTION_ORDER = ("summary", "guide", "transcription_orig", "transcription_es")
+FORMAT_ORDER = ("md", "docx", "pdf", "epub")
+
+def _file_order(key):
+    section = next((i for i, name in enumerate(SECTION_ORDER) if key == name or key.startswith(f"{name}_")), len(SECTION_ORDER))
+    suffix = key.rsplit("_", 1)[-1]
+    return (section, FORMAT_ORDER.index(suffix) if suffix in FORMAT_ORDER else 0)
+
 def create_docx(title, content, path):
     doc = Document()
     doc.add_heading(title, 0)
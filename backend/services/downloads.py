@@ -0,0 +1,216 @@
+import os
+import io
+import gzip
+import hashlib
+import logging
+import zipfile
+import mimetypes
+import threading
+import brotli
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi.responses import FileResponse, Response
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Text artifacts are stored next to gzip/brotli copies and served precompressed
+# to clients that accept them (see negotiate_encoding)
+COMPRESSIBLE_EXTENSIONS = (".md", ".txt")
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # preferred first
+VARIANT_EXTENSIONS = tuple(suffix for _, suffix in ENCODINGS)
+
+# Formats that are already compressed (DOCX/EPUB are ZIPs) are stored as-is in bundles
+STORED_EXTENSIONS = (".pdf", ".docx", ".epub", ".opus", ".m4a", ".mp3", ".webm")
+CHUNK_SIZE = 64 * 1024
+
+_etags = {}  # path -> ((size, mtime_ns, inode), etag)
+_etags_guard = threading.Lock()
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+    # mtime=0 keeps the output (and so its ETag) stable across rewrites
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress(path: str):
+    """
+    Writes the .br and .gz copies of a text artifact. No-op for other files.
+    """
+    if not path.endswith(COMPRESSIBLE_EXTENSIONS):
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    for encoding, suffix in ENCODINGS:
+        tmp_path = f"{path}{suffix}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_compress(data, encoding))
+        os.replace(tmp_path, path + suffix)
+
+
+def _fresh_variant(path: str, suffix: str):
+    """The precompressed copy of `path`, if it exists and is not older than the original."""
+    variant = path + suffix
+    try:
+        return variant if os.stat(variant).st_mtime_ns >= os.stat(path).st_mtime_ns else None
+    except FileNotFoundError:
+        return None
+
+
+def ensure_precompressed(path: str):
+    """
+    Creates missing or stale compressed copies (outputs written before
+    precompression existed, or rewritten since).
+    """
+    if path.endswith(COMPRESSIBLE_EXTENSIONS) and not all(_fresh_variant(path, suffix) for _, suffix in ENCODINGS):
+        precompress(path)
+
+
+def file_etag(path: str) -> str:
+    """
+    Strong ETag from the file's content hash, cached until its size, mtime or inode change.
+    """
+    st = os.stat(path)
+    key = (st.st_size, st.st_mtime_ns, st.st_ino)
+    with _etags_guard:
+        cached = _etags.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    etag = f'"{digest.hexdigest()}"'
+    with _etags_guard:
+        _etags[path] = (key, etag)
+    return etag
+
+
+def _variant_etag(etag: str, encoding: str) -> str:
+    # Each content-coding is a different representation, so it gets its own validator
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def negotiate_encoding(accept_encoding: str):
+    """
+    Returns the preferred encoding of ENCODINGS the client accepts ("br",
+    "gzip") or None for identity.
+    """
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding, _ in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def _etag_matches(header: str, etags: set) -> bool:
+    # If-None-Match uses the weak comparison: W/"x" matches "x"
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") in etags:
+            return True
+    return False
+
+
+def _not_modified(headers, etags: set, mtime: float) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etags)
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def file_response(path: str, headers, filename: str = None) -> Response:
+    """
+    Serves a file with a strong ETag, answering conditional requests with 304.
+    Text artifacts go out precompressed when the client accepts it; range
+    requests (and If-Range) are served from the identity representation.
+    """
+    etag = file_etag(path)
+    st = os.stat(path)
+    compressible = path.endswith(COMPRESSIBLE_EXTENSIONS)
+    response_headers = {"Vary": "Accept-Encoding"} if compressible else {}
+
+    encoding = None
+    if compressible and "range" not in headers:
+        encoding = negotiate_encoding(headers.get("accept-encoding"))
+        variant = _fresh_variant(path, dict(ENCODINGS)[encoding]) if encoding else None
+        if variant is None:
+            encoding = None
+
+    current = _variant_etag(etag, encoding) if encoding else etag
+    if _not_modified(headers, {current}, st.st_mtime):
+        metrics.inc("downloads_total", outcome="not_modified")
+        return Response(status_code=304, headers={**response_headers, "ETag": current})
+
+    response_headers["ETag"] = current
+    if encoding:
+        metrics.inc("downloads_total", outcome=encoding)
+        response_headers["Content-Encoding"] = encoding
+        # Type and Last-Modified of the original, so validators behave the same for every encoding
+        response_headers["Last-Modified"] = formatdate(st.st_mtime, usegmt=True)
+        media_type = mimetypes.guess_type(path)[0] or "text/plain"
+        return FileResponse(variant, headers=response_headers, filename=filename, media_type=media_type)
+    metrics.inc("downloads_total", outcome="range" if "range" in headers else "identity")
+    return FileResponse(path, headers=response_headers, filename=filename, stat_result=st)
+
+
+class _ChunkWriter(io.RawIOBase):
+    """
+    Unseekable sink for ZipFile: collects what it writes until drained, so the
+    archive streams out with data descriptors instead of being built up front.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return b"".join(chunks)
+
+
+def iter_zip(files: list):
+    """
+    Yields a ZIP archive of `files` ((archive name, path) pairs) chunk by chunk.
+    Only one read block per file is held in memory at a time. Text is deflated,
+    already-compressed formats are stored.
+    """
+    sink = _ChunkWriter()
+    with zipfile.ZipFile(sink, "w") as archive:
+        for name, path in files:
+            info = zipfile.ZipInfo.from_file(path, name)
+            info.compress_type = zipfile.ZIP_STORED if path.endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+            # from_file sets file_size, which makes ZipFile pick ZIP64 for files over 2 GiB
+            with open(path, "rb") as src, archive.open(info, "w") as dest:
+                while block := src.read(CHUNK_SIZE):
+                    dest.write(block)
+                    if chunk := sink.drain():
+                        yield chunk
+            if chunk := sink.drain():
+                yield chunk
+    yield sink.drain()
@@ -1,77 +1,71 @@
+import logging
 import os
+import re
+import json
+import random
+import asyncio
+import shutil
+import subprocess
+import tempfile
 import google.generativeai as genai
-import time
 from dotenv import load_dotenv
+from services import gemini_files, gemini_quota, metrics
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 API_KEY = os.getenv("GOOGLE_API_KEY")
 if not API_KEY:
     # Just a warning, might crash later if not set
-    print("WARNING: GOOGLE_API_KEY not found in environment variables.")
+    logger.warning("GOOGLE_API_KEY not found in environment variables.")
 
 genai.configure(api_key=API_KEY)
 
-async def analyze_content(audio_path: str, options: list) -> dict:
-    """
-    Uploads audio to Gemini and performs analysis based on options.
-    """
-    
-    print(f"Uploading file: {audio_path}")
-    audio_file = genai.upload_file(path=audio_path)
-    
-    # Wait for file to be active
-    while audio_file.state.name == "PROCESSING":
-        print("Waiting for audio processing...")
-        time.sleep(2)
-        audio_file = genai.get_file(audio_file.name)
-        
-    if audio_file.state.name == "FAILED":
-        raise Exception("Audio processing failed.")
+MODEL_NAME = 'gemini-flash-latest'
 
-    print("Audio processing complete. Generating content...")
+# Chunked mode: videos longer than CHUNK_THRESHOLD_MINUTES are split into
+# CHUNK_MINUTES windows analyzed concurrently (at most CHUNK_CONCURRENCY at once)
+CHUNK_MINUTES = float(os.getenv("GEMINI_CHUNK_MINUTES", "20"))
+CHUNK_THRESHOLD_MINUTES = float(os.getenv("GEMINI_CHUNK_THRESHOLD_MINUTES", "40"))
+CHUNK_CONCURRENCY = int(os.getenv("GEMINI_CHUNK_CONCURRENCY", "4"))
 
-    model = genai.GenerativeModel('gemini-flash-latest')
-    
-    # Construct the prompt based on options
-    prompt_parts = [
-        "You are an expert video analyst and educational content creator.",
-        "Analyze the provided audio from a YouTube video and generate the following outputs based on the requested sections.",
-        "Please separate your response clearly with headers like '### SECTION_NAME'."
-    ]
+# Re-requests of a section that came back missing or malformed (others are kept).
+# Transient API errors are retried by the quota scheduler (GEMINI_RETRIES), not here
+SECTION_RETRIES = int(os.getenv("GEMINI_SECTION_RETRIES", "2"))
+
+# File readiness polling: first poll estimated from the file size, then
+# exponential backoff with jitter up to READY_MAX_INTERVAL, giving up after READY_TIMEOUT
+READY_TIMEOUT_SECONDS = float(os.getenv("GEMINI_READY_TIMEOUT", "600"))
+READY_MIN_INTERVAL = float(os.getenv("GEMINI_READY_MIN_INTERVAL", "1"))
+READY_MAX_INTERVAL = float(os.getenv("GEMINI_READY_MAX_INTERVAL", "30"))
+READY_BYTES_PER_SECOND = float(os.getenv("GEMINI_READY_BYTES_PER_SECOND", "2000000"))
+
+ANALYSIS_MODES = ("auto", "single", "chunked", "sections")
 
-    prompt_parts.append("""
-    Please include a section ### KEYWORDS at the beginning with a list of 5-10 relevant keywords/tags for this video.
-    """)
+AUDIO_CONTEXT = "\nUsing the provided audio file, generate the response."
 
-    if "summary" in options:
-        prompt_parts.append("""
-        ### SUMMARY
+SECTION_INSTRUCTIONS = {
+    "keywords": """
+        A list of 5-10 relevant keywords/tags for this video.
+        """,
+    "summary": """
         Generate an EXTENSIVE and DETAILED summary of the video content in Spanish.
         - Go deep into the details, arguments, and examples provided.
         - Do not be brief. Aim for a comprehensive overview that covers all aspects of the video.
         - Structure it with clear subheadings.
-        """)
-        
-    if "transcription_orig" in options:
-        prompt_parts.append("""
-        ### TRANSCRIPTION_ORIG
-        Provide a transcription of the video in its original language. 
-        Identify different speakers (e.g., 'Speaker A', 'Speaker B') if possible. 
+        """,
+    "transcription_orig": """
+        Provide a transcription of the video in its original language.
+        Identify different speakers (e.g., 'Speaker A', 'Speaker B') if possible.
         Do not include timestamps.
-        """)
-
-    if "transcription_es" in options:
-        prompt_parts.append("""
-        ### TRANSCRIPTION_ES
+        """,
+    "transcription_es": """
         Provide a transcription of the video translated to Spanish.
         Identify different speakers.
         Do not include timestamps.
-        """)
-        
-    if "guide" in options:
-        prompt_parts.append("""
-        ### GUIDE
+        """,
+    "guide": """
         Create a comprehensive Didactic Guide (in Spanish) for the content.
         - Structure it as a professional course script or tutorial.
         - Section 1: Introduction & Learning Objectives.
@@ -79,56 +73,565 @@ async def analyze_content(audio_path: str, options: list) -> dict:
           - For each module, provide a detailed explanation and a text-based schema or infographic description.
         - Section 3: Key Takeaways & Conclusion.
         - Section 4: Quiz/Self-assessment questions.
-        """)
+        """,
+    # Chunked mode only: intermediate notes that feed the final summary/guide pass
+    "notes": """
+        Write DETAILED notes (in Spanish) of everything covered in this audio segment:
+        topics, arguments, examples, definitions and conclusions, in the order they appear.
+        These notes will be merged with the notes of the other segments, so do not add an introduction or conclusion.
+        """,
+}
+
+# Response schema per section: the model returns one JSON object with a field
+# per requested section, so nothing depends on how it formats headers
+SECTION_SCHEMAS = {
+    "keywords": {"type": "array", "items": {"type": "string"}},
+    "summary": {"type": "string"},
+    "transcription_orig": {"type": "string"},
+    "transcription_es": {"type": "string"},
+    "guide": {"type": "string"},
+    "notes": {"type": "string"},
+}
+
+# Generation counters, to see how often sections have to be re-requested
+generation_stats = {"requests": 0, "sections_received": 0, "sections_rerequested": 0, "sections_failed": 0}
+
+def requested_sections(options: list) -> list:
+    return ["keywords"] + [o for o in SECTION_INSTRUCTIONS if o in options and o != "keywords"]
+
+def response_schema(sections: list) -> dict:
+    return {
+        "type": "object",
+        "properties": {section: SECTION_SCHEMAS[section] for section in sections},
+        "required": list(sections),
+    }
+
+def build_prompt(sections: list, intro: str = None) -> str:
+    """
+    Builds the prompt requesting the given sections (in SECTION_INSTRUCTIONS order)
+    as fields of a JSON object.
+    """
+    prompt_parts = [
+        "You are an expert video analyst and educational content creator.",
+        intro or "Analyze the provided audio from a YouTube video and generate the following outputs based on the requested sections.",
+        "Respond with a JSON object with one field per requested section. Text fields may use Markdown."
+    ]
+    for section in SECTION_INSTRUCTIONS:
+        if section in sections:
+            prompt_parts.append(f'Field "{section}":{SECTION_INSTRUCTIONS[section]}')
+    return "\n".join(prompt_parts)
+
+def validate_section(name: str, value):
+    """
+    Returns the section as text, or None if it is missing or malformed.
+    """
+    if name == "keywords" and isinstance(value, list):
+        keywords = [str(keyword).strip() for keyword in value if str(keyword).strip()]
+        return ", ".join(keywords) or None
+    if isinstance(value, str) and value.strip():
+        return value.strip()
+    return None
+
+class JsonSectionStreamParser:
+    """
+    Incrementally scans a streamed JSON object. `on_section(name, content)` is
+    called as soon as a top-level field is complete and valid; valid fields are
+    collected in `results`, so a truncated or broken response still keeps every
+    section that arrived intact.
+    """
+    def __init__(self, sections: list, on_section=None):
+        self.sections = sections
+        self.on_section = on_section
+        self.results = {}
+        self.buffer = ""
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect = "key"  # key -> colon -> value
+        self.key = None
+        self.token_start = None
 
-    prompt_parts.append("Using the provided audio file, generate the response.")
+    def feed(self, text: str):
+        start = len(self.buffer)
+        self.buffer += text
+        for i in range(start, len(self.buffer)):
+            self._char(i, self.buffer[i])
 
-    response = model.generate_content([audio_file, "\n".join(prompt_parts)])
-    
-    # Clean up file after generation (optional, but good practice if not needed anymore)
-    # genai.delete_file(audio_file.name) 
-    
-    # Parse the response (Simple parsing by splitting headers)
-    # This is a basic implementation. Ideally, we ask for JSON or robust delimiters.
+    def _char(self, i: int, c: str):
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif c == "\\":
+                self.escape = True
+            elif c == '"':
+                self.in_string = False
+                if self.depth == 1 and self.expect == "key":
+                    self.key = json.loads(self.buffer[self.token_start:i + 1])
+                    self.expect = "colon"
+            return
+        if c == '"':
+            self.in_string = True
+            if self.depth == 1 and self.expect == "key":
+                self.token_start = i
+        elif c in "{[":
+            self.depth += 1
+        elif c in "}]":
+            self.depth -= 1
+            if self.depth == 0 and self.expect == "value":
+                self._finish_value(i)
+        elif c == ":" and self.depth == 1 and self.expect == "colon":
+            self.token_start = i + 1
+            self.expect = "value"
+        elif c == "," and self.depth == 1 and self.expect == "value":
+            self._finish_value(i)
+
+    def _finish_value(self, end: int):
+        self.expect = "key"
+        if self.key not in self.sections:
+            return
+        try:
+            value = json.loads(self.buffer[self.token_start:end])
+        except ValueError:
+            value = None
+        content = validate_section(self.key, value)
+        if content is None:
+            logger.warning(f"Section '{self.key}' is malformed")
+            return
+        self.results[self.key] = content
+        if self.on_section:
+            self.on_section(self.key, content)
+
+def _response_text(response) -> str:
     try:
-        text_content = response.text
+        return response.text
     except ValueError:
-        print(f"Safety Feedback: {response.prompt_feedback}")
+        logger.warning(f"Safety Feedback: {response.prompt_feedback}")
         raise Exception(f"Gemini refused to generate content. Safety feedback: {response.prompt_feedback}")
-    
-    results = {}
-    
-    # Very naive parsing, assuming the model follows instructions perfectly
-    # A better way would be to ask for JSON output
-    
-    current_section = None
-    buffer = []
-    
-    for line in text_content.split('\n'):
-        if line.strip().startswith("### SUMMARY"):
-            current_section = "summary"
-            buffer = []
-        elif line.strip().startswith("### TRANSCRIPTION_ORIG"):
-            if current_section: results[current_section] = "\n".join(buffer).strip()
-            current_section = "transcription_orig"
-            buffer = []
-        elif line.strip().startswith("### TRANSCRIPTION_ES"):
-            if current_section: results[current_section] = "\n".join(buffer).strip()
-            current_section = "transcription_es"
-            buffer = []
-        elif line.strip().startswith("### KEYWORDS"):
-            if current_section: results[current_section] = "\n".join(buffer).strip()
-            current_section = "keywords"
-            buffer = []
-        elif line.strip().startswith("### GUIDE"):
-            if current_section: results[current_section] = "\n".join(buffer).strip()
-            current_section = "guide"
-            buffer = []
+
+def _record_usage(usage, ticket: dict = None):
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    metrics.inc("gemini_tokens_total", prompt_tokens, kind="prompt")
+    metrics.inc("gemini_tokens_total", getattr(usage, "candidates_token_count", 0) or 0, kind="output")
+    if ticket is not None and prompt_tokens:
+        # Lets the quota scheduler replace its estimate with the real count
+        ticket["used"] = prompt_tokens
+
+async def wait_until_active(audio_file, size_bytes: int = None, on_event=None, timeout: float = None):
+    """
+    Waits for an uploaded file to leave the PROCESSING state without holding a
+    thread: the wait is an asyncio sleep (cancellable) and only the short
+    get_file call runs in a worker thread. The first delay is estimated from the
+    file size, then grows exponentially with jitter. Raises TimeoutError after
+    `timeout` seconds (READY_TIMEOUT_SECONDS by default).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (timeout or READY_TIMEOUT_SECONDS)
+    estimate = (size_bytes or 0) / READY_BYTES_PER_SECOND
+    delay = min(max(estimate, READY_MIN_INTERVAL), READY_MAX_INTERVAL)
+
+    while audio_file.state.name == "PROCESSING":
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise TimeoutError(f"Gemini file {audio_file.name} still PROCESSING after {timeout or READY_TIMEOUT_SECONDS:.1f}s.")
+        if on_event:
+            on_event("gemini", {"state": "PROCESSING"})
+        wait = min(random.uniform(delay * 0.5, delay * 1.5), remaining)
+        logger.debug(f"Waiting for audio processing ({wait:.1f}s)...")
+        await asyncio.sleep(wait)
+        name = audio_file.name
+        audio_file = await gemini_quota.run(lambda ticket: genai.get_file(name), metered=False)
+        delay = min(delay * 2, READY_MAX_INTERVAL)
+
+    return audio_file
+
+async def _reuse_file(name: str):
+    """The Gemini file `name` if it still exists and has not failed, else None."""
+    try:
+        audio_file = await gemini_quota.run(lambda ticket: genai.get_file(name), metered=False)
+    except Exception as e:
+        logger.debug(f"Gemini file {name} is gone: {e}")
+        await asyncio.to_thread(gemini_files.forget, name)
+        return None
+    if audio_file.state.name == "FAILED":
+        await asyncio.to_thread(gemini_files.forget, name)
+        return None
+    logger.debug(f"Reusing uploaded Gemini file {name}")
+    return audio_file
+
+async def _reuse_registered_file(content_hash: str, source_key: str):
+    name = await asyncio.to_thread(gemini_files.lookup, content_hash, source_key)
+    if not name:
+        return None
+    return await _reuse_file(name)
+
+async def upload_and_wait(audio_path: str, on_event=None, reuse: bool = True, source_key: str = None, file_name: str = None):
+    """
+    Uploads a file to Gemini and waits until it leaves the PROCESSING state.
+    `file_name` is an upload made for the same audio by an earlier, interrupted
+    run of the job, tried first. With `reuse`, a still-valid upload of the same
+    content (or the same `source_key`) is returned instead of uploading again.
+    """
+    audio_file = await _reuse_file(file_name) if file_name else None
+    content_hash = None
+    if reuse and audio_file is None:
+        content_hash = await asyncio.to_thread(gemini_files.file_hash, audio_path)
+        audio_file = await _reuse_registered_file(content_hash, source_key)
+
+    if audio_file is None:
+        # The SDK calls are blocking, so they run in worker threads to keep the event loop free
+        logger.debug(f"Uploading file: {audio_path}")
+        if on_event:
+            on_event("gemini", {"state": "UPLOADING"})
+        size = os.path.getsize(audio_path)
+        with metrics.span("upload"):
+            audio_file = await gemini_quota.run(lambda ticket: genai.upload_file(path=audio_path), metered=False)
+        metrics.inc("bytes_uploaded_total", size)
+        if reuse:
+            await asyncio.to_thread(gemini_files.register, content_hash, audio_file, source_key, size)
+
+    with metrics.span("gemini_processing"):
+        audio_file = await wait_until_active(audio_file, os.path.getsize(audio_path), on_event)
+
+    if audio_file.state.name == "FAILED":
+        await asyncio.to_thread(gemini_files.forget, audio_file.name)
+        raise Exception("Audio processing failed.")
+
+    if on_event:
+        on_event("gemini", {"state": audio_file.state.name, "name": audio_file.name})
+    return audio_file
+
+async def generate_text(contents: list) -> str:
+    model = genai.GenerativeModel(MODEL_NAME)
+
+    def run(ticket):
+        try:
+            with metrics.span("generation"):
+                response = model.generate_content(contents)
+        except Exception:
+            metrics.inc("gemini_requests_total", outcome="error")
+            raise
+        metrics.inc("gemini_requests_total", outcome="ok")
+        _record_usage(getattr(response, "usage_metadata", None), ticket)
+        return _response_text(response)
+
+    return await gemini_quota.run(run, gemini_quota.estimate_tokens(contents))
+
+def _stream_generate(contents: list, on_text, generation_config: dict = None, ticket: dict = None) -> str:
+    model = genai.GenerativeModel(MODEL_NAME)
+    response = model.generate_content(contents, generation_config=generation_config, stream=True)
+    parts = []
+    usage = None
+    try:
+        for chunk in response:
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            text = _response_text(chunk)
+            parts.append(text)
+            on_text(text)
+    finally:
+        # The last chunk carries the usage totals for the whole stream
+        _record_usage(usage, ticket)
+    return "".join(parts)
+
+async def generate_sections(contents: list, sections: list, on_section=None) -> dict:
+    """
+    Streams a schema-constrained JSON generation of `sections` and parses it as
+    it arrives; `on_section(name, content)` is called (from a worker thread) as
+    each field completes. Returns the valid sections; missing or malformed ones
+    are absent. If the stream breaks, the sections received so far are kept.
+    The call goes through the quota scheduler, which retries it on transient
+    errors (429, 5xx) as long as nothing has been received yet.
+    """
+    generation_config = {"response_mime_type": "application/json", "response_schema": response_schema(sections)}
+
+    def run(ticket):
+        parser = JsonSectionStreamParser(sections, on_section)
+        generation_stats["requests"] += 1
+        try:
+            with metrics.span("generation"):
+                _stream_generate(contents, parser.feed, generation_config, ticket)
+            metrics.inc("gemini_requests_total", outcome="ok")
+        except Exception as e:
+            metrics.inc("gemini_requests_total", outcome="error")
+            if not parser.results:
+                raise
+            logger.warning(f"Generation stream broke after {len(parser.results)} sections: {e}")
+        generation_stats["sections_received"] += len(parser.results)
+        metrics.inc("gemini_sections_total", len(parser.results), outcome="received")
+        return parser.results
+
+    return await gemini_quota.run(run, gemini_quota.estimate_tokens(contents))
+
+async def _request_section(media: list, section: str, context: str, retries: int, on_section=None) -> str:
+    """
+    Requests a single section on its own, re-requesting it up to `retries` times
+    while it comes back missing or malformed. API errors are not retried here:
+    gemini_quota.run already retried them, so they propagate.
+    """
+    intro = (
+        "Analyze the provided content and generate ONLY the field requested below. "
+        "Do not generate any other field."
+    )
+    for attempt in range(retries + 1):
+        result = await generate_sections(media + [build_prompt([section], intro) + context], [section], on_section)
+        if section in result:
+            return result[section]
+        if attempt < retries:
+            logger.warning(f"Section '{section}' came back missing or malformed (attempt {attempt + 1}). Retrying...")
+    raise Exception(f"Missing or malformed section '{section}'.")
+
+async def request_sections(media: list, sections: list, intro: str = None, context: str = "", retries: int = None, on_section=None) -> dict:
+    """
+    Requests all `sections` in one JSON generation, then re-requests only the
+    sections that came back missing or malformed. Keywords are best-effort; any
+    other section that still fails after `retries` fails the request.
+    `media` holds the uploaded files (if any) and `context` is appended to the prompt.
+    """
+    retries = SECTION_RETRIES if retries is None else retries
+    results = await generate_sections(media + [build_prompt(sections, intro) + context], sections, on_section)
+
+    missing = [section for section in sections if section not in results]
+    if not missing:
+        return results
+    logger.warning(f"Re-requesting missing/malformed sections: {', '.join(missing)}")
+    generation_stats["sections_rerequested"] += len(missing)
+    metrics.inc("gemini_sections_total", len(missing), outcome="rerequested")
+    retried = await asyncio.gather(
+        *[_request_section(media, section, context, retries, on_section) for section in missing],
+        return_exceptions=True,
+    )
+    errors = {}
+    for section, content in zip(missing, retried):
+        if isinstance(content, BaseException):
+            errors[section] = content
         else:
-            if current_section:
-                buffer.append(line)
-    
-    if current_section:
-        results[current_section] = "\n".join(buffer).strip()
+            results[section] = content
+    generation_stats["sections_failed"] += len(errors)
+    metrics.inc("gemini_sections_total", len(errors), outcome="failed")
 
+    failed = [section for section in errors if section != "keywords"]
+    if failed:
+        raise Exception(f"Sections failed: {', '.join(f'{s} ({errors[s]})' for s in failed)}")
     return results
+
+def probe_duration(audio_path: str):
+    """
+    Returns the audio duration in seconds using ffmpeg, or None if unknown.
+    """
+    try:
+        result = subprocess.run(["ffmpeg", "-i", audio_path], capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def split_audio(audio_path: str, chunk_seconds: float, output_dir: str) -> list:
+    """
+    Splits audio into consecutive windows of `chunk_seconds` without re-encoding.
+    Returns the chunk paths in order.
+    """
+    ext = os.path.splitext(audio_path)[1]
+    pattern = os.path.join(output_dir, f"chunk_%03d{ext}")
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-i", audio_path,
+        "-f", "segment", "-segment_time", str(int(chunk_seconds)),
+        "-reset_timestamps", "1", "-c", "copy", pattern,
+    ]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"FFmpeg audio split failed: {e.stderr.strip()[-500:]}")
+    return sorted(
+        os.path.join(output_dir, name) for name in os.listdir(output_dir)
+        if name.startswith("chunk_")
+    )
+
+async def analyze_content(audio_path: str, options: list, duration: float = None, mode: str = "auto", on_event=None, source_key: str = None, completed: dict = None, gemini_file: str = None) -> dict:
+    """
+    Uploads audio to Gemini and performs analysis based on options.
+    `mode` is 'single' (one request), 'chunked' (split + merge), 'sections'
+    (one concurrent request per section) or 'auto', which chunks audio longer
+    than CHUNK_THRESHOLD_MINUTES and otherwise uses a single request.
+    `on_event(event, data)` receives 'gemini' state changes and a 'section'
+    event as each section becomes available; it may be called from worker threads.
+    `source_key` identifies the audio (video + profile) for upload reuse.
+    `completed` holds sections already received by an interrupted run, and
+    `gemini_file` the name of its upload; in the single and sections modes only
+    the other sections are requested, on that upload if it is still there.
+    """
+    if mode not in ANALYSIS_MODES:
+        raise Exception(f"Unknown analysis mode '{mode}'. Available: {', '.join(ANALYSIS_MODES)}")
+
+    completed = {name: content for name, content in (completed or {}).items() if name in requested_sections(options)}
+    if completed and all(section in completed for section in requested_sections(options)):
+        return completed
+
+    if mode == "auto":
+        if duration is None:
+            duration = await asyncio.to_thread(probe_duration, audio_path)
+        mode = "chunked" if duration and duration > CHUNK_THRESHOLD_MINUTES * 60 else "single"
+
+    if mode == "chunked":
+        return await analyze_content_chunked(audio_path, options, on_event=on_event)
+    if mode == "sections":
+        return await analyze_content_sections(audio_path, options, on_event=on_event, source_key=source_key, completed=completed, gemini_file=gemini_file)
+
+    audio_file = await upload_and_wait(audio_path, on_event, source_key=source_key, file_name=gemini_file)
+    logger.debug("Audio processing complete. Generating content...")
+
+    # The upload is kept for reuse; gemini_files.run_reaper deletes it once expired or idle
+    results = await request_sections(
+        [audio_file],
+        [section for section in requested_sections(options) if section not in completed],
+        context=AUDIO_CONTEXT,
+        on_section=(lambda name, content: on_event("section", {"name": name, "content": content})) if on_event else None,
+    )
+    return {**completed, **results}
+
+async def analyze_content_sections(audio_path: str, options: list, retries: int = None, on_event=None, source_key: str = None, completed: dict = None, gemini_file: str = None) -> dict:
+    """
+    Uploads the audio once and requests every section concurrently. Sections are
+    collected as they finish; a failing section is retried on its own. Keywords are
+    best-effort, any other section that still fails after retries fails the analysis.
+    """
+    retries = SECTION_RETRIES if retries is None else retries
+    audio_file = await upload_and_wait(audio_path, on_event, source_key=source_key, file_name=gemini_file)
+    logger.debug("Audio processing complete. Generating sections concurrently...")
+
+    completed = completed or {}
+    sections = [section for section in requested_sections(options) if section not in completed]
+
+    async def run(section):
+        try:
+            return section, await _request_section([audio_file], section, AUDIO_CONTEXT, retries), None
+        except Exception as e:
+            return section, None, e
+
+    results = dict(completed)
+    errors = {}
+    for next_done in asyncio.as_completed([run(section) for section in sections]):
+        section, content, error = await next_done
+        if error is not None:
+            logger.error(f"Section '{section}' failed: {error}")
+            errors[section] = error
+            continue
+        results[section] = content
+        if on_event:
+            on_event("section", {"name": section, "content": content})
+
+    failed = [section for section in errors if section != "keywords"]
+    if failed:
+        raise Exception(f"Sections failed: {', '.join(f'{s} ({errors[s]})' for s in failed)}")
+    return results
+
+async def _analyze_chunk(index: int, chunk_path: str, sections: list, total: int, semaphore: asyncio.Semaphore) -> dict:
+    async with semaphore:
+        logger.debug(f"Analyzing chunk {index + 1}/{total}")
+        chunk_file = await upload_and_wait(chunk_path, reuse=False)
+        await asyncio.to_thread(gemini_files.register_transient, chunk_file)
+        intro = (
+            f"Analyze the provided audio, which is segment {index + 1} of {total} of a longer YouTube video, "
+            "and generate the following outputs based on the requested sections."
+        )
+        try:
+            return await request_sections([chunk_file], sections, intro, AUDIO_CONTEXT)
+        finally:
+            # Chunk uploads are single-use
+            try:
+                await asyncio.to_thread(genai.delete_file, chunk_file.name)
+            except Exception as e:
+                logger.debug(f"Could not delete chunk file {chunk_file.name}: {e}")
+            await asyncio.to_thread(gemini_files.forget, chunk_file.name)
+
+async def analyze_content_chunked(audio_path: str, options: list, chunk_minutes: float = None, concurrency: int = None, on_event=None) -> dict:
+    """
+    Map/reduce analysis for long audio: splits the file into time windows,
+    transcribes and takes notes for each window concurrently, then merges the
+    transcriptions and runs one text-only pass for keywords, summary and guide.
+    """
+    chunk_seconds = (chunk_minutes or CHUNK_MINUTES) * 60
+    semaphore = asyncio.Semaphore(concurrency or CHUNK_CONCURRENCY)
+
+    # Per-chunk sections: transcriptions as requested, plus notes feeding the reduce pass
+    chunk_sections = ["keywords"] + [o for o in ("transcription_orig", "transcription_es") if o in options]
+    needs_reduce = "summary" in options or "guide" in options
+    if needs_reduce:
+        chunk_sections.append("notes")
+
+    chunk_dir = tempfile.mkdtemp(prefix="chunks_", dir=os.path.dirname(audio_path) or ".")
+    try:
+        chunk_paths = await asyncio.to_thread(split_audio, audio_path, chunk_seconds, chunk_dir)
+        logger.debug(f"Split audio into {len(chunk_paths)} chunks of {chunk_seconds / 60:.0f} min")
+        done = [0]
+
+        async def run_chunk(i, path):
+            result = await _analyze_chunk(i, path, chunk_sections, len(chunk_paths), semaphore)
+            done[0] += 1
+            if on_event:
+                on_event("chunk", {"done": done[0], "total": len(chunk_paths)})
+            return result
+
+        chunk_results = await asyncio.gather(*[run_chunk(i, path) for i, path in enumerate(chunk_paths)])
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    results = {}
+    for key in ("transcription_orig", "transcription_es"):
+        if key in options:
+            results[key] = "\n\n".join(chunk.get(key, "") for chunk in chunk_results).strip()
+
+    chunk_keywords = "\n".join(chunk.get("keywords", "") for chunk in chunk_results)
+    if not needs_reduce:
+        results["keywords"] = chunk_keywords.strip()
+
+    if on_event:
+        for name, content in results.items():
+            on_event("section", {"name": name, "content": content})
+    if not needs_reduce:
+        return results
+
+    # Reduce pass: text-only, built from the ordered per-chunk notes
+    notes = "\n\n".join(
+        f"--- Segment {i + 1} of {len(chunk_results)} ---\n{chunk.get('notes', '')}"
+        for i, chunk in enumerate(chunk_results)
+    )
+    reduce_sections = ["keywords"] + [o for o in ("summary", "guide") if o in options]
+    intro = (
+        "The following are detailed notes taken from consecutive segments of a long YouTube video, "
+        "plus the keywords found in each segment. Treat them as the full content of the video "
+        "and generate the following outputs based on the requested sections."
+    )
+    logger.debug("Running merge pass over chunk notes")
+    merged = await request_sections([], reduce_sections, intro, f"\n\nSEGMENT KEYWORDS:\n{chunk_keywords}\n\nSEGMENT NOTES:\n{notes}")
+    if on_event:
+        for name, content in merged.items():
+            on_event("section", {"name": name, "content": content})
+    results.update(merged)
+    return results
+
+# Batch summaries: per-video text is capped so large playlists fit in one request
+BATCH_REPORT_CHARS = int(os.getenv("GEMINI_BATCH_REPORT_CHARS", "20000"))
+
+async def summarize_batch(reports: list) -> str:
+    """
+    Text-only pass over several analyzed videos (`reports` is a list of
+    {"title", "text"}) producing one cross-video summary in Markdown.
+    """
+    prompt = "\n".join([
+        "You are an expert video analyst and educational content creator.",
+        "The following are the analyses of a series of related YouTube videos (for example, the lessons of a course).",
+        "Write an EXTENSIVE cross-video summary in Spanish, in Markdown:",
+        "- An overview of the whole series and how the videos relate to each other.",
+        "- The main themes, each with the videos where it appears.",
+        "- A short paragraph per video, in the given order.",
+        "- Key takeaways for the series as a whole.",
+    ])
+    videos = "\n\n".join(
+        f"--- Video {i + 1}: {report['title']} ---\n{report['text'][:BATCH_REPORT_CHARS]}"
+        for i, report in enumerate(reports)
+    )
+    return await generate_text([f"{prompt}\n\n{videos}"])
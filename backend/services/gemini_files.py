@@ -0,0 +1,176 @@
+import logging
+import os
+import json
+import time
+import hashlib
+import asyncio
+import threading
+from datetime import datetime, timezone
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# Registry of uploaded Gemini files, keyed by the SHA-256 of the audio content
+REGISTRY_FILE = os.getenv("GEMINI_FILE_REGISTRY", "gemini_files.json")
+# Gemini deletes uploads after 48h; stop reusing them a bit earlier
+FILE_TTL_HOURS = float(os.getenv("GEMINI_FILE_TTL_HOURS", "40"))
+# Uploads not used for this long are deleted by the reaper
+FILE_IDLE_HOURS = float(os.getenv("GEMINI_FILE_IDLE_HOURS", "6"))
+REAPER_INTERVAL_SECONDS = float(os.getenv("GEMINI_FILE_REAPER_INTERVAL", "600"))
+
+# content_hash -> {"name", "source_key", "size", "uploaded_at", "expires_at", "last_used"}
+_registry = None
+# Registry reads and writes run in worker threads (see gemini.upload_and_wait)
+_lock = threading.Lock()
+
+
+def _load():
+    global _registry
+    if _registry is not None:
+        return _registry
+    _registry = {}
+    if os.path.exists(REGISTRY_FILE):
+        try:
+            with open(REGISTRY_FILE, "r") as f:
+                _registry = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read Gemini file registry: {e}")
+    return _registry
+
+
+def _save():
+    tmp_path = f"{REGISTRY_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(_registry, f)
+    os.replace(tmp_path, REGISTRY_FILE)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _expiry_timestamp(file_obj) -> float:
+    """
+    Uses the file's own expiration time when available, capped by FILE_TTL_HOURS.
+    """
+    ttl_expiry = time.time() + FILE_TTL_HOURS * 3600
+    expiration = getattr(file_obj, "expiration_time", None)
+    if isinstance(expiration, datetime):
+        if expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=timezone.utc)
+        # Keep a one-hour safety margin before Gemini removes the file
+        return min(ttl_expiry, expiration.timestamp() - 3600)
+    return ttl_expiry
+
+
+def lookup(content_hash: str = None, source_key: str = None):
+    """
+    Returns the Gemini file name registered for this content (or, failing that,
+    for the same source video/profile) if it has not expired yet.
+    """
+    with _lock:
+        registry = _load()
+        entry = registry.get(content_hash) if content_hash else None
+        if entry is None and source_key:
+            entry = next((e for e in registry.values() if e.get("source_key") == source_key), None)
+        if entry is None or entry["expires_at"] <= time.time():
+            return None
+        entry["last_used"] = time.time()
+        _save()
+        return entry["name"]
+
+
+def register(content_hash: str, file_obj, source_key: str = None, size: int = None):
+    now = time.time()
+    with _lock:
+        _load()[content_hash] = {
+            "name": file_obj.name,
+            "source_key": source_key,
+            "size": size,
+            "uploaded_at": now,
+            "expires_at": _expiry_timestamp(file_obj),
+            "last_used": now,
+        }
+        _save()
+
+
+def register_transient(file_obj):
+    """
+    Records a single-use upload (an audio chunk) so the reaper can delete it if
+    the process dies before the chunk's own cleanup runs. Never returned by lookup.
+    """
+    now = time.time()
+    with _lock:
+        _load()[f"transient:{file_obj.name}"] = {
+            "name": file_obj.name,
+            "source_key": None,
+            "size": None,
+            "uploaded_at": now,
+            "expires_at": _expiry_timestamp(file_obj),
+            "last_used": now,
+            "transient": True,
+        }
+        _save()
+
+
+def forget(name: str):
+    with _lock:
+        registry = _load()
+        for content_hash in [h for h, e in registry.items() if e["name"] == name]:
+            del registry[content_hash]
+        _save()
+
+
+def stats() -> dict:
+    with _lock:
+        registry = dict(_load())
+    return {
+        "files": sum(1 for e in registry.values() if not e.get("transient")),
+        "transient_files": sum(1 for e in registry.values() if e.get("transient")),
+        "bytes": sum(e.get("size") or 0 for e in registry.values()),
+    }
+
+
+def _stale_names(now: float) -> set:
+    idle_cutoff = now - FILE_IDLE_HOURS * 3600
+    with _lock:
+        return {e["name"] for e in _load().values() if e["expires_at"] <= now or e["last_used"] <= idle_cutoff}
+
+
+async def reap_once(now: float = None) -> list:
+    """
+    Deletes registered uploads that expired or sat unused for FILE_IDLE_HOURS,
+    including chunk uploads left behind by an interrupted analysis. Only files
+    this deployment registered are touched: the API key's other uploads (other
+    deployments, other tools) are not ours to delete. Returns the deleted file names.
+    """
+    now = now or time.time()
+    stale = await asyncio.to_thread(_stale_names, now)
+
+    deleted = []
+    for name in stale:
+        try:
+            await asyncio.to_thread(genai.delete_file, name)
+            deleted.append(name)
+        except Exception as e:
+            # Already gone (expired remotely) counts as deleted
+            logger.debug(f"Could not delete Gemini file {name}: {e}")
+            deleted.append(name)
+        await asyncio.to_thread(forget, name)
+
+    if deleted:
+        logger.debug(f"Gemini file reaper deleted {len(deleted)} files")
+    return deleted
+
+
+async def run_reaper(interval: float = REAPER_INTERVAL_SECONDS):
+    while True:
+        try:
+            await reap_once()
+        except Exception as e:
+            logger.warning(f"Gemini file reaper failed: {e}")
+        await asyncio.sleep(interval)
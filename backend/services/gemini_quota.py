@@ -0,0 +1,255 @@
+import os
+import re
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import contextvars
+from collections import deque
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Gemini quota budgets (override via environment; 0 disables a limit). The
+# defaults match the paid tier 1 limits of the Flash models; the free tier is
+# roughly GEMINI_RPM=10 and GEMINI_TPM=250000.
+RPM_LIMIT = int(os.getenv("GEMINI_RPM", "1000"))
+TPM_LIMIT = int(os.getenv("GEMINI_TPM", "1000000"))
+MAX_CONCURRENT = int(os.getenv("GEMINI_MAX_CONCURRENT", "16"))
+
+# Transient failures (429, 5xx, timeouts) are retried with exponential backoff
+# and full jitter, or after the delay the server asks for
+MAX_RETRIES = int(os.getenv("GEMINI_RETRIES", "5"))
+RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_SECONDS", "2"))
+RETRY_MAX_SECONDS = float(os.getenv("GEMINI_RETRY_MAX_SECONDS", "60"))
+
+WINDOW_SECONDS = 60.0
+# Input tokens billed per second of audio, and the bitrate of the speech profile,
+# used to estimate an uploaded file's tokens from its size
+AUDIO_TOKENS_PER_SECOND = 32
+AUDIO_BYTES_PER_SECOND = 3000
+CHARS_PER_TOKEN = 4
+
+# Priorities: lower runs first. Calls made while a job runs inherit its priority
+# (see set_priority); interactive requests go ahead of batch items.
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+_priority = contextvars.ContextVar("gemini_priority", default=INTERACTIVE)
+
+TRANSIENT_CODES = (408, 429, 500, 502, 503, 504)
+TRANSIENT_NAMES = ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "GatewayTimeout")
+
+_waiters = []             # heap of (priority, seq, tokens, future)
+_seq = itertools.count()
+_requests = deque()       # start times of metered calls in the current window
+_tokens = deque()         # (time, tokens) reserved or corrected in the current window
+_tokens_in_window = 0
+_active = 0
+_paused_until = 0.0
+_timer = None
+stats = {"calls": 0, "retries": 0, "throttled": 0, "failed": 0, "queued_seconds": 0.0}
+
+
+def set_priority(priority: int):
+    """Sets the priority for Gemini calls made from the current task (and the tasks/threads it starts)."""
+    _priority.set(priority)
+
+
+def estimate_tokens(contents: list) -> int:
+    """
+    Rough input tokens for a request: text at ~4 characters per token, uploaded
+    audio from its size. Corrected with the real count once the response arrives.
+    """
+    tokens = 0
+    for part in contents:
+        if isinstance(part, str):
+            tokens += len(part) // CHARS_PER_TOKEN
+        else:
+            size = getattr(part, "size_bytes", 0) or 0
+            tokens += int(size / AUDIO_BYTES_PER_SECOND * AUDIO_TOKENS_PER_SECOND)
+    return tokens
+
+
+def _expire(now: float):
+    global _tokens_in_window
+    while _requests and _requests[0] <= now - WINDOW_SECONDS:
+        _requests.popleft()
+    while _tokens and _tokens[0][0] <= now - WINDOW_SECONDS:
+        _tokens_in_window -= _tokens.popleft()[1]
+
+
+def _admission_delay(tokens: int, now: float):
+    """
+    Seconds until a call of `tokens` fits the budgets: 0 if it fits now, None if
+    it must wait for a running call to finish.
+    """
+    if now < _paused_until:
+        return _paused_until - now
+    if MAX_CONCURRENT and _active >= MAX_CONCURRENT:
+        return None
+    if RPM_LIMIT and len(_requests) >= RPM_LIMIT:
+        return _requests[0] + WINDOW_SECONDS - now
+    # A request larger than the whole budget runs alone rather than never
+    if TPM_LIMIT and _tokens_in_window + tokens > TPM_LIMIT and _tokens_in_window > 0:
+        excess = _tokens_in_window + tokens - TPM_LIMIT
+        for stamp, amount in _tokens:
+            excess -= amount
+            if excess <= 0:
+                return stamp + WINDOW_SECONDS - now
+        # Larger than the whole budget: wait for the window to drain, then it runs alone
+        return _tokens[-1][0] + WINDOW_SECONDS - now
+    return 0
+
+
+def _dispatch():
+    """Admits queued calls in priority order while the budgets allow; the head of the queue is never skipped."""
+    global _timer, _active, _tokens_in_window
+    if _timer is not None:
+        _timer.cancel()
+        _timer = None
+    loop = asyncio.get_running_loop()
+    while _waiters:
+        priority, _, tokens, future = _waiters[0]
+        if future.done():  # cancelled while waiting
+            heapq.heappop(_waiters)
+            continue
+        now = time.monotonic()
+        _expire(now)
+        delay = _admission_delay(tokens, now)
+        if delay is None:
+            return
+        if delay > 0:
+            _timer = loop.call_later(delay, _dispatch)
+            return
+        heapq.heappop(_waiters)
+        _requests.append(now)
+        _tokens.append((now, tokens))
+        _tokens_in_window += tokens
+        _active += 1
+        future.set_result(None)
+
+
+async def _acquire(tokens: int) -> dict:
+    future = asyncio.get_running_loop().create_future()
+    heapq.heappush(_waiters, (_priority.get(), next(_seq), tokens, future))
+    queued_at = time.monotonic()
+    _dispatch()
+    try:
+        await future
+    except asyncio.CancelledError:
+        if future.done() and not future.cancelled():
+            # Admitted just as we were cancelled: give the slot back
+            _release({"tokens": tokens, "used": None})
+        raise
+    stats["queued_seconds"] += time.monotonic() - queued_at
+    return {"tokens": tokens, "used": None}
+
+
+def _release(ticket: dict):
+    global _active, _tokens_in_window
+    _active -= 1
+    if ticket["used"] is not None and ticket["used"] != ticket["tokens"]:
+        # Replace the estimate with the real count (as a correction entry in the window)
+        correction = ticket["used"] - ticket["tokens"]
+        _tokens.append((time.monotonic(), correction))
+        _tokens_in_window += correction
+    _dispatch()
+
+
+def _is_transient(error: Exception) -> bool:
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in TRANSIENT_CODES:
+        return True
+    if type(error).__name__ in TRANSIENT_NAMES or isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    message = str(error).lower()
+    return "429" in message or "resource has been exhausted" in message or "quota" in message or "503" in message
+
+
+def _is_throttle(error: Exception) -> bool:
+    return getattr(error, "code", None) == 429 or type(error).__name__ in ("ResourceExhausted", "TooManyRequests") or "429" in str(error)
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """The server's requested delay if it gave one, else exponential backoff with full jitter."""
+    match = re.search(r"retry in ([\d.]+)\s*s|retry_delay\s*\{\s*seconds:\s*(\d+)", str(error))
+    if match:
+        return min(float(match.group(1) or match.group(2)), RETRY_MAX_SECONDS)
+    return random.uniform(0, min(RETRY_BASE_SECONDS * 2 ** attempt, RETRY_MAX_SECONDS))
+
+
+async def run(call, tokens: int = 0, metered: bool = True, retries: int = None):
+    """
+    Runs the blocking `call(ticket)` in a worker thread once the RPM/TPM and
+    concurrency budgets allow, in priority order, retrying transient failures.
+    `call` may set ticket["used"] to the real input token count. Unmetered calls
+    (uploads, file polling) skip the budgets but still get the retries.
+    A 429 pauses every metered call until the retry delay has passed.
+    """
+    global _paused_until
+    retries = MAX_RETRIES if retries is None else retries
+    priority = PRIORITY_NAMES.get(_priority.get(), str(_priority.get()))
+    for attempt in range(retries + 1):
+        ticket = await _acquire(tokens) if metered else {"tokens": 0, "used": None}
+        stats["calls"] += 1
+        try:
+            return await asyncio.to_thread(call, ticket)
+        except Exception as e:
+            if not _is_transient(e) or attempt == retries:
+                if _is_transient(e):
+                    stats["failed"] += 1
+                raise
+            delay = _retry_delay(e, attempt)
+            stats["retries"] += 1
+            metrics.inc("gemini_retries_total", priority=priority, reason="throttled" if _is_throttle(e) else "transient")
+            if _is_throttle(e):
+                stats["throttled"] += 1
+                if metered:
+                    # Everyone backs off, not just this call, so the quota can recover
+                    _paused_until = max(_paused_until, time.monotonic() + delay)
+            logger.warning(f"Gemini call failed ({e}); retry {attempt + 1}/{retries} in {delay:.1f}s")
+        finally:
+            if metered:
+                _release(ticket)
+        await asyncio.sleep(delay)
+
+
+def usage() -> dict:
+    """
+    Current budget usage over the last minute, for /jobs and /metrics. Reads
+    snapshots only, since it is also called from request threads.
+    """
+    now = time.monotonic()
+    cutoff = now - WINDOW_SECONDS
+    queued = {}
+    for priority, _, _, future in list(_waiters):
+        if not future.done():
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            queued[name] = queued.get(name, 0) + 1
+    return {
+        "rpm_limit": RPM_LIMIT,
+        "tpm_limit": TPM_LIMIT,
+        "requests_last_minute": sum(1 for stamp in list(_requests) if stamp > cutoff),
+        "tokens_last_minute": sum(amount for stamp, amount in list(_tokens) if stamp > cutoff),
+        "active": _active,
+        "max_concurrent": MAX_CONCURRENT,
+        "queued": queued,
+        "paused_seconds": round(max(0.0, _paused_until - now), 1),
+        **stats,
+        "queued_seconds": round(stats["queued_seconds"], 3),
+    }
+
+
+metrics.register_gauge(
+    "gemini_quota_usage",
+    lambda: [({"budget": budget}, usage()[f"{budget}_last_minute"]) for budget in ("requests", "tokens")],
+    "Gemini requests and input tokens used in the last minute.",
+)
+metrics.register_gauge(
+    "gemini_queued_calls",
+    lambda: [({"priority": name}, count) for name, count in usage()["queued"].items()],
+    "Gemini calls waiting for quota, by priority.",
+)
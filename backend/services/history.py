@@ -0,0 +1,165 @@
+import logging
+import os
+import json
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# SQLite history store (WAL mode, safe to share between uvicorn workers)
+HISTORY_DB = os.getenv("HISTORY_DB", "history.db")
+LEGACY_HISTORY_FILE = "history.json"
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    video_id TEXT,
+    url TEXT,
+    title TEXT,
+    report_date TEXT,
+    dir_name TEXT,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_video_id ON history(video_id);
+CREATE INDEX IF NOT EXISTS idx_history_url ON history(url);
+CREATE INDEX IF NOT EXISTS idx_history_report_date ON history(report_date);
+CREATE INDEX IF NOT EXISTS idx_history_dir_name ON history(dir_name);
+"""
+
+
+def _connect():
+    conn = sqlite3.connect(HISTORY_DB, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _row_values(entry: dict) -> tuple:
+    return (
+        entry["id"],
+        entry.get("video_id"),
+        entry.get("url"),
+        entry.get("title"),
+        entry.get("report_date"),
+        entry.get("dir_name"),
+        json.dumps(entry),
+    )
+
+
+def init_history(legacy_file: str = LEGACY_HISTORY_FILE):
+    """
+    Creates the schema and imports entries from a legacy history.json, which is
+    then renamed to history.json.migrated so entries removed later (by storage
+    sweeps) are not imported again on the next startup.
+    """
+    conn = _connect()
+    try:
+        conn.executescript(SCHEMA)
+        if os.path.exists(legacy_file):
+            try:
+                with open(legacy_file, "r") as f:
+                    legacy_entries = json.load(f)
+            except Exception as e:
+                # Left in place, so the import is retried once the file is fixed
+                logger.warning(f"Could not read {legacy_file} for migration: {e}")
+                return
+            with conn:
+                cursor = conn.executemany(
+                    "INSERT OR IGNORE INTO history (id, video_id, url, title, report_date, dir_name, entry) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [_row_values(entry) for entry in legacy_entries if entry.get("id")],
+                )
+            os.replace(legacy_file, f"{legacy_file}.migrated")
+            logger.debug(f"Migrated {cursor.rowcount} entries from {legacy_file}")
+    finally:
+        conn.close()
+
+
+def add_entry(entry: dict):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO history (id, video_id, url, title, report_date, dir_name, entry) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                _row_values(entry),
+            )
+    finally:
+        conn.close()
+
+
+def remove_by_dir_names(dir_names: list):
+    if not dir_names:
+        return
+    conn = _connect()
+    try:
+        with conn:
+            conn.executemany("DELETE FROM history WHERE dir_name = ?", [(name,) for name in dir_names])
+    finally:
+        conn.close()
+
+
+def get_entry(entry_id: str):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT entry FROM history WHERE id = ?", (entry_id,)).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def iter_entries():
+    """
+    Yields every entry, oldest first, without loading the table into memory.
+    """
+    conn = _connect()
+    try:
+        for (entry,) in conn.execute("SELECT entry FROM history ORDER BY seq"):
+            yield json.loads(entry)
+    finally:
+        conn.close()
+
+
+def list_entries(limit: int = DEFAULT_PAGE_SIZE, cursor: int = None, video_id: str = None, url: str = None,
+                 date_from: str = None, date_to: str = None, q: str = None):
+    """
+    Returns (entries, next_cursor), newest first. `cursor` is the opaque value
+    returned by the previous page; `q` matches title or URL (case-insensitive).
+    """
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    clauses = []
+    params = []
+    if cursor is not None:
+        clauses.append("seq < ?")
+        params.append(cursor)
+    if video_id:
+        clauses.append("video_id = ?")
+        params.append(video_id)
+    if url:
+        clauses.append("url = ?")
+        params.append(url)
+    if date_from:
+        clauses.append("report_date >= ?")
+        params.append(date_from)
+    if date_to:
+        clauses.append("report_date <= ?")
+        params.append(date_to)
+    if q:
+        clauses.append("(title LIKE ? OR url LIKE ?)")
+        params.extend([f"%{q}%", f"%{q}%"])
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            f"SELECT seq, entry FROM history {where} ORDER BY seq DESC LIMIT ?",
+            params + [limit + 1],
+        ).fetchall()
+    finally:
+        conn.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = rows[-1][0] if has_more else None
+    return [json.loads(entry) for _, entry in rows], next_cursor
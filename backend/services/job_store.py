@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+from services import history
+
+logger = logging.getLogger(__name__)
+
+# Durable job records with stage checkpoints, stored alongside history so an
+# interrupted job can resume after a restart (see jobs.start_workers)
+RESUME_JOBS = os.getenv("RESUME_JOBS", "true").lower() == "true"
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+# `checkpoint` is the last stage that completed; `state` is job["_state"] as of
+# that stage (metadata, audio path, Gemini file, sections received so far...)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL,
+    stage TEXT,
+    checkpoint TEXT,
+    request TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+"""
+
+
+def init_job_store():
+    conn = history._connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+# Stage state kept in memory only: the preflight info dict is large and its
+# format URLs expire, so a resumed download resolves the metadata again
+VOLATILE_STATE_KEYS = ("info", "info_at")
+
+
+def snapshot(job: dict, state: bool = False) -> dict:
+    """
+    Captures the job's status fields (with `state`, also its checkpoint and
+    stage state) for save_jobs. Cheap enough for the event loop: nested dicts
+    are copied one level deep and serialised later, in the writer thread.
+    """
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "stage": job.get("stage"),
+        "checkpoint": job.get("_checkpoint"),
+        "request": job["request"],
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at"),
+        "state": {
+            key: dict(value) if isinstance(value, dict) else value
+            for key, value in (job.get("_state") or {}).items()
+            if key not in VOLATILE_STATE_KEYS
+        } if state else None,
+    }
+
+
+def save_jobs(snapshots: list):
+    """
+    Upserts snapshots in one transaction. A snapshot without state leaves the
+    stored checkpoint and state as they are.
+    """
+    conn = history._connect()
+    try:
+        with conn:
+            for snap in snapshots:
+                state_json = json.dumps(snap["state"], default=str) if snap["state"] is not None else None
+                conn.execute(
+                    """
+                    INSERT INTO jobs (id, status, stage, checkpoint, request, state, result, error, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET
+                        status = excluded.status, stage = excluded.stage, result = excluded.result,
+                        error = excluded.error, updated_at = excluded.updated_at
+                    """,
+                    (
+                        snap["id"], snap["status"], snap["stage"], snap["checkpoint"],
+                        json.dumps(snap["request"]), state_json or "{}",
+                        json.dumps(snap["result"]), snap["error"], snap["created_at"], snap["updated_at"],
+                    ),
+                )
+                if state_json is not None:
+                    conn.execute(
+                        "UPDATE jobs SET checkpoint = ?, state = ? WHERE id = ?",
+                        (snap["checkpoint"], state_json, snap["id"]),
+                    )
+    finally:
+        conn.close()
+
+
+def save_job(job: dict, state: bool = False):
+    """
+    Upserts the job's status fields; with `state`, also its checkpoint and stage state.
+    """
+    save_jobs([snapshot(job, state)])
+
+
+def _job_from_row(row) -> dict:
+    job_id, status, stage, checkpoint, request, state, result, error, created_at, updated_at = row
+    return {
+        "id": job_id,
+        "status": status,
+        "stage": stage,
+        "request": json.loads(request),
+        "result": json.loads(result) if result else None,
+        "error": error,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "_checkpoint": checkpoint,
+        "_state": json.loads(state) if status not in FINISHED_STATUSES else {},
+    }
+
+
+def load_jobs(finished_limit: int) -> tuple:
+    """
+    Returns (unfinished, finished): the jobs that were queued or running, oldest
+    first, and the newest `finished_limit` finished ones, oldest first.
+    """
+    conn = history._connect()
+    try:
+        columns = "id, status, stage, checkpoint, request, state, result, error, created_at, updated_at"
+        placeholders = ", ".join("?" * len(FINISHED_STATUSES))
+        unfinished = conn.execute(
+            f"SELECT {columns} FROM jobs WHERE status NOT IN ({placeholders}) ORDER BY seq", FINISHED_STATUSES
+        ).fetchall()
+        finished = conn.execute(
+            f"SELECT {columns} FROM jobs WHERE status IN ({placeholders}) ORDER BY seq DESC LIMIT ?",
+            FINISHED_STATUSES + (finished_limit,),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [_job_from_row(row) for row in unfinished], [_job_from_row(row) for row in reversed(finished)]
+
+
+def prune_finished(keep: int):
+    """
+    Deletes all but the newest `keep` finished jobs.
+    """
+    conn = history._connect()
+    try:
+        with conn:
+            placeholders = ", ".join("?" * len(FINISHED_STATUSES))
+            conn.execute(
+                f"""
+                DELETE FROM jobs WHERE status IN ({placeholders}) AND seq NOT IN (
+                    SELECT seq FROM jobs WHERE status IN ({placeholders}) ORDER BY seq DESC LIMIT ?
+                )
+                """,
+                FINISHED_STATUSES + FINISHED_STATUSES + (keep,),
+            )
+    finally:
+        conn.close()
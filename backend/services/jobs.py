@@ -0,0 +1,578 @@
+import logging
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from services import metrics, job_store
+
+logger = logging.getLogger(__name__)
+
+# Queue configuration (override via environment)
+MAX_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "20"))
+MAX_FINISHED_JOBS = int(os.getenv("ANALYSIS_FINISHED_JOBS", "500"))
+
+# Pipeline: each stage has its own workers and a bounded queue in front of it, so
+# job N+1 can download while job N waits on Gemini and job N-1 renders documents.
+# The first queue (MAX_QUEUE_SIZE) admits new jobs; the queues between stages
+# (STAGE_QUEUE_SIZE) apply backpressure when a later stage falls behind.
+STAGE_WORKERS = {
+    "preflight": int(os.getenv("STAGE_PREFLIGHT_WORKERS", "4")),
+    "download": int(os.getenv("STAGE_DOWNLOAD_WORKERS", "2")),
+    "analysis": int(os.getenv("STAGE_ANALYSIS_WORKERS", "2")),
+    "documents": int(os.getenv("STAGE_DOCUMENTS_WORKERS", "1")),
+}
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", "4"))
+
+# In-memory job registry: job_id -> job dict
+jobs = {}
+
+# Queued/running jobs by canonical video ID, used to coalesce duplicate requests
+_inflight = {}
+
+# Admission queue (the first stage's queue)
+job_queue = None
+# Pipeline stages in order, each {"name", "handler", "queue", "workers", counters...}
+_stages = []
+_workers = []
+_loop = None
+_started_at = None
+_resume_task = None
+# Job snapshots waiting for the writer task, which stores them off the event loop
+_persist_queue = None
+_writer_task = None
+
+# Job statuses after which no more events are published
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has reached MAX_QUEUE_SIZE."""
+    pass
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def update_job(job: dict, **fields):
+    """
+    Updates a job record in place and refreshes its timestamp.
+    Status/stage changes are also published as a 'status' event.
+    """
+    if fields.get("status") in FINISHED_STATUSES and job.get("status") not in FINISHED_STATUSES:
+        metrics.inc("jobs_total", status=fields["status"])
+    job.update(fields)
+    job["updated_at"] = _now()
+    if "status" in fields or "stage" in fields:
+        _persist(job)
+        status_event = {"status": job.get("status"), "stage": job.get("stage")}
+        if job.get("status") == "completed":
+            status_event["result"] = job.get("result")
+        if job.get("status") == "failed":
+            status_event["error"] = job.get("error")
+        publish_event(job, "status", status_event)
+    return job
+
+
+def _persist(job: dict, state: bool = False):
+    # Only jobs created by _new_job (or restored from the store) are durable, not
+    # job dicts built by hand
+    if not job.get("_durable"):
+        return
+    snapshot = job_store.snapshot(job, state or job["status"] in FINISHED_STATUSES)
+    if _persist_queue is None:
+        _write([snapshot])
+    else:
+        _persist_queue.put_nowait(snapshot)
+
+
+def _write(snapshots: list):
+    try:
+        job_store.save_jobs(snapshots)
+    except Exception as e:
+        logger.warning(f"Could not persist jobs: {e}", extra={"job_ids": [snap["id"] for snap in snapshots]})
+
+
+def _coalesce(snapshots: list) -> list:
+    # Only the newest snapshot of each job is written; one without state keeps
+    # the state of an earlier one so that checkpoint is not lost
+    merged = {}
+    for snapshot in snapshots:
+        previous = merged.get(snapshot["id"])
+        if previous is not None and snapshot["state"] is None:
+            snapshot = {**snapshot, "state": previous["state"], "checkpoint": previous["checkpoint"]}
+        merged[snapshot["id"]] = snapshot
+    return list(merged.values())
+
+
+async def _persist_writer():
+    # A None snapshot (see stop_workers) stops the writer once the rest are written
+    while True:
+        snapshots = [await _persist_queue.get()]
+        while not _persist_queue.empty():
+            snapshots.append(_persist_queue.get_nowait())
+        pending = [snapshot for snapshot in snapshots if snapshot is not None]
+        if pending:
+            await asyncio.to_thread(_write, _coalesce(pending))
+        if len(pending) < len(snapshots):
+            return
+
+
+def _call_on_loop(callback, *args):
+    # Runs callback on the event loop, marshalling it there from worker threads
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+
+    if _loop is None or running_loop is _loop:
+        callback(*args)
+    else:
+        _loop.call_soon_threadsafe(callback, *args)
+
+
+def save_checkpoint(job: dict, update=None):
+    """
+    Applies `update(job["_state"])`, if given, and persists the stage state
+    mid-stage (e.g. each analysis section as it arrives), so a resumed job keeps
+    that progress. Safe to call from worker threads: both steps run on the event
+    loop, so the state is never mutated while it is being snapshotted.
+    """
+    def checkpoint():
+        if update is not None:
+            update(job["_state"])
+        _persist(job, state=True)
+
+    _call_on_loop(checkpoint)
+
+
+def _append_event(job: dict, event: str, data):
+    if "_events" not in job:
+        return
+    job["_events"].append({"event": event, "data": data})
+    if event == "status" and data.get("status") in FINISHED_STATUSES:
+        # Finished jobs are kept around (MAX_FINISHED_JOBS); don't keep every progress
+        # tick and section text with them. Live subscribers hold the full list.
+        job["_events"] = job["_events"][-1:]
+    # Wake up every subscriber waiting on this job
+    signal = job.get("_event_signal")
+    if signal is not None:
+        signal.set()
+    job["_event_signal"] = asyncio.Event()
+
+
+def publish_event(job: dict, event: str, data):
+    """
+    Appends an event to the job's event log. Safe to call from worker threads
+    (e.g. yt-dlp progress hooks), which are marshalled onto the event loop.
+    """
+    _call_on_loop(_append_event, job, event, data)
+
+
+def job_event_callback(job: dict):
+    """
+    Returns a thread-safe `on_event(event, data)` callable bound to a job.
+    """
+    return lambda event, data: publish_event(job, event, data)
+
+
+async def subscribe_events(job: dict, keepalive: float = 15.0):
+    """
+    Yields the job's events from the beginning, then live ones until the job
+    finishes (only the final status event once it has). Yields None every
+    `keepalive` seconds while idle.
+    """
+    index = 0
+    # The list is replaced (not cleared) once the job finishes, so this one still
+    # has every event up to the final status
+    events = job.get("_events", [])
+    while True:
+        while index < len(events):
+            yield events[index]
+            index += 1
+        if job.get("status") in FINISHED_STATUSES:
+            return
+        if job.get("_event_signal") is None:
+            job["_event_signal"] = asyncio.Event()
+        try:
+            await asyncio.wait_for(job["_event_signal"].wait(), timeout=keepalive)
+        except asyncio.TimeoutError:
+            yield None
+
+
+def public_job(job: dict) -> dict:
+    """
+    Returns the client-facing view of a job (without internal fields).
+    """
+    return {key: value for key, value in job.items() if not key.startswith("_")}
+
+
+def get_job(job_id: str):
+    return jobs.get(job_id)
+
+
+def active_output_dirs(exclude: dict = None) -> set:
+    """
+    Names of the output directories that queued or running jobs write to.
+    """
+    return {
+        os.path.basename(job["_state"]["output_dir"]) for job in list(jobs.values())
+        if job is not exclude and job["status"] not in FINISHED_STATUSES and job.get("_state", {}).get("output_dir")
+    }
+
+
+def _prune_finished_jobs():
+    finished = [job_id for job_id, job in jobs.items() if job["status"] in FINISHED_STATUSES]
+    # Dicts keep insertion order, so the oldest finished jobs come first
+    pruned = finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]
+    for job_id in pruned:
+        del jobs[job_id]
+    if pruned:
+        try:
+            job_store.prune_finished(MAX_FINISHED_JOBS)
+        except Exception as e:
+            logger.warning(f"Could not prune stored jobs: {e}")
+
+
+def _new_job(request: dict) -> dict:
+    return {
+        "id": str(uuid.uuid4())[:8],
+        "status": "queued",
+        "stage": None,
+        "request": request,
+        "result": None,
+        "error": None,
+        "created_at": _now(),
+        "updated_at": _now(),
+        "_events": [],
+        "_event_signal": None,
+        # Intermediate results handed from one stage to the next, and the last
+        # completed stage; both are persisted at stage boundaries
+        "_state": {},
+        "_checkpoint": None,
+        "_durable": True,
+    }
+
+
+def create_completed_job(request: dict, result: dict, **fields) -> dict:
+    """
+    Registers a job that is already finished (e.g. served from the result cache).
+    """
+    job = _new_job(request)
+    update_job(job, status="completed", result=result, **fields)
+    _prune_finished_jobs()
+    jobs[job["id"]] = job
+    return job
+
+
+def find_inflight(video_id: str, options):
+    """
+    Returns a queued/running job for the same video whose options cover the
+    requested ones, so a duplicate request can attach to it instead of
+    starting another download/analysis.
+    """
+    if not video_id:
+        return None
+    requested = set(options)
+    for job in _inflight.get(video_id, []):
+        if requested.issubset(job["request"]["options"]):
+            return job
+    return None
+
+
+def attach_to_job(job: dict) -> dict:
+    update_job(job, subscribers=job.get("subscribers", 1) + 1)
+    return job
+
+
+def _track_inflight(job: dict):
+    video_id = job["request"].get("video_id")
+    if video_id:
+        _inflight.setdefault(video_id, []).append(job)
+
+
+def _untrack_inflight(job: dict):
+    video_id = job["request"].get("video_id")
+    if video_id in _inflight:
+        _inflight[video_id] = [j for j in _inflight[video_id] if j is not job]
+        if not _inflight[video_id]:
+            del _inflight[video_id]
+
+
+def submit_job(request: dict) -> dict:
+    """
+    Creates a job for the given request payload and enqueues it.
+    Raises QueueFullError if the queue is at capacity.
+    """
+    if job_queue is None:
+        raise RuntimeError("Job workers are not running.")
+
+    job = _new_job(request)
+    try:
+        job_queue.put_nowait(job)
+    except asyncio.QueueFull:
+        raise QueueFullError(f"Job queue is full ({MAX_QUEUE_SIZE} pending jobs).")
+
+    _prune_finished_jobs()
+    jobs[job["id"]] = job
+    _track_inflight(job)
+    _persist(job)
+    publish_event(job, "status", {"status": "queued", "stage": None})
+    return job
+
+
+async def enqueue_job(request: dict) -> dict:
+    """
+    Like submit_job, but waits for room in the queue instead of failing.
+    Used by batches, which may hold more items than the queue.
+    """
+    if job_queue is None:
+        raise RuntimeError("Job workers are not running.")
+
+    job = _new_job(request)
+    _prune_finished_jobs()
+    jobs[job["id"]] = job
+    _track_inflight(job)
+    _persist(job)
+    publish_event(job, "status", {"status": "queued", "stage": None})
+    try:
+        await job_queue.put(job)
+    except asyncio.CancelledError:
+        # Never reached the queue (e.g. its batch was cancelled while waiting for
+        # room): finish it so later requests do not attach to it
+        _untrack_inflight(job)
+        update_job(job, status="cancelled", stage=None)
+        raise
+    return job
+
+
+async def wait_for_job(job: dict) -> dict:
+    async for _ in subscribe_events(job):
+        pass
+    return job
+
+
+def cancel_job(job: dict) -> bool:
+    """
+    Cancels a queued or running job. A queued job is skipped when dequeued; a
+    running job has its task cancelled, which interrupts any awaiting stage
+    (e.g. the Gemini readiness wait); a job waiting between stages is skipped by
+    the next stage. A job other requests are attached to (see attach_to_job)
+    only loses one subscriber and keeps running for the rest. Returns False if
+    the job already finished.
+    """
+    if job["status"] in FINISHED_STATUSES:
+        return False
+    if job.get("subscribers", 1) > 1:
+        update_job(job, subscribers=job["subscribers"] - 1)
+        return True
+    job["_cancel_requested"] = True
+    task = job.get("_task")
+    if task is not None:
+        task.cancel()
+    else:
+        _untrack_inflight(job)
+        update_job(job, status="cancelled", stage=None)
+    return True
+
+
+def _stage_stats(stage: dict, uptime: float) -> dict:
+    workers = len(stage["workers"])
+    return {
+        "name": stage["name"],
+        "workers": workers,
+        "queued": stage["queue"].qsize(),
+        "max_queue_size": stage["queue"].maxsize,
+        "busy": stage["busy"],
+        "processed": stage["processed"],
+        "failed": stage["failed"],
+        "avg_seconds": round(stage["busy_seconds"] / stage["processed"], 3) if stage["processed"] else None,
+        # Share of worker time spent running jobs since startup
+        "utilization": round(stage["busy_seconds"] / (workers * uptime), 3) if workers and uptime else 0.0,
+        # Time finished jobs waited for room in the next stage's queue
+        "blocked_seconds": round(stage["blocked_seconds"], 3),
+    }
+
+
+def queue_stats() -> dict:
+    uptime = time.perf_counter() - _started_at if _started_at else 0.0
+    return {
+        "workers": len(_workers),
+        "queued": job_queue.qsize() if job_queue else 0,
+        "max_queue_size": MAX_QUEUE_SIZE,
+        "running": sum(1 for job in jobs.values() if job["status"] == "running"),
+        "inflight_videos": len(_inflight),
+        "stages": [_stage_stats(stage, uptime) for stage in _stages],
+    }
+
+
+def _finish_job(job: dict, **fields):
+    # Stage state is only needed to resume; drop it from memory and the store
+    job["_state"] = {}
+    update_job(job, stage=None, **fields)
+    _untrack_inflight(job)
+
+
+async def _stage_worker(index: int):
+    stage = _stages[index]
+    next_stage = _stages[index + 1] if index + 1 < len(_stages) else None
+    while True:
+        job = await stage["queue"].get()
+        try:
+            if job.get("_cancel_requested"):
+                continue
+            if job["status"] == "queued":
+                update_job(job, status="running")
+            update_job(job, stage=stage["name"])
+
+            stage["busy"] += 1
+            started = time.perf_counter()
+            job["_task"] = asyncio.create_task(stage["handler"](job))
+            try:
+                result = await job["_task"]
+            except asyncio.CancelledError:
+                if job.get("_cancel_requested"):
+                    _finish_job(job, status="cancelled")
+                    continue
+                job["_task"].cancel()
+                if not job_store.RESUME_JOBS:
+                    _finish_job(job, status="failed", error="Server shutting down.")
+                # Otherwise the job stays queued/running in the store and resumes
+                # from its last checkpoint on the next start
+                raise
+            except Exception as e:
+                stage["failed"] += 1
+                metrics.inc("stage_errors_total", stage=stage["name"])
+                logger.error(f"Job failed: {e}", extra={"job_id": job["id"], "stage": stage["name"]})
+                _finish_job(job, status="failed", error=str(e))
+                continue
+            finally:
+                job.pop("_task", None)
+                stage["busy"] -= 1
+                elapsed = time.perf_counter() - started
+                stage["busy_seconds"] += elapsed
+                metrics.observe("stage_seconds", elapsed, stage=stage["name"])
+
+            stage["processed"] += 1
+            job["_checkpoint"] = stage["name"]
+            if next_stage is None:
+                _finish_job(job, status="completed", result=result)
+            else:
+                _persist(job, state=True)
+                blocked = time.perf_counter()
+                await next_stage["queue"].put(job)
+                stage["blocked_seconds"] += time.perf_counter() - blocked
+        finally:
+            stage["queue"].task_done()
+
+
+def _restore_jobs(resume: bool) -> list:
+    """
+    Loads stored jobs into the registry: recent finished ones (so their status
+    stays available) and interrupted ones, which are queued again at the stage
+    after their checkpoint (or marked failed if not `resume`).
+    Returns [(stage index, job)] to requeue.
+    """
+    unfinished, finished = job_store.load_jobs(MAX_FINISHED_JOBS)
+    names = [stage["name"] for stage in _stages]
+    for job in finished:
+        job.update(_events=[], _event_signal=None, _durable=True)
+        jobs[job["id"]] = job
+
+    resumed = []
+    for job in unfinished:
+        job.update(_events=[], _event_signal=None, _durable=True)
+        if not resume:
+            jobs[job["id"]] = job
+            update_job(job, status="failed", stage=None, error="Interrupted by a server restart.", _state={})
+            continue
+        # A job whose last stage completed but was not marked finished reruns that stage
+        index = min(names.index(job["_checkpoint"]) + 1, len(names) - 1) if job["_checkpoint"] in names else 0
+        jobs[job["id"]] = job
+        _track_inflight(job)
+        update_job(job, status="queued", stage=None, resumed_from=names[index])
+        resumed.append((index, job))
+    if resumed:
+        logger.info(f"Resuming {len(resumed)} interrupted jobs")
+    return resumed
+
+
+async def _requeue(resumed: list):
+    # Waits for queue space like any other producer, so a long backlog cannot overflow the stages
+    for index, job in resumed:
+        await _stages[index]["queue"].put(job)
+
+
+async def start_workers(stages: list):
+    """
+    Starts the pipeline. `stages` is an ordered list of (name, handler) where
+    `handler` is an async callable receiving the job dict; stages pass data
+    through job["_state"] and the last stage's return value becomes the job
+    result. Worker counts come from STAGE_WORKERS (1 for unknown stages).
+    With RESUME_JOBS, jobs interrupted by a restart continue from their last
+    completed stage.
+    """
+    global job_queue, _loop, _started_at, _resume_task, _persist_queue, _writer_task
+    _loop = asyncio.get_running_loop()
+    _started_at = time.perf_counter()
+    _persist_queue = asyncio.Queue()
+    _writer_task = asyncio.create_task(_persist_writer())
+    for i, (name, handler) in enumerate(stages):
+        _stages.append({
+            "name": name,
+            "handler": handler,
+            "queue": asyncio.Queue(maxsize=MAX_QUEUE_SIZE if i == 0 else STAGE_QUEUE_SIZE),
+            "workers": [],
+            "busy": 0,
+            "busy_seconds": 0.0,
+            "blocked_seconds": 0.0,
+            "processed": 0,
+            "failed": 0,
+        })
+    job_queue = _stages[0]["queue"]
+    for i, stage in enumerate(_stages):
+        for _ in range(STAGE_WORKERS.get(stage["name"], 1)):
+            task = asyncio.create_task(_stage_worker(i))
+            stage["workers"].append(task)
+            _workers.append(task)
+    metrics.register_gauge(
+        "stage_queue_depth",
+        lambda: [({"stage": stage["name"]}, stage["queue"].qsize()) for stage in _stages],
+        "Jobs waiting in front of each pipeline stage.",
+    )
+    metrics.register_gauge(
+        "stage_busy_workers",
+        lambda: [({"stage": stage["name"]}, stage["busy"]) for stage in _stages],
+        "Workers currently processing a job, by stage.",
+    )
+    metrics.register_gauge(
+        "jobs",
+        lambda: [({"status": status}, sum(1 for job in jobs.values() if job["status"] == status))
+                 for status in ("queued", "running")],
+        "Jobs currently queued or running.",
+    )
+    layout = ", ".join(f"{stage['name']}={len(stage['workers'])}" for stage in _stages)
+    logger.debug(f"Started analysis pipeline ({layout}; queue size {MAX_QUEUE_SIZE})")
+
+    resumed = _restore_jobs(job_store.RESUME_JOBS)
+    if resumed:
+        _resume_task = asyncio.create_task(_requeue(resumed))
+
+
+async def stop_workers():
+    global _resume_task, _persist_queue, _writer_task
+    if _resume_task is not None:
+        _resume_task.cancel()
+        _resume_task = None
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _stages.clear()
+    # Let the writer store what the cancelled workers persisted last
+    if _writer_task is not None:
+        _persist_queue.put_nowait(None)
+        await _writer_task
+        _persist_queue = None
+        _writer_task = None
@@ -0,0 +1,129 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# In-process metrics, exposed in Prometheus text format by GET /metrics
+PREFIX = "videoinsight_"
+SPAN_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+HELP = {
+    "span_seconds": "Duration of pipeline steps (download, transcode, upload, gemini_processing, generation, render...).",
+    "stage_seconds": "Time a job spent in each pipeline stage.",
+    "stage_errors_total": "Jobs that failed, by pipeline stage.",
+    "jobs_total": "Finished jobs by final status.",
+    "bytes_downloaded_total": "Source media bytes downloaded from YouTube.",
+    "bytes_uploaded_total": "Audio bytes uploaded to Gemini.",
+    "gemini_tokens_total": "Gemini tokens used, by kind (prompt/output).",
+    "gemini_requests_total": "Gemini generation requests, by outcome.",
+    "gemini_sections_total": "Analysis sections received, re-requested or failed.",
+    "gemini_retries_total": "Gemini calls retried after a transient error, by priority and reason.",
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> {"buckets": [...], "sum": float, "count": int}
+_gauges = {}      # name -> (help, callable returning [(labels dict, value)])
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+
+def inc(name: str, amount: float = 1, **labels):
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, value: float, **labels):
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(SPAN_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(SPAN_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def register_gauge(name: str, collect, help: str = ""):
+    """
+    Registers a gauge whose samples are read at scrape time: `collect()`
+    returns a list of (labels dict, value).
+    """
+    _gauges[name] = (help, collect)
+
+
+@contextmanager
+def span(name: str, **labels):
+    """
+    Times a block into the span_seconds histogram and logs it at debug level.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        observe("span_seconds", seconds, span=name, **labels)
+        logger.debug("span finished", extra={"span": name, "seconds": round(seconds, 3), "status": status, **labels})
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{value}"'.replace("\n", " ") for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def render() -> str:
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    lines = []
+
+    def header(name, kind, help_text):
+        lines.append(f"# HELP {PREFIX}{name} {help_text or HELP.get(name, name)}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in _histograms.items())
+
+    last = None
+    for (name, labels), value in counters:
+        if name != last:
+            header(name, "counter", None)
+            last = name
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+
+    last = None
+    for (name, labels), histogram in histograms:
+        if name != last:
+            header(name, "histogram", None)
+            last = name
+        for bound, count in zip(SPAN_BUCKETS, histogram["buckets"]):
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {round(histogram['sum'], 6)}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    for name, (help_text, collect) in sorted(_gauges.items()):
+        try:
+            samples = collect()
+        except Exception as e:
+            logger.warning(f"Metrics gauge {name} failed: {e}")
+            continue
+        header(name, "gauge", help_text)
+        for labels, value in samples:
+            lines.append(f"{PREFIX}{name}{_format_labels(_labels_key(labels))} {value}")
+
+    return "\n".join(lines) + "\n"
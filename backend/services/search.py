@@ -0,0 +1,185 @@
+import os
+import time
+from services import history
+
+# Full-text index over generated reports (SQLite FTS5, stored alongside history)
+INDEXED_SECTIONS = ("summary", "guide", "transcription_orig", "transcription_es", "keywords")
+
+# Report files on disk, by filename suffix (see generate_documents)
+SECTION_FILES = {
+    "_summary.md": "summary",
+    "_guide.md": "guide",
+    "_transcription_original.txt": "transcription_orig",
+    "_transcription_es.txt": "transcription_es",
+}
+METADATA_SEPARATOR = f"{'-'*40}\n\n"
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# report_docs maps FTS rowids to reports so a report can be re-indexed or removed
+# without scanning the FTS table.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_docs (
+    rowid INTEGER PRIMARY KEY,
+    dir_name TEXT NOT NULL,
+    section TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_report_docs_dir_name ON report_docs(dir_name);
+CREATE VIRTUAL TABLE IF NOT EXISTS report_search USING fts5(
+    title, body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4'
+);
+"""
+
+
+def init_search():
+    conn = history._connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def _delete_reports(conn, dir_names):
+    for dir_name in dir_names:
+        conn.execute("DELETE FROM report_search WHERE rowid IN (SELECT rowid FROM report_docs WHERE dir_name = ?)", (dir_name,))
+        conn.execute("DELETE FROM report_docs WHERE dir_name = ?", (dir_name,))
+
+
+def index_report(dir_name: str, title: str, sections: dict):
+    """
+    (Re)indexes one report. `sections` maps section keys (summary, guide,
+    transcriptions, keywords) to their text; other keys are ignored.
+    """
+    conn = history._connect()
+    try:
+        with conn:
+            _delete_reports(conn, [dir_name])
+            for section in INDEXED_SECTIONS:
+                text = sections.get(section)
+                if not text:
+                    continue
+                cursor = conn.execute("INSERT INTO report_docs (dir_name, section) VALUES (?, ?)", (dir_name, section))
+                conn.execute("INSERT INTO report_search (rowid, title, body) VALUES (?, ?, ?)", (cursor.lastrowid, title, text))
+    finally:
+        conn.close()
+
+
+def remove_reports(dir_names: list):
+    if not dir_names:
+        return
+    conn = history._connect()
+    try:
+        with conn:
+            _delete_reports(conn, dir_names)
+    finally:
+        conn.close()
+
+
+def _match_expression(query: str) -> str:
+    """
+    Turns free text into an FTS5 query: every word must match, and the last
+    one is treated as a prefix so results update while typing.
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    if not terms:
+        return ""
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search(query: str, limit: int = DEFAULT_LIMIT, section: str = None):
+    """
+    Returns (results, seconds) ranked by BM25 (title matches weigh more),
+    each with a highlighted snippet and the report's history metadata.
+    """
+    match = _match_expression(query)
+    if not match:
+        return [], 0.0
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+    params = [match]
+    section_clause = ""
+    if section:
+        section_clause = "AND d.section = ?"
+        params.append(section)
+
+    start = time.perf_counter()
+    conn = history._connect()
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT d.dir_name, d.section, report_search.title,
+                   snippet(report_search, 1, '<mark>', '</mark>', '…', 16),
+                   bm25(report_search, 5.0, 1.0) AS score,
+                   h.id, h.video_id, h.url, h.report_date
+            FROM report_search
+            JOIN report_docs d ON d.rowid = report_search.rowid
+            LEFT JOIN history h ON h.dir_name = d.dir_name
+            WHERE report_search MATCH ? {section_clause}
+            ORDER BY score
+            LIMIT ?
+            """,
+            params + [limit],
+        ).fetchall()
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+
+    results = [
+        {
+            "dir_name": dir_name,
+            "section": section_key,
+            "title": title,
+            "snippet": snippet,
+            "score": round(-score, 4),
+            "id": report_id,
+            "video_id": video_id,
+            "url": url,
+            "report_date": report_date,
+        }
+        for dir_name, section_key, title, snippet, score, report_id, video_id, url, report_date in rows
+    ]
+    return results, elapsed
+
+
+def read_report_dir(path: str):
+    """
+    Recovers title, keywords and section texts from a report directory's .md/.txt files.
+    """
+    title = None
+    sections = {}
+    for filename in sorted(os.listdir(path)):
+        section = next((key for suffix, key in SECTION_FILES.items() if filename.endswith(suffix)), None)
+        if section is None:
+            continue
+        with open(os.path.join(path, filename), "r", encoding="utf-8") as f:
+            text = f.read()
+        header, _, body = text.partition(METADATA_SEPARATOR)
+        if not body:
+            header, body = "", text
+        for line in header.splitlines():
+            if line.startswith("Title: ") and title is None:
+                title = line[len("Title: "):]
+            elif line.startswith("Keywords: ") and "keywords" not in sections:
+                sections["keywords"] = line[len("Keywords: "):]
+        sections[section] = body
+    return title, sections
+
+
+def backfill(output_dir: str) -> int:
+    """
+    Indexes every report directory under `output_dir`. Safe to re-run; each
+    report replaces its previous rows. Returns the number of reports indexed.
+    """
+    init_search()
+    indexed = 0
+    for dir_name in sorted(os.listdir(output_dir)):
+        path = os.path.join(output_dir, dir_name)
+        if not os.path.isdir(path):
+            continue
+        title, sections = read_report_dir(path)
+        if not any(key in sections for key in SECTION_FILES.values()):
+            continue
+        index_report(dir_name, title or dir_name, sections)
+        indexed += 1
+    return indexed
@@ -0,0 +1,305 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+import subprocess
+from datetime import datetime
+from services import metrics, history, search, cache, jobs
+from services.youtube import DOWNLOAD_DIR_NAME
+
+logger = logging.getLogger(__name__)
+
+# What happens to a report's audio once its analysis is done: "delete" (it is only
+# needed for the Gemini upload), "compress" (re-encode to a small archival copy) or "keep"
+AUDIO_RETENTION = os.getenv("AUDIO_RETENTION", "delete").lower()
+# Reports not produced or downloaded for this many days are deleted (0 keeps them)
+RETENTION_DAYS = float(os.getenv("OUTPUT_RETENTION_DAYS", "90"))
+# Disk quota for the whole output directory; past it, the least-downloaded and
+# then least recently used reports are deleted first (0 disables). This module is
+# the only one that deletes reports; the result cache just forgets them
+QUOTA_BYTES = int(float(os.getenv("OUTPUT_QUOTA_MB", "10240")) * 1024 * 1024)
+# Partial downloads and leftovers of interrupted jobs older than this are deleted
+STALE_HOURS = float(os.getenv("STALE_DOWNLOAD_HOURS", "24"))
+SWEEP_INTERVAL_SECONDS = float(os.getenv("STORAGE_SWEEP_MINUTES", "30")) * 60
+# Reports produced or downloaded this recently are never evicted by the quota
+MIN_AGE_SECONDS = 3600
+
+AUDIO_EXTENSIONS = (".ogg", ".opus", ".aac", ".m4a", ".mp3", ".webm", ".wav")
+ARCHIVED_AUDIO_SUFFIX = ".archive.ogg"
+ARCHIVE_AUDIO_ARGS = ["-c:a", "libopus", "-b:a", "12k", "-ac", "1", "-ar", "16000", "-application", "voip"]
+# Files at the top of the output directory that belong to no report
+SHARED_FILES = ("request_log.md",)
+
+# Download counts per report directory, used to pick what to evict
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_usage (
+    dir_name TEXT PRIMARY KEY,
+    downloads INTEGER NOT NULL DEFAULT 0,
+    last_download REAL
+);
+"""
+
+_output_dir = None
+_last_sweep = {}
+
+
+def init_storage(output_dir: str):
+    global _output_dir
+    _output_dir = output_dir
+    conn = history._connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def record_download(dir_name: str):
+    conn = history._connect()
+    try:
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO report_usage (dir_name, downloads, last_download) VALUES (?, 1, ?)
+                ON CONFLICT(dir_name) DO UPDATE SET downloads = downloads + 1, last_download = excluded.last_download
+                """,
+                (dir_name, time.time()),
+            )
+    finally:
+        conn.close()
+
+
+def _usage() -> dict:
+    conn = history._connect()
+    try:
+        return {dir_name: (downloads, last_download) for dir_name, downloads, last_download in conn.execute(
+            "SELECT dir_name, downloads, last_download FROM report_usage"
+        )}
+    finally:
+        conn.close()
+
+
+def _size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove(path: str, reason: str) -> int:
+    size = _size(path)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+    metrics.inc("storage_freed_bytes_total", size, reason=reason)
+    return size
+
+
+def release_audio(audio_path: str) -> int:
+    """
+    Deletes or compresses a report's audio according to AUDIO_RETENTION once it
+    is no longer needed. Returns the bytes freed.
+    """
+    if AUDIO_RETENTION == "keep" or not os.path.isfile(audio_path) or audio_path.endswith(ARCHIVED_AUDIO_SUFFIX):
+        return 0
+    if AUDIO_RETENTION != "compress":
+        return _remove(audio_path, "audio")
+
+    base = os.path.splitext(audio_path)[0]
+    tmp_path = f"{base}.tmp{ARCHIVED_AUDIO_SUFFIX}"
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", audio_path, "-vn", *ARCHIVE_AUDIO_ARGS, tmp_path]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"Could not compress {audio_path}, keeping it: {getattr(e, 'stderr', e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return 0
+    before = os.path.getsize(audio_path)
+    if os.path.getsize(tmp_path) >= before:
+        # Already smaller than the archival profile (e.g. the speech profile at low bitrates)
+        os.remove(tmp_path)
+        os.replace(audio_path, base + ARCHIVED_AUDIO_SUFFIX)
+        return 0
+    os.replace(tmp_path, base + ARCHIVED_AUDIO_SUFFIX)
+    os.remove(audio_path)
+    freed = before - os.path.getsize(base + ARCHIVED_AUDIO_SUFFIX)
+    metrics.inc("storage_freed_bytes_total", freed, reason="audio")
+    return freed
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+def _is_stale(path: str, now: float) -> bool:
+    try:
+        return now - os.path.getmtime(path) > STALE_HOURS * 3600
+    except OSError:
+        return False
+
+
+def _clean_partials(now: float) -> int:
+    """
+    Deletes abandoned source downloads (.downloads), audio left at the top of the
+    output directory by a job that died before moving it, and render/transcode temp files.
+    """
+    freed = 0
+    partial_dir = os.path.join(_output_dir, DOWNLOAD_DIR_NAME)
+    if os.path.isdir(partial_dir):
+        for name in os.listdir(partial_dir):
+            path = os.path.join(partial_dir, name)
+            if _is_stale(path, now):
+                freed += _remove(path, "partial")
+    for name in os.listdir(_output_dir):
+        path = os.path.join(_output_dir, name)
+        if os.path.isfile(path) and name not in SHARED_FILES and (name.endswith(AUDIO_EXTENSIONS) or ".tmp" in name) and _is_stale(path, now):
+            freed += _remove(path, "partial")
+    return freed
+
+
+def _report_dirs() -> list:
+    return [
+        name for name in os.listdir(_output_dir)
+        if not name.startswith(".") and os.path.isdir(os.path.join(_output_dir, name))
+    ]
+
+
+def sweep(active_dirs=()) -> dict:
+    """
+    One storage pass over the output directory: cleans stale partials, releases
+    audio of finished reports, deletes expired and orphaned reports, enforces the
+    quota, and drops history/search entries whose outputs are gone.
+    `active_dirs` (names of report directories that jobs are still writing) are
+    never touched. Returns a summary; the caller updates the result cache.
+    """
+    now = time.time()
+    active_dirs = set(active_dirs)
+    report = {"freed_bytes": 0, "expired": [], "evicted": [], "orphaned": [], "missing": []}
+    report["freed_bytes"] += _clean_partials(now)
+
+    entries = {entry["dir_name"]: entry for entry in history.iter_entries() if entry.get("dir_name")}
+    usage = _usage()
+    candidates = []
+    for dir_name in _report_dirs():
+        if dir_name in active_dirs:
+            continue
+        path = os.path.join(_output_dir, dir_name)
+        try:
+            names = os.listdir(path)
+        except OSError:
+            # Removed while the sweep was running (by hand or by a job)
+            continue
+        # Last written (including lazy renders); the directory's own mtime also
+        # moves when audio is released, so it is not used
+        last_used = max([_mtime(os.path.join(path, name)) for name in names] + [0])
+        if dir_name not in entries and not any(name.endswith((".md", ".txt")) for name in names):
+            # Only audio or chunks, left by a job that failed or was cancelled before
+            # writing its report (an unfinished one would be active)
+            if now - last_used > STALE_HOURS * 3600:
+                report["freed_bytes"] += _remove(path, "orphaned")
+                report["orphaned"].append(dir_name)
+            continue
+        for name in names:
+            if name.endswith(AUDIO_EXTENSIONS):
+                report["freed_bytes"] += release_audio(os.path.join(path, name))
+            elif name.startswith("chunks_") and _is_stale(os.path.join(path, name), now):
+                report["freed_bytes"] += _remove(os.path.join(path, name), "partial")
+        downloads, last_download = usage.get(dir_name, (0, None))
+        last_used = max(last_used, last_download or 0)
+        if RETENTION_DAYS and now - last_used > RETENTION_DAYS * 86400:
+            report["freed_bytes"] += _remove(path, "expired")
+            report["expired"].append(dir_name)
+            continue
+        candidates.append((downloads, last_used, dir_name))
+
+    total = _size(_output_dir)
+    if QUOTA_BYTES and total > QUOTA_BYTES:
+        for downloads, last_used, dir_name in sorted(candidates):
+            if total <= QUOTA_BYTES:
+                break
+            if now - last_used < MIN_AGE_SECONDS:
+                continue
+            freed = _remove(os.path.join(_output_dir, dir_name), "quota")
+            total -= freed
+            report["freed_bytes"] += freed
+            report["evicted"].append(dir_name)
+        if total > QUOTA_BYTES:
+            logger.warning(f"Output directory is over its quota ({total} > {QUOTA_BYTES} bytes) with nothing left to evict")
+
+    # History entries whose directory was removed here or by hand
+    removed = report["expired"] + report["evicted"]
+    report["missing"] = [
+        dir_name for dir_name in entries
+        if dir_name not in removed and dir_name not in active_dirs and not os.path.isdir(os.path.join(_output_dir, dir_name))
+    ]
+    gone = removed + report["missing"]
+    if gone:
+        history.remove_by_dir_names(gone)
+        search.remove_reports(gone)
+        logger.info(f"Removed {len(gone)} reports from storage and history", extra={"reports": gone})
+    _forget_usage([dir_name for dir_name in usage if not os.path.isdir(os.path.join(_output_dir, dir_name))])
+
+    report["total_bytes"] = total
+    return report
+
+
+def _forget_usage(dir_names: list):
+    conn = history._connect()
+    try:
+        with conn:
+            conn.executemany("DELETE FROM report_usage WHERE dir_name = ?", [(name,) for name in dir_names])
+    finally:
+        conn.close()
+
+
+async def sweep_once() -> dict:
+    """
+    Runs a sweep and drops the removed reports from the result cache, both in worker threads.
+    """
+    start = time.perf_counter()
+    report = await asyncio.to_thread(sweep, jobs.active_output_dirs())
+    await asyncio.to_thread(cache.forget, report["expired"] + report["evicted"] + report["missing"])
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    report["finished_at"] = datetime.now().isoformat()
+    _last_sweep.clear()
+    _last_sweep.update(report)
+    return report
+
+
+async def run_sweeper(interval: float = SWEEP_INTERVAL_SECONDS):
+    while True:
+        try:
+            await sweep_once()
+        except Exception as e:
+            logger.warning(f"Storage sweep failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def stats() -> dict:
+    return {
+        "audio_retention": AUDIO_RETENTION,
+        "retention_days": RETENTION_DAYS,
+        "quota_bytes": QUOTA_BYTES,
+        "last_sweep": dict(_last_sweep),
+    }
+
+
+metrics.register_gauge(
+    "storage_bytes",
+    lambda: [({}, _last_sweep["total_bytes"])] if "total_bytes" in _last_sweep else [],
+    "Size of the output directory at the last storage sweep.",
+)
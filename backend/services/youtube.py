@@ -1,123 +1,521 @@
+import logging
 import yt_dlp
 import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+from services import metrics
+from services.log import YtDlpLogger
 
-def download_audio_and_metadata(url: str, output_dir: str, video_id: str):
+logger = logging.getLogger(__name__)
+
+VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+def extract_video_id(url: str):
+    """
+    Returns the canonical 11-character YouTube video ID for a URL, or None.
+    Handles youtu.be links, watch?v= (with extra params such as t= or list=),
+    /shorts/, /embed/, /live/ and /v/ paths.
+    """
+    try:
+        parsed = urlparse(url.strip())
+    except Exception:
+        return None
+
+    host = (parsed.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if host.startswith("m."):
+        host = host[2:]
+
+    candidate = None
+    if host == "youtu.be":
+        candidate = parsed.path.lstrip("/").split("/")[0]
+    elif host in ("youtube.com", "music.youtube.com", "youtube-nocookie.com"):
+        query = parse_qs(parsed.query)
+        if "v" in query:
+            candidate = query["v"][0]
+        else:
+            parts = [p for p in parsed.path.split("/") if p]
+            if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+                candidate = parts[1]
+    elif VIDEO_ID_RE.match(url.strip()):
+        candidate = url.strip()
+
+    if candidate and VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+# Audio-only streams at or above this bitrate (kbps) are good enough for speech
+SPEECH_MIN_ABR = float(os.getenv("AUDIO_MIN_ABR", "48"))
+
+# Transcoding profiles for the audio sent to Gemini.
+# `remux` maps source codecs that are already acceptable to the container they
+# can be stream-copied into (no re-encode) when their bitrate is <= max_remux_abr.
+AUDIO_PROFILES = {
+    "speech": {
+        "codec": "libopus", "ext": "ogg", "bitrate": "24k", "channels": 1, "sample_rate": 16000,
+        "remux": {"opus": "ogg", "mp4a": "aac"}, "max_remux_abr": 64,
+    },
+    "speech_aac": {
+        "codec": "aac", "ext": "aac", "bitrate": "32k", "channels": 1, "sample_rate": 16000,
+        "remux": {"mp4a": "aac"}, "max_remux_abr": 64,
+    },
+    "mp3": {
+        "codec": "libmp3lame", "ext": "mp3", "bitrate": "192k", "channels": None, "sample_rate": None,
+        "remux": {"mp3": "mp3"}, "max_remux_abr": None,
+    },
+}
+DEFAULT_AUDIO_PROFILE = os.getenv("AUDIO_PROFILE", "speech")
+
+def transcode_audio(source_path: str, output_base: str, profile_name: str, source_acodec=None, source_abr=None):
+    """
+    Converts the downloaded file into the audio profile's format.
+    Stream-copies (remux) when the source codec is already acceptable, otherwise
+    re-encodes. Returns (output_path, stats).
+    """
+    if profile_name not in AUDIO_PROFILES:
+        raise Exception(f"Unknown audio profile '{profile_name}'. Available: {', '.join(AUDIO_PROFILES)}")
+    profile = AUDIO_PROFILES[profile_name]
+
+    codec_family = (source_acodec or "").split(".")[0].lower()
+    remux_ext = profile["remux"].get(codec_family)
+    max_abr = profile["max_remux_abr"]
+    can_remux = remux_ext is not None and (max_abr is None or (source_abr is not None and source_abr <= max_abr))
+
+    output_path = f"{output_base}.{remux_ext if can_remux else profile['ext']}"
+    tmp_path = f"{output_base}.tmp.{remux_ext if can_remux else profile['ext']}"
+
+    # bitexact keeps container serials deterministic, so re-downloads of the same
+    # video hash identically (see services/gemini_files.py)
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", source_path, "-vn", "-fflags", "+bitexact"]
+    if can_remux:
+        cmd += ["-c:a", "copy"]
+    else:
+        cmd += ["-c:a", profile["codec"], "-b:a", profile["bitrate"]]
+        if profile["channels"]:
+            cmd += ["-ac", str(profile["channels"])]
+        if profile["sample_rate"]:
+            cmd += ["-ar", str(profile["sample_rate"])]
+    cmd.append(tmp_path)
+
+    start = time.perf_counter()
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise Exception(f"FFmpeg audio conversion failed: {e.stderr.strip()[-500:]}")
+    elapsed = time.perf_counter() - start
+
+    input_bytes = os.path.getsize(source_path)
+    os.replace(tmp_path, output_path)
+    if os.path.abspath(source_path) != os.path.abspath(output_path):
+        os.remove(source_path)
+
+    stats = {
+        "profile": profile_name,
+        "mode": "remux" if can_remux else "transcode",
+        "source_codec": source_acodec,
+        "seconds": round(elapsed, 2),
+        "input_bytes": input_bytes,
+        "output_bytes": os.path.getsize(output_path),
+    }
+    logger.debug(f"Audio {stats['mode']} ({profile_name}) took {stats['seconds']}s: {input_bytes} -> {stats['output_bytes']} bytes")
+    return output_path, stats
+
+def _estimated_size(fmt: dict, duration):
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    bitrate = fmt.get('abr') or fmt.get('tbr')
+    if bitrate and duration:
+        return bitrate * 1000 / 8 * duration
+    return float('inf')
+
+def select_audio_format(formats: list, duration=None):
+    """
+    Picks the cheapest format that still carries usable speech audio.
+    Returns (format_selector, kind) where kind is 'audio' or 'muxed'.
+
+    Preference order:
+      1. Smallest audio-only stream with abr >= SPEECH_MIN_ABR (or unknown abr).
+      2. Highest-bitrate audio-only stream below the threshold.
+      3. Smallest muxed video+audio stream.
+    The selector always ends with yt-dlp fallbacks so a stale pick cannot fail the job.
+    """
+    usable = [f for f in formats if f.get('acodec') not in (None, 'none') and f.get('protocol') != 'mhtml']
+    audio_only = [f for f in usable if f.get('vcodec') == 'none']
+    muxed = [f for f in usable if f.get('vcodec') not in (None, 'none')]
+
+    good_enough = [f for f in audio_only if (f.get('abr') or SPEECH_MIN_ABR) >= SPEECH_MIN_ABR]
+    if good_enough:
+        chosen = min(good_enough, key=lambda f: _estimated_size(f, duration))
+        return f"{chosen['format_id']}/bestaudio/best", 'audio'
+    if audio_only:
+        chosen = max(audio_only, key=lambda f: f.get('abr') or 0)
+        return f"{chosen['format_id']}/bestaudio/best", 'audio'
+    if muxed:
+        chosen = min(muxed, key=lambda f: _estimated_size(f, duration))
+        return f"{chosen['format_id']}/best", 'muxed'
+    return 'bestaudio/best', 'audio'
+
+# Source downloads (and their .part files) are named after the video ID and
+# format rather than the job, so a retried or restarted job resumes the partial file
+DOWNLOAD_DIR_NAME = ".downloads"
+# Fragments fetched in parallel for DASH/HLS formats (and aria2c connections)
+FRAGMENT_CONCURRENCY = int(os.getenv("DOWNLOAD_FRAGMENT_CONCURRENCY", "4"))
+# Bandwidth cap per download, e.g. "2M" (bytes/s; empty = unlimited)
+RATE_LIMIT = os.getenv("DOWNLOAD_RATE_LIMIT", "")
+# Use aria2c (if installed) for parallel range requests on single-file formats
+USE_ARIA2C = os.getenv("DOWNLOAD_USE_ARIA2C", "false").lower() == "true"
+
+# One download per video at a time, so two jobs never write the same partial file
+_download_locks = {}  # key -> [lock, holders and waiters]
+_download_locks_guard = threading.Lock()
+
+@contextmanager
+def _download_lock(key: str):
+    """Holds the video's download lock; the entry is dropped once nobody uses it."""
+    with _download_locks_guard:
+        entry = _download_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _download_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _download_locks[key]
+
+def _partial_bytes(partial_dir: str, source_id: str) -> int:
+    if not source_id or not os.path.isdir(partial_dir):
+        return 0
+    return sum(
+        os.path.getsize(os.path.join(partial_dir, name)) for name in os.listdir(partial_dir)
+        if name.startswith(f"{source_id}.") and ".part" in name
+    )
+
+def _base_opts(output_dir: str, po_token=None) -> dict:
+    # No yt-dlp postprocessors: audio conversion is done by transcode_audio()
+    opts = {
+        'outtmpl': f'{output_dir}/{DOWNLOAD_DIR_NAME}/%(id)s.%(format_id)s.%(ext)s',
+        # watch?v=<id>&list=... (including the RD mix links YouTube adds) means the video
+        'noplaylist': True,
+        'continuedl': True,
+        'concurrent_fragment_downloads': FRAGMENT_CONCURRENCY,
+        # yt-dlp output goes through logging; verbose only when debugging
+        'logger': YtDlpLogger(),
+        'noprogress': True,
+        'verbose': logger.isEnabledFor(logging.DEBUG),
+    }
+    rate_limit = yt_dlp.utils.parse_bytes(RATE_LIMIT) if RATE_LIMIT else None
+    if rate_limit:
+        opts['ratelimit'] = rate_limit
+    if USE_ARIA2C and shutil.which("aria2c"):
+        # Only plain HTTP(S) formats; fragmented formats keep the native downloader
+        opts['external_downloader'] = {'http': 'aria2c'}
+        aria2c_args = ['-x', str(FRAGMENT_CONCURRENCY), '-s', str(FRAGMENT_CONCURRENCY), '-k', '1M', '--continue=true']
+        if rate_limit:
+            aria2c_args.append(f'--max-download-limit={rate_limit}')
+        opts['external_downloader_args'] = {'aria2c': aria2c_args}
+    if po_token:
+        opts['extractor_args'] = {'youtube': {'po_token': [po_token]}}
+    return opts
+
+def _download_with_info(opts: dict, info: dict, url: str, download_stats: dict, output_dir: str, video_id: str, profile: str, on_event=None) -> dict:
+    """
+    Downloads using an already-extracted info dict (no second metadata request
+    when `info` is provided), converts the audio with the given profile and
+    returns the video metadata.
+    """
+    last_percent = [-1]
+
+    def progress_hook(d):
+        if d.get('status') == 'finished':
+            finished_bytes = d.get('downloaded_bytes') or d.get('total_bytes') or 0
+            download_stats['bytes_downloaded'] += finished_bytes
+            metrics.inc("bytes_downloaded_total", finished_bytes)
+        elif d.get('status') == 'downloading' and on_event:
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            downloaded = d.get('downloaded_bytes') or 0
+            percent = int(downloaded * 100 / total) if total else None
+            # Only report whole-percent changes to keep the event stream small
+            if percent is not None and percent != last_percent[0]:
+                last_percent[0] = percent
+                on_event("download", {"percent": percent, "downloaded_bytes": downloaded, "total_bytes": total})
+
+    # Bytes already on disk from an interrupted attempt, picked up by continuedl
+    download_stats['resumable_bytes'] = _partial_bytes(os.path.join(output_dir, DOWNLOAD_DIR_NAME), (info or {}).get('id') or extract_video_id(url))
+
+    opts = dict(opts, progress_hooks=[progress_hook])
+    with metrics.span("download"), yt_dlp.YoutubeDL(opts) as ydl:
+        if info is not None:
+            info = ydl.process_ie_result(info, download=True)
+        else:
+            info = ydl.extract_info(url, download=True)
+        filename = ydl.prepare_filename(info)
+
+    requested = info.get('requested_downloads') or [info]
+    download_stats['format_id'] = "+".join(str(r.get('format_id')) for r in requested)
+    download_stats['source_ext'] = requested[0].get('ext')
+
+    source_path = requested[0].get('filepath') or filename
+    if on_event:
+        on_event("transcode", {"profile": profile})
+    with metrics.span("transcode", profile=profile):
+        audio_filename, transcode_stats = transcode_audio(
+            source_path,
+            os.path.join(output_dir, video_id),
+            profile,
+            source_acodec=requested[0].get('acodec') or info.get('acodec'),
+            source_abr=requested[0].get('abr') or info.get('abr'),
+        )
+
+    return {
+        "title": info.get('title', 'Unknown Title'),
+        "upload_date": info.get('upload_date', 'Unknown Date'),
+        "thumbnail": info.get('thumbnail', ''),
+        "audio_path": audio_filename,
+        "description": info.get('description', ''),
+        "duration": info.get('duration'),
+        "webpage_url": info.get('webpage_url', url),
+        "uploader": info.get('uploader', 'Unknown Author'),
+        "download_stats": download_stats,
+        "transcode_stats": transcode_stats,
+    }
+
+# Preflight policies (0 disables a limit)
+MAX_VIDEO_MINUTES = float(os.getenv("MAX_VIDEO_MINUTES", "240"))
+MAX_DOWNLOAD_MB = float(os.getenv("MAX_DOWNLOAD_MB", "0"))
+ALLOW_LIVE = os.getenv("ALLOW_LIVE_STREAMS", "false").lower() == "true"
+BLOCKED_AVAILABILITY = ("private", "premium_only", "subscriber_only", "needs_auth")
+
+# Resolved info dicts, reused by the download. Format URLs expire after a few
+# hours, so entries are kept much shorter than that.
+METADATA_CACHE_TTL_SECONDS = float(os.getenv("METADATA_CACHE_TTL_SECONDS", "1800"))
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "100"))
+_metadata_cache = {}  # video ID (or URL) -> (expires_at, info)
+# fetch_metadata runs in worker threads; this guards _metadata_cache
+_metadata_lock = threading.Lock()
+
+class PreflightError(Exception):
+    """Raised when a video can never be processed (private, too long, live, no audio...)."""
+    pass
+
+def _metadata_key(url: str) -> str:
+    return extract_video_id(url) or url.strip()
+
+def forget_metadata(url: str):
+    with _metadata_lock:
+        _metadata_cache.pop(_metadata_key(url), None)
+
+def fetch_metadata(url: str, po_token: str = None) -> dict:
+    """
+    Resolves the video's info dict (formats included) without downloading,
+    from the cache when possible. yt-dlp errors propagate.
+    """
+    key = _metadata_key(url)
+    with _metadata_lock:
+        cached = _metadata_cache.get(key)
+    if cached and cached[0] > time.time():
+        return cached[1]
+
+    with yt_dlp.YoutubeDL(dict(_base_opts(".", po_token), quiet=True, verbose=False)) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    with _metadata_lock:
+        _metadata_cache.pop(key, None)
+        if info.get('_type') in ('playlist', 'multi_video') and key != url.strip():
+            # Never let a playlist stand in for the video ID it was keyed under
+            return info
+        _metadata_cache[key] = (time.time() + METADATA_CACHE_TTL_SECONDS, info)
+        # Dicts keep insertion order, so the first key is the oldest entry
+        while len(_metadata_cache) > METADATA_CACHE_MAX_ENTRIES:
+            del _metadata_cache[next(iter(_metadata_cache))]
+    return info
+
+def check_policies(info: dict):
+    """
+    Raises PreflightError if the video breaks a configured policy.
+    """
+    if info.get('_type') in ('playlist', 'multi_video'):
+        raise PreflightError("The URL is a playlist; use the batch endpoint.")
+    if not ALLOW_LIVE and (info.get('is_live') or info.get('live_status') in ('is_live', 'is_upcoming')):
+        raise PreflightError("Live streams and upcoming premieres are not supported.")
+    if info.get('availability') in BLOCKED_AVAILABILITY:
+        raise PreflightError(f"Video is not publicly available ({info['availability']}).")
+
+    duration = info.get('duration')
+    if MAX_VIDEO_MINUTES and duration and duration > MAX_VIDEO_MINUTES * 60:
+        raise PreflightError(f"Video is {duration / 60:.0f} min long; the limit is {MAX_VIDEO_MINUTES:.0f} min.")
+
+    formats = info.get('formats') or []
+    if formats and not any(f.get('acodec') not in (None, 'none') for f in formats):
+        raise PreflightError("No format with audio is available for this video.")
+    if MAX_DOWNLOAD_MB and formats:
+        format_id = select_audio_format(formats, duration)[0].split('/')[0]
+        chosen = next((f for f in formats if f.get('format_id') == format_id), None)
+        size = _estimated_size(chosen, duration) if chosen else float('inf')
+        if size != float('inf') and size > MAX_DOWNLOAD_MB * 1024 * 1024:
+            raise PreflightError(f"Smallest usable format is {size / 1024 / 1024:.0f} MB; the limit is {MAX_DOWNLOAD_MB:.0f} MB.")
+
+def preflight(url: str) -> dict:
+    """
+    Resolves metadata once and checks it against the policies, so doomed jobs
+    fail before any download. Returns the info dict for download_audio_and_metadata.
+    """
+    try:
+        with metrics.span("preflight"):
+            info = fetch_metadata(url, os.getenv("YOUTUBE_PO_TOKEN"))
+    except yt_dlp.utils.DownloadError as e:
+        message = str(e).replace("ERROR: ", "", 1)
+        # Permanent extractor errors (private, removed, geo-blocked...) are not worth a download attempt
+        if "Private video" in message or "unavailable" in message.lower() or "not available" in message.lower():
+            raise PreflightError(message)
+        raise
+    check_policies(info)
+    return info
+
+def download_audio_and_metadata(url: str, output_dir: str, video_id: str, profile: str = None, on_event=None, info: dict = None):
     """
     Downloads audio from YouTube video and returns metadata.
+    Formats are probed once (or taken from `info`, e.g. from preflight) and the
+    smallest speech-quality audio-only stream is fetched; muxed video is only
+    downloaded when no audio-only stream exists.
+    The audio is then converted with `profile` (see AUDIO_PROFILES).
+    `on_event(event, data)` receives download progress (called from this thread).
     """
+    profile = profile or DEFAULT_AUDIO_PROFILE
+    if profile not in AUDIO_PROFILES:
+        raise Exception(f"Unknown audio profile '{profile}'. Available: {', '.join(AUDIO_PROFILES)}")
     import shutil
     if not shutil.which("ffmpeg"):
-        print("ERROR: FFmpeg not found in youtube.py check!")
+        logger.error("FFmpeg not found in youtube.py check!")
         raise Exception("FFmpeg not found in system PATH.")
 
     # FORCE NODE.JS VISIBILITY: Update PATH to include common locations
     os.environ["PATH"] += os.pathsep + "/usr/local/bin" + os.pathsep + "/usr/bin"
 
-    print(f"Starting download for URL: {url} to {output_dir}")
-    ydl_opts = {
-        'format': 'best', # CHANGED: Use 'best' (video+audio) to avoid "format not available" errors with bestaudio
-        'outtmpl': f'{output_dir}/{video_id}.%(ext)s',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'quiet': False, # Enable logs
-        'no_warnings': False, # Enable warnings
-        'verbose': True, # FORCE VERBOSE LOGGING
-    }
-    
+    logger.info("Starting download", extra={"url": url, "output_dir": output_dir})
+
     # AGGRESSIVE COOKIE CLEANUP: Delete cookies.txt if it exists to force clean IP run
     if os.path.exists("cookies.txt"):
-        print(f"DEBUG: Found cookies.txt (Size: {os.path.getsize('cookies.txt')} bytes). DELETING IT to force clean run.")
+        logger.debug(f"Found cookies.txt (Size: {os.path.getsize('cookies.txt')} bytes). DELETING IT to force clean run.")
         try:
             os.remove("cookies.txt")
-            print("DEBUG: cookies.txt deleted successfully.")
+            logger.debug("cookies.txt deleted successfully.")
         except Exception as e:
-            print(f"DEBUG: Error deleting cookies.txt: {e}")
+            logger.debug(f"Error deleting cookies.txt: {e}")
             
     # if os.path.exists("cookies.txt"):
     #     print(f"DEBUG: youtube.py found cookies.txt (Size: {os.path.getsize('cookies.txt')} bytes)")
     #     ydl_opts['cookiefile'] = "cookies.txt"
     # else:
-    print("DEBUG: youtube.py running WITHOUT cookies.txt (Clean Mode)")
+    logger.debug("youtube.py running WITHOUT cookies.txt (Clean Mode)")
 
     # Check for PO Token
     po_token = os.getenv("YOUTUBE_PO_TOKEN")
     if po_token:
-        print("DEBUG: Using YOUTUBE_PO_TOKEN")
-        ydl_opts['extractor_args'] = {'youtube': {'po_token': [po_token]}}
+        logger.debug("Using YOUTUBE_PO_TOKEN")
 
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            audio_filename = os.path.splitext(filename)[0] + ".mp3"
-            
-            return {
-                "title": info.get('title', 'Unknown Title'),
-                "upload_date": info.get('upload_date', 'Unknown Date'),
-                "thumbnail": info.get('thumbnail', ''),
-                "audio_path": audio_filename,
-                "description": info.get('description', ''),
-                "webpage_url": info.get('webpage_url', url),
-                "uploader": info.get('uploader', 'Unknown Author')
-            }
+    ydl_opts = _base_opts(output_dir, po_token)
+
+    # Downloads of the same video share their partial file; take turns
+    with _download_lock(extract_video_id(url) or url.strip()):
+        try:
+            # Probe formats once; the same info dict is reused for the download
+            if info is None:
+                info = fetch_metadata(url, po_token)
+
+            format_selector, kind = select_audio_format(info.get('formats', []), info.get('duration'))
+            logger.debug(f"Selected format '{format_selector}' ({kind})")
+            download_stats = {"format_kind": kind, "bytes_downloaded": 0}
+            return _download_with_info(dict(ydl_opts, format=format_selector), info, url, download_stats, output_dir, video_id, profile, on_event)
             
-    except yt_dlp.utils.DownloadError as e:
-        print(f"WARNING: Download failed with primary options. Error: {e}")
-        print("WARNING: Retrying with fallback configuration (Format: best)...")
-        
-        # Fallback: Simple 'best' format (video+audio) and extract audio.
-        # Create a FRESH options dictionary to avoid any pollution
-        fallback_opts = {
-            'format': 'best', # Explicitly request 'best' which is usually available
-            'outtmpl': f'{output_dir}/{video_id}.%(ext)s',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'quiet': False,
-            'verbose': True,
-            'no_warnings': False,
-        }
+        except yt_dlp.utils.DownloadError as e:
+            logger.warning(f"Download failed with primary options. Error: {e}")
+            # The resolved formats may be stale; the fallback extracts afresh
+            forget_metadata(url)
+            logger.warning("Retrying with fallback configuration (Format: best)...")
         
-        if os.path.exists("cookies.txt"):
-             fallback_opts['cookiefile'] = "cookies.txt"
+            # Fallback: Simple 'best' format (video+audio) and extract audio.
+            # Create a FRESH options dictionary to avoid any pollution
+            fallback_opts = dict(_base_opts(output_dir, po_token), format='best')
         
-        # Try PO token again if present
-        if po_token:
-             fallback_opts['extractor_args'] = {'youtube': {'po_token': [po_token]}}
+            if os.path.exists("cookies.txt"):
+                 fallback_opts['cookiefile'] = "cookies.txt"
 
-        try:
-            with yt_dlp.YoutubeDL(fallback_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                audio_filename = os.path.splitext(filename)[0] + ".mp3"
-                
-                return {
-                    "title": info.get('title', 'Unknown Title'),
-                    "upload_date": info.get('upload_date', 'Unknown Date'),
-                    "thumbnail": info.get('thumbnail', ''),
-                    "audio_path": audio_filename,
-                    "description": info.get('description', ''),
-                    "webpage_url": info.get('webpage_url', url),
-                    "uploader": info.get('uploader', 'Unknown Author')
-                }
-        except Exception as retry_error:
-            print(f"ERROR: Fallback download also failed: {retry_error}")
-            
-            # FINAL DEBUG: List available formats to see what's actually there
             try:
-                print("CRITICAL DEBUG: Attempting to list all available formats...")
-                with yt_dlp.YoutubeDL({'cookiefile': 'cookies.txt' if os.path.exists('cookies.txt') else None}) as ydl_debug:
-                    info_debug = ydl_debug.extract_info(url, download=False)
-                    formats = info_debug.get('formats', [])
-                    print(f"FOUND {len(formats)} FORMATS:")
-                    for f in formats:
-                        print(f" - ID: {f.get('format_id')} | Ext: {f.get('ext')} | Note: {f.get('format_note')}")
-            except Exception as debug_e:
-                print(f"CRITICAL DEBUG FAILED: {debug_e}")
-
-            raise e
+                download_stats = {"format_kind": "muxed", "bytes_downloaded": 0}
+                return _download_with_info(fallback_opts, None, url, download_stats, output_dir, video_id, profile, on_event)
+            except Exception as retry_error:
+                logger.error(f"Fallback download also failed: {retry_error}")
+            
+                # FINAL DEBUG: List the formats from the probe to see what's actually there
+                if info is not None:
+                    formats = info.get('formats', [])
+                    logger.error(f"Found {len(formats)} formats", extra={
+                        "formats": [f"{f.get('format_id')}|{f.get('ext')}|{f.get('format_note')}" for f in formats],
+                    })
+
+                raise e
+
+def _flat_entries(info: dict, ydl, expand_tabs: bool = True) -> list:
+    """
+    Walks a flat playlist result. Channel pages list their tabs (Videos, Shorts,
+    Live) as nested playlists, which are expanded once with another flat request.
+    """
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return [info]
+    entries = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        if entry.get('_type') == 'playlist':
+            entries.extend(_flat_entries(entry, ydl, expand_tabs))
+        elif entry.get('ie_key') == 'YoutubeTab':
+            if expand_tabs:
+                entries.extend(_flat_entries(ydl.extract_info(entry['url'], download=False), ydl, False))
+        else:
+            entries.append(entry)
+    return entries
+
+def expand_urls(urls: list, max_items: int = None) -> list:
+    """
+    Expands playlist/channel URLs into their videos with a flat metadata
+    extraction (one request per playlist, nothing per video). Plain video URLs
+    pass through. Returns [{"url", "video_id", "title"}] without duplicates.
+    """
+    opts = {'extract_flat': 'in_playlist', 'skip_download': True, 'quiet': True, 'no_warnings': True}
+    po_token = os.getenv("YOUTUBE_PO_TOKEN")
+    if po_token:
+        opts['extractor_args'] = {'youtube': {'po_token': [po_token]}}
+
+    items = []
+    seen = set()
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        for url in urls:
+            video_id = extract_video_id(url)
+            if video_id and 'list=' not in url:
+                entries = [{'id': video_id, 'url': url, 'title': None}]
+            else:
+                entries = _flat_entries(ydl.extract_info(url, download=False), ydl)
+            for entry in entries:
+                entry_url = entry.get('webpage_url') or entry.get('url') or ''
+                entry_id = extract_video_id(entry_url) or (entry.get('id') if VIDEO_ID_RE.match(entry.get('id') or '') else None)
+                if entry_id:
+                    entry_url = f"https://www.youtube.com/watch?v={entry_id}"
+                key = entry_id or entry_url
+                if not entry_url or key in seen:
+                    continue
+                seen.add(key)
+                items.append({"url": entry_url, "video_id": entry_id, "title": entry.get('title')})
+                if max_items and len(items) >= max_items:
+                    return items
+    return items
@@ -1,7 +1,9 @@
 import requests
 import json
+import time
 
-url = "http://localhost:8000/analyze"
+base_url = "http://localhost:8000"
+url = f"{base_url}/analyze"
 data = {
     "url": "https://www.youtube.com/watch?v=jNQXAC9IVRw", # Me at the zoo (Short, fast)
     "options": ["summary", "guide", "transcription_orig"]
@@ -9,21 +11,33 @@ data = {
 
 try:
     print(f"Sending POST request to {url}...")
-    response = requests.post(url, json=data, timeout=120) # Increased timeout for analysis
+    response = requests.post(url, json=data, timeout=30)
     print(f"Status Code: {response.status_code}")
-    
-    if response.status_code == 200:
-        result = response.json()
-        print("Analysis success!")
-        print(json.dumps(result, indent=2))
-        
-        # Test download of the PDF Guide if available
-        if "guide_pdf" in result["files"]:
-            dl_url = f"http://localhost:8000{result['files']['guide_pdf']}"
-            print(f"Testing download: {dl_url}")
-            dl_res = requests.get(dl_url)
-            print(f"Download Status: {dl_res.status_code}")
-            print(f"File Size: {len(dl_res.content)} bytes")
+
+    if response.status_code == 202:
+        # The job runs in the background; poll it until it finishes
+        job = response.json()
+        print(f"Job {job['id']} queued, polling...")
+        deadline = time.time() + 600
+        while job["status"] not in ("completed", "failed", "cancelled") and time.time() < deadline:
+            time.sleep(2)
+            job = requests.get(f"{base_url}/jobs/{job['id']}", timeout=30).json()
+            print(f"  status: {job['status']} stage: {job.get('stage')}")
+
+        if job["status"] == "completed":
+            result = job["result"]
+            print("Analysis success!")
+            print(json.dumps(result, indent=2))
+
+            # Test download of the PDF Guide if available
+            if "guide_pdf" in result["files"]:
+                dl_url = f"{base_url}{result['files']['guide_pdf']}"
+                print(f"Testing download: {dl_url}")
+                dl_res = requests.get(dl_url)
+                print(f"Download Status: {dl_res.status_code}")
+                print(f"File Size: {len(dl_res.content)} bytes")
+        else:
+            print(f"Job did not complete: {job['status']} {job.get('error')}")
     else:
         print(f"Response: {response.text}")
 
@@ -1,12 +1,13 @@
 import sys
 import os
+import time
 import asyncio
-from fastapi import HTTPException
 
 # Add backend directory to sys.path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from main import app, health_check, analyze_video, AnalyzeRequest
+from main import app, health_check, lifespan
+from services import jobs
 
 def test_health_metrics():
     print("\n[Testing health_check logic]...")
@@ -21,21 +22,28 @@ def test_health_metrics():
         print(f"FAIL: health_check error. {e}")
 
 async def test_download_error_logic():
-    print("\n[Testing analyze_video error logic]...")
+    print("\n[Testing pipeline error logic]...")
     # Invalid URL to trigger yt-dlp error
-    req = AnalyzeRequest(url="https://www.youtube.com/watch?v=INVALID_VIDEO_ID_12345", options=["summary"])
-    
-    try:
-        await analyze_video(req, None)
-        print("FAIL: Should have raised HTTPException")
-    except HTTPException as e:
-        print(f"Caught expected HTTPException: {e.detail}")
-        if e.status_code == 500 and "Download failed" in e.detail:
-            print("PASS: Correctly caught download error.")
-        else:
-            print(f"FAIL: Unexpected error details: {e.detail}")
-    except Exception as e:
-        print(f"FAIL: Unexpected exception type: {type(e)}")
+    request = {"url": "https://www.youtube.com/watch?v=INVALID_VIDEO_ID_12345", "options": ["summary"]}
+
+    # The lifespan starts the stage workers the job runs on
+    async with lifespan(app):
+        job = await jobs.enqueue_job(request)
+        deadline = time.time() + 300
+        while job["status"] not in jobs.FINISHED_STATUSES and time.time() < deadline:
+            await asyncio.sleep(1)
+
+    error = job.get("error") or ""
+    if job["status"] != "failed":
+        print(f"FAIL: Should have failed, ended as {job['status']}")
+    # Preflight rejects unavailable videos before the download; without network
+    # access preflight is inconclusive and the download stage fails instead
+    elif error.startswith("Rejected:"):
+        print("PASS: Correctly rejected in preflight.")
+    elif error.startswith("Download failed"):
+        print("PASS: Correctly caught download error.")
+    else:
+        print(f"FAIL: Unexpected error details: {error}")
 
 if __name__ == "__main__":
     test_health_metrics()
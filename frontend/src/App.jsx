@@ -12,6 +12,7 @@ function App() {
   const [darkMode, setDarkMode] = useState(false)
   const [historyOpen, setHistoryOpen] = useState(false)
   const [loading, setLoading] = useState(false)
+  const [progress, setProgress] = useState('')
   const [results, setResults] = useState(null)
   const [history, setHistory] = useState([])
 
@@ -33,22 +34,87 @@ function App() {
     try {
       const apiUrl = import.meta.env.VITE_API_URL || '';
       const res = await axios.get(`${apiUrl}/history`)
-      setHistory(res.data)
+      setHistory(res.data.items)
     } catch (e) {
       console.error("Failed to fetch history", e)
     }
   }
 
+  // Follows a job through its Server-Sent Events stream, showing partial results
+  // (metadata, then each document) as they arrive. Resolves with the final job.
+  const streamJob = (apiUrl, job) => new Promise((resolve, reject) => {
+    const source = new EventSource(`${apiUrl}/jobs/${job.id}/events`)
+    const stageLabels = { preflight: 'Checking video...', download: 'Downloading audio...', analysis: 'Analyzing with AI...', documents: 'Generating documents...' }
+
+    source.addEventListener('status', (e) => {
+      const data = JSON.parse(e.data)
+      if (['completed', 'failed', 'cancelled'].includes(data.status)) {
+        source.close()
+        resolve({ ...job, ...data })
+      } else if (data.status === 'queued') {
+        setProgress('Waiting in queue...')
+      } else if (stageLabels[data.stage]) {
+        setProgress(stageLabels[data.stage])
+      }
+    })
+    source.addEventListener('download', (e) => {
+      setProgress(`Downloading audio... ${JSON.parse(e.data).percent}%`)
+    })
+    source.addEventListener('gemini', (e) => {
+      const { state } = JSON.parse(e.data)
+      setProgress(state === 'ACTIVE' ? 'Generating analysis...' : `Uploading to AI (${state.toLowerCase()})...`)
+    })
+    source.addEventListener('section', (e) => {
+      setProgress(`Received section: ${JSON.parse(e.data).name}`)
+    })
+    source.addEventListener('metadata', (e) => {
+      setResults({ ...JSON.parse(e.data), files: {} })
+    })
+    source.addEventListener('file', (e) => {
+      const { key, url } = JSON.parse(e.data)
+      setResults(prev => prev ? { ...prev, files: { ...prev.files, [key]: url } } : prev)
+    })
+    source.onerror = () => {
+      source.close()
+      reject(new Error('event stream unavailable'))
+    }
+  })
+
+  // Fallback when the event stream is unavailable: poll the job until it finishes
+  const pollJob = async (apiUrl, job) => {
+    while (job.status === 'queued' || job.status === 'running') {
+      await new Promise(resolve => setTimeout(resolve, 2000))
+      const jobRes = await axios.get(`${apiUrl}/jobs/${job.id}`)
+      job = jobRes.data
+    }
+    return job
+  }
+
   const handleAnalyze = async (url, options) => {
     setLoading(true)
     setResults(null)
+    setProgress('')
     try {
       const apiUrl = import.meta.env.VITE_API_URL || '';
       const res = await axios.post(`${apiUrl}/analyze`, {
         url,
         options
       })
-      setResults(res.data)
+
+      // The backend queues the analysis; follow the job until it finishes
+      let job = res.data
+      if (job.status === 'queued' || job.status === 'running') {
+        try {
+          job = await streamJob(apiUrl, job)
+        } catch (streamError) {
+          job = await pollJob(apiUrl, job)
+        }
+      }
+      if (job.status === 'failed' || job.status === 'cancelled') {
+        throw new Error(job.error || `Analysis ${job.status}`)
+      }
+
+      setResults(job.result)
       fetchHistory() // Refresh history
     } catch (error) {
       console.error(error)
@@ -66,6 +132,7 @@ function App() {
       alert(errorMessage)
     } finally {
       setLoading(false)
+      setProgress('')
     }
   }
 
@@ -136,7 +203,7 @@ function App() {
         <div className="bg-white dark:bg-slate-800 rounded-3xl shadow-xl shadow-slate-200/50 dark:shadow-black/50 overflow-hidden border border-slate-100 dark:border-slate-700 mb-12">
           <div className="p-1 bg-gradient-to-r from-primary-500 to-purple-500 opacity-80" />
           <div className="p-8 md:p-10">
-            <InputSection onAnalyze={handleAnalyze} loading={loading} />
+            <InputSection onAnalyze={handleAnalyze} loading={loading} progress={progress} />
           </div>
         </div>
 
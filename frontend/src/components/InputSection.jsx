@@ -2,7 +2,7 @@ import React, { useState } from 'react'
 import { Youtube, Loader2, ArrowRight } from 'lucide-react'
 import Controls from './Controls'
 
-function InputSection({ onAnalyze, loading }) {
+function InputSection({ onAnalyze, loading, progress }) {
     const [url, setUrl] = useState('')
     const [options, setOptions] = useState(['summary', 'guide']) // defaults
 
@@ -37,7 +37,7 @@ function InputSection({ onAnalyze, loading }) {
             >
                 {loading ? (
                     <>
-                        <Loader2 className="animate-spin" /> Analyzing Video...
+                        <Loader2 className="animate-spin" /> {progress || 'Analyzing Video...'}
                     </>
                 ) : (
                     <>
@@ -1,9 +1,11 @@
 import React from 'react'
-import { Download, FileText, File, Video, BookOpen } from 'lucide-react'
+import { Download, FileText, File, Video, BookOpen, Archive } from 'lucide-react'
 
 function Results({ data }) {
     if (!data) return null
 
+    const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000'
+
     return (
         <div className="bg-white dark:bg-slate-800 p-8 rounded-3xl shadow-xl shadow-slate-200/50 dark:shadow-black/50 border border-slate-100 dark:border-slate-700">
             <div className="flex flex-col md:flex-row gap-6 mb-8 border-b border-gray-100 dark:border-slate-700 pb-8">
@@ -17,9 +19,21 @@ function Results({ data }) {
                 </div>
             </div>
 
-            <h4 className="font-bold text-lg text-slate-800 dark:text-slate-200 mb-4 flex items-center gap-2">
-                <FileText size={20} className="text-primary-500" /> Generated Documents
-            </h4>
+            <div className="flex items-center justify-between gap-4 mb-4">
+                <h4 className="font-bold text-lg text-slate-800 dark:text-slate-200 flex items-center gap-2">
+                    <FileText size={20} className="text-primary-500" /> Generated Documents
+                </h4>
+                {/* One streamed ZIP with every file; only once the job has finished */}
+                {data.id && Object.keys(data.files).length > 0 && (
+                    <a
+                        href={`${apiUrl}/jobs/${data.id}/archive`}
+                        download
+                        className="flex items-center gap-2 px-4 py-2 rounded-xl text-sm font-semibold bg-primary-500 text-white hover:bg-primary-600 transition-colors shadow-md"
+                    >
+                        <Archive size={16} /> Download all
+                    </a>
+                )}
+            </div>
 
             <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4">
                 {Object.entries(data.files).map(([key, path]) => {
@@ -37,7 +51,7 @@ function Results({ data }) {
                     return (
                         <a
                             key={key}
-                            href={`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}${path}`}
+                            href={`${apiUrl}${path}`}
                             target="_blank"
                             download
                             className={`flex items-center gap-4 p-4 rounded-xl border border-gray-100 dark:border-slate-700 bg-gray-50 dark:bg-slate-800/50 transition-all hover:shadow-md ${hoverColor} group`}